@@ -1,69 +1,263 @@
-import sqlite3
-from datetime import datetime
+import argparse
+import bisect
+import time
+from datetime import date, timedelta
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QMessageBox, QTabWidget, QFormLayout, QTableWidget, QTableWidgetItem, QComboBox,
     QHBoxLayout, QDialog, QGroupBox, QGridLayout, QDateEdit, QCheckBox, QDialogButtonBox,
-    QHeaderView
+    QHeaderView, QTableView, QFileDialog, QProgressDialog, QCompleter, QListView, QStyledItemDelegate, QStyle,
+    QInputDialog, QDateTimeEdit
 )
-from PyQt5.QtCore import Qt, QDate
-
-# Connect to the SQLite database
-conn = sqlite3.connect("library_pc.db")
-c = conn.cursor()
-
-# Create the necessary tables if they don't exist
-c.execute('''
-    CREATE TABLE IF NOT EXISTS students (
-        student_id INTEGER PRIMARY KEY,
-        name TEXT,
-        course TEXT,
-        contact TEXT
-    )
-''')
-
-c.execute('''
-    CREATE TABLE IF NOT EXISTS computers (
-        pc_id TEXT PRIMARY KEY,
-        student_id INTEGER,
-        status TEXT DEFAULT 'Vacant',
-        FOREIGN KEY (student_id) REFERENCES students(student_id)
-    )
-''')
-
-c.execute('''
-    CREATE TABLE IF NOT EXISTS reservations (
-        student_id INTEGER,
-        pc_id TEXT,
-        entry_time TEXT,
-        exit_time TEXT,
-        FOREIGN KEY (student_id) REFERENCES students(student_id),
-        FOREIGN KEY (pc_id) REFERENCES computers(pc_id)
-    )
-''')
+from PyQt5.QtCore import (
+    Qt, QDate, QDateTime, QAbstractTableModel, QAbstractListModel, QAbstractProxyModel, QModelIndex, QObject, pyqtSignal, QRunnable, QThreadPool,
+    QTimer, QEvent, QSize, QSettings, QEventLoop
+)
+from PyQt5.QtGui import QStandardItem, QStandardItemModel, QColor, QPen
+from library_core import (
+    ALLOCATION_POLICIES, BACKUP_KEEP, HISTORY_WINDOW_ROWS, MAX_SESSION_SECONDS, SESSION_LIMIT_SECONDS,
+    TIME_FORMAT, AssignmentError, BookingError, HistoryColumns, HistoryFilters, Instrumentation, LibraryStore, PcAllocator,
+    PcTakenError, backup_dir_for, clock_time, format_booking_time, local_epoch, parse_timestamp
+)
+
+
+# How long typing has to pause before the student search runs
+SEARCH_DELAY_MS = 150
+
+# Where QSettings keeps the window layout, last tab, column widths and history filters
+SETTINGS_ORGANIZATION = "Library"
+SETTINGS_APPLICATION = "PC Management"
+
+# How often the window ends sessions that ran past the time limit or closing time
+EXPIRY_CHECK_MS = 60 * 1000
+
+# How often the window checks whether another desk or the API changed the database
+WATCH_INTERVAL_MS = 1000
+
+# Occupancy grid tiles, in pixels, and their colors by state
+TILE_SIZE = QSize(84, 56)
+VACANT_COLOR = QColor("#2e7d32")
+ASSIGNED_COLOR = QColor("#1565c0")
+OVERDUE_COLOR = QColor("#c62828")
+
+
+class DataChangeNotifier(QObject):
+    # Emitted after the change has been committed, so each view can patch just the affected rows
+    pc_added = pyqtSignal(str)
+    pc_deleted = pyqtSignal(str)
+    session_opened = pyqtSignal(int, str, str, str)  # student_id, name, pc_id, entry_time
+    session_closed = pyqtSignal(int, str, str, str)  # student_id, pc_id, exit_time, duration
+    # Many sessions closed in one transaction, as a list of session_closed tuples; views
+    # refresh once rather than once per session
+    sessions_closed = pyqtSignal(list)
+    student_added = pyqtSignal(int, str, str, str)  # student_id, name, course, contact
+    pcs_imported = pyqtSignal()
+
+
+class DbTaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class DbTask(QRunnable):
+    def __init__(self, store, function, args):
+        super().__init__()
+        self.setAutoDelete(False)
+
+        self.store = store
+        self.function = function
+        self.args = args
+        self.signals = DbTaskSignals()
+        self.cancelled = False
+        self.conn = None
+
+    def run(self):
+        # Signals even when cancelled, so the runner knows the task is done;
+        # it drops the results of cancelled tasks
+        if self.cancelled:
+            self.signals.finished.emit(None)
+            return
+
+        # Remember which connection is running the query so cancel() can interrupt it
+        self.conn = self.store.conn
+        try:
+            result = self.function(*self.args)
+        except Exception as error:
+            self.signals.failed.emit(str(error))
+            return
+        finally:
+            self.conn = None
+
+        self.signals.finished.emit(result)
+
+    def cancel(self):
+        self.cancelled = True
+        conn = self.conn
+        if conn is not None:
+            conn.interrupt()
+
+
+class DbTaskRunner(QObject):
+    # Runs store calls on worker threads and delivers the results on the GUI thread.
+    # Reads are tagged with a channel; a new read on a channel cancels the one still pending.
+    # Writes go through a single thread so they commit in the order they were made.
+    pending_changed = pyqtSignal(str, bool)
+    failed = pyqtSignal(str)
+
+    def __init__(self, store, read_threads=4):
+        super().__init__()
+
+        self.store = store
+        self.read_pool = QThreadPool()
+        self.read_pool.setMaxThreadCount(read_threads)
+        self.read_pool.setExpiryTimeout(-1)
+        self.write_pool = QThreadPool()
+        self.write_pool.setMaxThreadCount(1)
+        self.write_pool.setExpiryTimeout(-1)
+        self.pending = {}
+        self.running = set()
+
+    def read(self, channel, function, *args, on_result=None):
+        self.cancel(channel)
+        task = self.start(self.read_pool, function, args, on_result, channel)
+        self.pending[channel] = task
+        self.pending_changed.emit(channel, True)
+        return task
+
+    def write(self, function, *args, on_result=None):
+        return self.start(self.write_pool, function, args, on_result, None)
+
+    def cancel(self, channel):
+        task = self.pending.pop(channel, None)
+        if task is not None:
+            task.cancel()
+            self.pending_changed.emit(channel, False)
+
+    def start(self, pool, function, args, on_result, channel):
+        task = DbTask(self.store, function, args)
+        # Reads are timed per channel from request to result on screen, writes per function
+        task.timing = ("view", channel) if channel is not None else ("write", function.__name__)
+        task.started = time.perf_counter()
+        task.signals.finished.connect(lambda result: self.deliver(task, channel, on_result, result))
+        task.signals.failed.connect(lambda message: self.deliver(task, channel, self.failed.emit, message))
+        self.running.add(task)
+        pool.start(task)
+        return task
+
+    def deliver(self, task, channel, callback, result):
+        self.running.discard(task)
+        # A result can already be queued when its task gets cancelled
+        if task.cancelled:
+            return
+        if channel is not None and self.pending.get(channel) is task:
+            del self.pending[channel]
+            self.pending_changed.emit(channel, False)
+        if callback is not None:
+            callback(result)
+        self.store.instrumentation.record(*task.timing, time.perf_counter() - task.started)
+
+    def shutdown(self):
+        for channel in list(self.pending):
+            self.cancel(channel)
+        self.read_pool.waitForDone()
+        self.write_pool.waitForDone()
+
+
+class LoadingLabel(QLabel):
+    def __init__(self, runner, *channels):
+        super().__init__("Loading...")
+
+        self.channels = channels
+        self.hide()
+        runner.pending_changed.connect(self.update_state)
+
+    def update_state(self, channel, pending):
+        if channel in self.channels:
+            self.setVisible(pending)
+
+
+def show_import_result(parent, result):
+    message = f"Imported {result.imported} rows."
+    if result.rejected:
+        message += f"\n\n{len(result.rejected)} rows were rejected:\n"
+        message += "\n".join(f"Line {line}: {reason}" for line, reason in result.rejected[:20])
+        if len(result.rejected) > 20:
+            message += f"\n... and {len(result.rejected) - 20} more"
+    QMessageBox.information(parent, "Import Finished", message)
+
+
+def choose_import_file(parent):
+    path, _ = QFileDialog.getOpenFileName(parent, "Import CSV", "", "CSV files (*.csv)")
+    return path
 
 
 class AssignPcWidget(QWidget):
-    def __init__(self, pc_management_widget, assignment_history_widget):
+    def __init__(self, store, runner, notifier, allocator):
         super().__init__()
 
         self.layout = QVBoxLayout()
-        self.pc_management_widget = pc_management_widget
-        self.assignment_history_widget=assignment_history_widget
+        self.store = store
+        self.runner = runner
+        self.notifier = notifier
+        self.allocator = allocator
+        # Student ID -> first item of the open session's row, to find the row again without scanning
+        self.session_items = {}
+        notifier.session_opened.connect(self.add_session_row)
+        notifier.session_closed.connect(self.remove_session_row)
+        notifier.sessions_closed.connect(lambda closed: self.display_assignment_history())
+
         student_id_input = QLineEdit()
-        student_id_input.setPlaceholderText("Enter Student ID")
+        student_id_input.setPlaceholderText("Enter Student ID, or search by name, contact or course")
+
+        # Matches for what was typed, fetched once typing pauses; picking one fills in the student ID
+        self.search_model = QStandardItemModel(self)
+        self.search_completer = QCompleter(self.search_model, self)
+        self.search_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.search_completer.setCompletionRole(Qt.UserRole)
+        student_id_input.setCompleter(self.search_completer)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(lambda: self.search_students(student_id_input.text()))
+        student_id_input.textEdited.connect(self.search_text_edited)
+        # Enter assigns straight away, so in an auto-assign mode a check-in is one keystroke
+        student_id_input.returnPressed.connect(lambda: self.validate_student_and_show_assign_pc_popup(student_id_input))
         self.layout.addWidget(student_id_input)
 
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(QLabel("Assign Mode:"))
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItem("Choose PC", None)
+        for policy, title in ALLOCATION_POLICIES.items():
+            self.mode_combo.addItem(f"Auto: {title}", policy)
+        mode_layout.addWidget(self.mode_combo)
+        self.layout.addLayout(mode_layout)
+
         assign_button = QPushButton("Assign PC")
         assign_button.clicked.connect(lambda: self.validate_student_and_show_assign_pc_popup(student_id_input))
         self.layout.addWidget(assign_button)
 
+        self.auto_assign_label = QLabel()
+        self.layout.addWidget(self.auto_assign_label)
+
+        self.layout.addWidget(LoadingLabel(runner, "active sessions", "student lookup"))
+
         self.assignment_table = QTableWidget()
         self.assignment_table.setColumnCount(4)
         self.assignment_table.setHorizontalHeaderLabels(["Student ID", "PC ID", "Assign Time", "Unassign"])
         self.assignment_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.assignment_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.layout.addWidget(self.assignment_table)
 
+        release_layout = QHBoxLayout()
+        release_selected_button = QPushButton("Release Selected")
+        release_selected_button.clicked.connect(self.release_selected)
+        release_layout.addWidget(release_selected_button)
+        release_all_button = QPushButton("Release All")
+        release_all_button.clicked.connect(self.release_all)
+        release_layout.addWidget(release_all_button)
+        self.layout.addLayout(release_layout)
+
         self.setLayout(self.layout)
 
         # Display assignment history
@@ -72,96 +266,158 @@ class AssignPcWidget(QWidget):
     def validate_student_and_show_assign_pc_popup(self,student_id_input):
         student_id = student_id_input.text()
 
-        # Check if the student ID exists in the students table
-        c.execute("SELECT * FROM students WHERE student_id = ?", (student_id,))
-        student = c.fetchone()
+        policy = self.mode_combo.currentData()
+        if policy is not None:
+            self.runner.write(self.auto_assign, student_id, policy, on_result=self.auto_assigned)
+            student_id_input.clear()
+            return
+
+        # Check if the student ID exists in the students table, and fetch the PCs they can have with it
+        self.runner.read("student lookup", self.lookup_student, student_id, on_result=self.show_assign_pc_popup)
+
+    def search_text_edited(self, text):
+        self.search_model.clear()
+        self.search_timer.start()
+
+    def search_students(self, text):
+        self.runner.read("student search", self.store.search_students, text, on_result=self.show_search_matches)
+
+    def show_search_matches(self, matches):
+        self.search_model.clear()
+        for match in matches:
+            item = QStandardItem(f"{match.student_id}  {match.name} ({match.course})")
+            item.setData(str(match.student_id), Qt.UserRole)
+            self.search_model.appendRow(item)
+        if matches:
+            self.search_completer.complete()
 
+    def auto_assign(self, student_id, policy):
+        # Returns (session, None), or (None, reason) if the student can't be checked in
+        student = self.store.student(student_id)
         if student is None:
-            QMessageBox.warning(self, "No Match Found", "No matching student found.")
-        else:
-            self.show_assign_pc_popup(student_id)
+            return None, "No matching student found."
+        try:
+            pc_id, entry_time = self.allocator.assign_next(student.student_id, policy)
+        except AssignmentError as error:
+            return None, str(error)
+        return (student.student_id, student.name, pc_id, entry_time), None
+
+    def auto_assigned(self, assigned):
+        session, error = assigned
+        if error is not None:
+            self.auto_assign_label.clear()
+            QMessageBox.warning(self, "Error", error)
+            return
 
+        student_id, name, pc_id, entry_time = session
+        self.auto_assign_label.setText(f"{name} ({student_id}) -> {pc_id}")
+        self.notifier.session_opened.emit(*session)
+
+    def show_assign_pc_popup(self, lookup):
+        student, vacant_pcs = lookup
+        if student is None:
+            QMessageBox.warning(self, "No Match Found", "No matching student found.")
+            return
 
-    def show_assign_pc_popup(self, student_id):
-        popup = AssignPcPopup(student_id, self.get_vacant_pcs(), self.pc_management_widget, self.assignment_history_widget)
-        if popup.exec_() == QDialog.Accepted:
-            self.display_assignment_history()
+        popup = AssignPcPopup(self.store, self.runner, student, vacant_pcs, self.notifier, self.allocator)
+        popup.exec_()
 
-    def get_vacant_pcs(self):
-        c.execute("SELECT pc_id FROM computers WHERE status = 'Vacant'")
-        vacant_pcs = c.fetchall()
-        return [pc[0] for pc in vacant_pcs]
+    def lookup_student(self, student_id):
+        # Returns the student and the vacant PCs nobody else has booked soon
+        student = self.store.student(student_id)
+        return student, self.allocator.available(student.student_id) if student else []
 
     def display_assignment_history(self):
-        c.execute(
-            "SELECT students.student_id, students.name, computers.pc_id, "
-            "reservations.entry_time, reservations.exit_time "
-            "FROM students "
-            "JOIN reservations ON students.student_id = reservations.student_id "
-            "JOIN computers ON computers.pc_id = reservations.pc_id "
-            "WHERE computers.status != 'Vacant' AND reservations.exit_time IS NULL "
-            "ORDER BY reservations.entry_time ASC"
-        )
-        assignment_data = c.fetchall()
+        self.runner.read("active sessions", self.store.active_sessions, on_result=self.populate_sessions)
 
+    def populate_sessions(self, assignment_data):
+        self.session_items = {}
         self.assignment_table.setRowCount(len(assignment_data))
-        for row, assignment in enumerate(assignment_data):
-            student_id, name, pc_id, entry_time, exit_time = assignment
-            student_item = QTableWidgetItem(str(student_id))
-            student_item.setData(Qt.UserRole, name)
-            pc_item = QTableWidgetItem(pc_id)
-            entry_time_item = QTableWidgetItem(entry_time)
-            unassign_button = QPushButton("Unassign")
-            unassign_button.clicked.connect(lambda checked, student_id=student_id: self.unassign_pc(student_id))
-
-            self.assignment_table.setItem(row, 0, student_item)
-            self.assignment_table.setItem(row, 1, pc_item)
-            self.assignment_table.setItem(row, 2, entry_time_item)
-            self.assignment_table.setCellWidget(row, 3, unassign_button)
+        for row, session in enumerate(assignment_data):
+            self.set_session_row(row, *session)
 
         # self.assignment_table.resizeColumnsToContents()
 
+    def set_session_row(self, row, student_id, name, pc_id, entry_time):
+        student_item = QTableWidgetItem(str(student_id))
+        student_item.setData(Qt.UserRole, name)
+        pc_item = QTableWidgetItem(pc_id)
+        entry_time_item = QTableWidgetItem(entry_time)
+        unassign_button = QPushButton("Unassign")
+        unassign_button.clicked.connect(lambda checked, student_id=student_id: self.unassign_pc(student_id))
+
+        self.assignment_table.setItem(row, 0, student_item)
+        self.assignment_table.setItem(row, 1, pc_item)
+        self.assignment_table.setItem(row, 2, entry_time_item)
+        self.assignment_table.setCellWidget(row, 3, unassign_button)
+        self.session_items[student_id] = student_item
+
+    def add_session_row(self, student_id, name, pc_id, entry_time):
+        # The new session is the most recent one, so it goes at the bottom
+        row = self.assignment_table.rowCount()
+        self.assignment_table.insertRow(row)
+        self.set_session_row(row, student_id, name, pc_id, entry_time)
+
+    def remove_session_row(self, student_id, pc_id, exit_time, duration):
+        student_item = self.session_items.pop(student_id, None)
+        if student_item is not None:
+            self.assignment_table.removeRow(self.assignment_table.row(student_item))
+
     def unassign_pc(self, student_id):
-        c.execute("UPDATE computers SET student_id = NULL, status = 'Vacant' WHERE student_id = ?", (student_id,))
-        c.execute("UPDATE reservations SET exit_time = ? WHERE student_id = ? AND exit_time IS NULL",
-                  (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), student_id))
-        conn.commit()
-        self.display_assignment_history()
-        self.pc_management_widget.display_pcs()
-        self.assignment_history_widget.display_assignment_history() #####################################################
+        self.runner.write(self.store.close_session, student_id,
+                          on_result=lambda closed: self.session_closed(student_id, closed))
+
+    def session_closed(self, student_id, closed):
+        if closed is not None:
+            self.notifier.session_closed.emit(student_id, *closed)
+
+    def release_selected(self):
+        rows = {index.row() for index in self.assignment_table.selectedIndexes()}
+        if not rows:
+            QMessageBox.warning(self, "Error", "Please select the sessions to release.")
+            return
+
+        student_ids = [int(self.assignment_table.item(row, 0).text()) for row in rows]
+        self.runner.write(self.store.close_sessions, student_ids, on_result=self.sessions_released)
+
+    def release_all(self):
+        answer = QMessageBox.question(self, "Release All", "End every open session?")
+        if answer == QMessageBox.Yes:
+            self.runner.write(self.store.close_sessions, on_result=self.sessions_released)
+
+    def sessions_released(self, closed):
+        if closed:
+            self.notifier.sessions_closed.emit(closed)
 
 
 class AssignPcPopup(QDialog):
-    def __init__(self, student_id, vacant_pcs, pc_management_widget,assignment_history_widget):
+    def __init__(self, store, runner, student, vacant_pcs, notifier, allocator):
         super().__init__()
 
         self.setWindowTitle("Assign PC")
-        self.student_id = student_id
-        self.pc_management_widget = pc_management_widget
-        self.assignment_history_widget=assignment_history_widget
+        self.store = store
+        self.runner = runner
+        self.allocator = allocator
+        self.student_id = student.student_id
+        self.notifier = notifier
+        self.name = student.name
         self.layout = QVBoxLayout()
 
         student_info_group = QGroupBox("Student Information")
         student_info_layout = QVBoxLayout()
         student_info_group.setLayout(student_info_layout)
 
-        # Fetch the student details from the database
-        c.execute("SELECT name, course, contact FROM students WHERE student_id = ?", (student_id,))
-        student_data = c.fetchone()
-        if student_data:
-            name, course, contact = student_data
+        student_id_label = QLabel(f"Student ID: {student.student_id}")
+        student_info_layout.addWidget(student_id_label)
 
-            student_id_label = QLabel(f"Student ID: {student_id}")
-            student_info_layout.addWidget(student_id_label)
+        name_label = QLabel(f"Name: {student.name}")
+        student_info_layout.addWidget(name_label)
 
-            name_label = QLabel(f"Name: {name}")
-            student_info_layout.addWidget(name_label)
+        course_label = QLabel(f"Course: {student.course}")
+        student_info_layout.addWidget(course_label)
 
-            course_label = QLabel(f"Course: {course}")
-            student_info_layout.addWidget(course_label)
-
-            contact_label = QLabel(f"Contact: {contact}")
-            student_info_layout.addWidget(contact_label)
+        contact_label = QLabel(f"Contact: {student.contact}")
+        student_info_layout.addWidget(contact_label)
 
         self.layout.addWidget(student_info_group)
 
@@ -174,49 +430,66 @@ class AssignPcPopup(QDialog):
 
         self.layout.addWidget(pc_selection_group)
 
-        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        button_box.accepted.connect(lambda: self.assign_pc(student_id))
-        button_box.rejected.connect(self.reject)
-        self.layout.addWidget(button_box)
+        self.button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.button_box.accepted.connect(lambda: self.assign_pc(self.student_id))
+        self.button_box.rejected.connect(self.reject)
+        self.layout.addWidget(self.button_box)
 
         self.setLayout(self.layout)
 
         # Populate the PC options
+        self.populate_pcs(vacant_pcs)
+
+    def populate_pcs(self, vacant_pcs):
+        self.pc_combo.clear()
         self.pc_combo.addItems(vacant_pcs)
 
     def assign_pc(self,student_id):
         pc_id = self.pc_combo.currentText()
 
-        # Check if the student is already assigned
-        c.execute("SELECT student_id FROM computers WHERE student_id = ?", (student_id,))
-        assigned_student = c.fetchone()
-
-        if assigned_student is not None:
-            QMessageBox.warning(self, "Error", "The Student is already assigned to a PC.")
+        self.button_box.button(QDialogButtonBox.Ok).setEnabled(False)
+        self.runner.write(self.open_session, student_id, pc_id,
+                          on_result=lambda opened: self.session_opened(pc_id, *opened))
+
+    def open_session(self, student_id, pc_id):
+        # Returns (entry_time, None), or (None, reason) if another desk got there first
+        try:
+            return self.store.open_session(student_id, pc_id), None
+        except PcTakenError as error:
+            self.allocator.load()
+            return None, str(error)
+        except AssignmentError as error:
+            return None, str(error)
+
+    def session_opened(self, pc_id, entry_time, error):
+        self.button_box.button(QDialogButtonBox.Ok).setEnabled(True)
+        if error is not None:
+            QMessageBox.warning(self, "Error", error)
+            # The list may be out of date if another desk took the PC
+            self.runner.read("vacant pcs", self.allocator.available, self.student_id, on_result=self.populate_pcs)
             return
 
-        # Update the database with the assignment
-        entry_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.execute("INSERT INTO reservations VALUES (?, ?, ?, NULL)", (self.student_id, pc_id, entry_time))
-        conn.commit()
-
-        # Update PC status to 'Assigned'
-        c.execute("UPDATE computers SET student_id = ?, status = 'Assigned' WHERE pc_id = ?", (self.student_id, pc_id))
-        conn.commit()
-
         QMessageBox.information(self, "PC Assigned", "PC assigned successfully!")
         self.accept()
-        
-        self.pc_management_widget.display_pcs()
-        self.assignment_history_widget.display_assignment_history()
-        
+
+        self.notifier.session_opened.emit(self.student_id, self.name, pc_id, entry_time)
 
 
 class PCManagementWidget(QWidget):
-    def __init__(self):
+    def __init__(self, store, runner, notifier):
         super().__init__()
 
         self.layout = QVBoxLayout()
+        self.store = store
+        self.runner = runner
+        self.notifier = notifier
+        # PC ID -> status item of its row, so a status change touches one cell
+        self.status_items = {}
+        notifier.pc_added.connect(self.add_pc_row)
+        notifier.pc_deleted.connect(self.remove_pc_row)
+        notifier.session_opened.connect(lambda student_id, name, pc_id, entry_time: self.set_pc_status(pc_id, "Assigned"))
+        notifier.session_closed.connect(lambda student_id, pc_id, exit_time, duration: self.set_pc_status(pc_id, "Vacant"))
+        notifier.sessions_closed.connect(self.sessions_closed)
 
         pc_input_layout = QHBoxLayout()
 
@@ -232,7 +505,12 @@ class PCManagementWidget(QWidget):
         delete_button.clicked.connect(lambda: self.delete_pc(pc_id_input.text()))
         pc_input_layout.addWidget(delete_button)
 
+        import_button = QPushButton("Import CSV...")
+        import_button.clicked.connect(self.import_pcs)
+        pc_input_layout.addWidget(import_button)
+
         self.layout.addLayout(pc_input_layout)
+        self.layout.addWidget(LoadingLabel(runner, "pcs"))
 
         self.pc_table = QTableWidget()
         self.pc_table.setColumnCount(2)
@@ -246,72 +524,108 @@ class PCManagementWidget(QWidget):
         self.display_pcs()
 
     def display_pcs(self):
-        c.execute("SELECT pc_id, status FROM computers")
-        pc_data = c.fetchall()
-        print("DIsplaying.........")
+        self.runner.read("pcs", self.store.pcs, on_result=self.populate_pcs)
+
+    def populate_pcs(self, pc_data):
+        self.status_items = {}
         self.pc_table.setRowCount(len(pc_data))
         for row, pc in enumerate(pc_data):
-            pc_id, status = pc
-            pc_item = QTableWidgetItem(pc_id)
-            status_item = QTableWidgetItem(status)
-
-            self.pc_table.setItem(row, 0, pc_item)
-            self.pc_table.setItem(row, 1, status_item)
+            self.set_pc_row(row, pc.pc_id, pc.status)
 
         # self.pc_table.resizeColumnsToContents()
 
+    def set_pc_row(self, row, pc_id, status):
+        pc_item = QTableWidgetItem(pc_id)
+        status_item = QTableWidgetItem(status)
+
+        self.pc_table.setItem(row, 0, pc_item)
+        self.pc_table.setItem(row, 1, status_item)
+        self.status_items[pc_id] = status_item
+
+    def add_pc_row(self, pc_id):
+        row = self.pc_table.rowCount()
+        self.pc_table.insertRow(row)
+        self.set_pc_row(row, pc_id, "Vacant")
+
+    def remove_pc_row(self, pc_id):
+        status_item = self.status_items.pop(pc_id, None)
+        if status_item is not None:
+            self.pc_table.removeRow(self.pc_table.row(status_item))
+
+    def set_pc_status(self, pc_id, status):
+        status_item = self.status_items.get(pc_id)
+        if status_item is not None:
+            status_item.setText(status)
+
+    def sessions_closed(self, closed):
+        for student_id, pc_id, exit_time, duration in closed:
+            self.set_pc_status(pc_id, "Vacant")
+
     def add_pc(self, pc_id):
         if not pc_id:
             QMessageBox.warning(self, "Error", "Please enter a PC ID.")
             return
 
-        # Check if the PC ID already exists
-        c.execute("SELECT pc_id FROM computers WHERE pc_id = ?", (pc_id,))
-        existing_pc = c.fetchone()
-        if existing_pc:
+        # Insert the new PC unless the PC ID already exists
+        self.runner.write(self.store.add_pc, pc_id, on_result=lambda added: self.pc_added(pc_id, added))
+
+    def pc_added(self, pc_id, added):
+        if not added:
             QMessageBox.warning(self, "Error", "PC ID already exists.")
             return
 
-        # Insert the new PC into the database
-        c.execute("INSERT INTO computers (pc_id) VALUES (?)", (pc_id,))
-        conn.commit()
-
         QMessageBox.information(self, "PC Added", "PC added successfully!")
-        self.display_pcs()
+        self.notifier.pc_added.emit(pc_id)
 
     def delete_pc(self, pc_id):
         if not pc_id:
             QMessageBox.warning(self, "Error", "Please enter a PC ID.")
             return
 
+        self.runner.write(self.remove_pc, pc_id, on_result=lambda error: self.pc_deleted(pc_id, error))
+
+    def remove_pc(self, pc_id):
         # Check if the PC ID exists
-        c.execute("SELECT pc_id FROM computers WHERE pc_id = ?", (pc_id,))
-        existing_pc = c.fetchone()
+        existing_pc = self.store.pc(pc_id)
         if not existing_pc:
-            QMessageBox.warning(self, "Error", "PC ID does not exist.")
-            return
+            return "PC ID does not exist."
 
         # Check if the PC is currently assigned
-        c.execute("SELECT student_id FROM computers WHERE pc_id = ?", (pc_id,))
-        pc_status = c.fetchone()[0]
-
-        if pc_status is not None:
-            QMessageBox.warning(self, "Error", "Cannot delete an assigned PC.")
-            return
+        if existing_pc.student_id is not None:
+            return "Cannot delete an assigned PC."
 
         # Delete the PC from the database
-        c.execute("DELETE FROM computers WHERE pc_id = ?", (pc_id,))
-        conn.commit()
+        self.store.delete_pc(pc_id)
+        return None
 
-        QMessageBox.information(self, "PC Deleted", "PC deleted successfully!")
+    def import_pcs(self):
+        path = choose_import_file(self)
+        if path:
+            self.runner.write(self.store.import_pcs, path, on_result=self.pcs_imported)
+
+    def pcs_imported(self, result):
+        show_import_result(self, result)
         self.display_pcs()
+        self.notifier.pcs_imported.emit()
+
+    def pc_deleted(self, pc_id, error):
+        if error is not None:
+            QMessageBox.warning(self, "Error", error)
+            return
+
+        QMessageBox.information(self, "PC Deleted", "PC deleted successfully!")
+        self.notifier.pc_deleted.emit(pc_id)
 
 
 class StudentManagementWidget(QWidget):
-    def __init__(self):
+    def __init__(self, store, runner, notifier):
         super().__init__()
 
         self.layout = QVBoxLayout()
+        self.store = store
+        self.runner = runner
+        self.notifier = notifier
+        notifier.student_added.connect(self.add_student_row)
 
         form_layout = QFormLayout()
         self.student_id_input = QLineEdit()
@@ -336,7 +650,12 @@ class StudentManagementWidget(QWidget):
         add_student_button.clicked.connect(self.add_student)
         form_layout.addRow(add_student_button)
 
+        import_button = QPushButton("Import Students from CSV...")
+        import_button.clicked.connect(self.import_students)
+        form_layout.addRow(import_button)
+
         self.layout.addLayout(form_layout)
+        self.layout.addWidget(LoadingLabel(runner, "students"))
 
         self.students_table = QTableWidget()
         self.students_table.setColumnCount(4)
@@ -350,24 +669,31 @@ class StudentManagementWidget(QWidget):
         self.display_students()
 
     def display_students(self):
-        c.execute("SELECT * FROM students")
-        student_data = c.fetchall()
+        self.runner.read("students", self.store.students, on_result=self.populate_students)
+
+    def populate_students(self, student_data):
 
         self.students_table.setRowCount(len(student_data))
         for row, student in enumerate(student_data):
-            student_id, name, course, contact = student
+            self.set_student_row(row, *student)
 
-            student_id_item = QTableWidgetItem(str(student_id))
-            name_item = QTableWidgetItem(name)
-            course_item = QTableWidgetItem(course)
-            contact_item = QTableWidgetItem(contact)
+        # self.students_table.resizeColumnsToContents()
 
-            self.students_table.setItem(row, 0, student_id_item)
-            self.students_table.setItem(row, 1, name_item)
-            self.students_table.setItem(row, 2, course_item)
-            self.students_table.setItem(row, 3, contact_item)
+    def set_student_row(self, row, student_id, name, course, contact):
+        student_id_item = QTableWidgetItem(str(student_id))
+        name_item = QTableWidgetItem(name)
+        course_item = QTableWidgetItem(course)
+        contact_item = QTableWidgetItem(contact)
 
-        # self.students_table.resizeColumnsToContents()
+        self.students_table.setItem(row, 0, student_id_item)
+        self.students_table.setItem(row, 1, name_item)
+        self.students_table.setItem(row, 2, course_item)
+        self.students_table.setItem(row, 3, contact_item)
+
+    def add_student_row(self, student_id, name, course, contact):
+        row = self.students_table.rowCount()
+        self.students_table.insertRow(row)
+        self.set_student_row(row, student_id, name, course, contact)
 
     def add_student(self):
         student_id = self.student_id_input.text()
@@ -379,18 +705,24 @@ class StudentManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Please enter all fields.")
             return
 
-        # Check if the student ID already exists
-        c.execute("SELECT student_id FROM students WHERE student_id = ?", (student_id,))
-        existing_student = c.fetchone()
-        if existing_student:
+        # Insert the new student unless the student ID already exists
+        self.runner.write(self.store.add_student, student_id, name, course, contact,
+                          on_result=lambda added: self.student_added(added, student_id, name, course, contact))
+
+    def import_students(self):
+        path = choose_import_file(self)
+        if path:
+            self.runner.write(self.store.import_students, path, on_result=self.students_imported)
+
+    def students_imported(self, result):
+        show_import_result(self, result)
+        self.display_students()
+
+    def student_added(self, added, student_id, name, course, contact):
+        if not added:
             QMessageBox.warning(self, "Error", "Student ID already exists.")
             return
 
-        # Insert the new student into the database
-        c.execute("INSERT INTO students (student_id, name, course, contact) VALUES (?, ?, ?, ?)",
-                  (student_id, name, course, contact))
-        conn.commit()
-
         QMessageBox.information(self, "Student Added", "Student added successfully!")
 
         # Clear the input fields
@@ -398,14 +730,643 @@ class StudentManagementWidget(QWidget):
         self.name_input.clear()
         self.contact_input.clear()
 
-        # Refresh student data
-        self.display_students()
+        self.notifier.student_added.emit(int(student_id), name, course, contact)
+
+
+class AssignmentHistoryModel(QAbstractTableModel):
+    # The newest HISTORY_WINDOW_ROWS sessions, or every session matching the filters that
+    # window can't answer, in HistoryColumns. Rows stay in the order they were loaded;
+    # HistoryFilterModel sorts and filters them.
+    headers = ["Student ID", "Name", "PC ID", "Entry Time", "Exit Time", "Duration"]
+
+    def __init__(self, store, runner, notifier):
+        super().__init__()
+
+        self.store = store
+        self.runner = runner
+        self.columns = HistoryColumns()
+        # Entry time of the oldest session in a full window; None once the whole history is loaded
+        self.since = None
+        # The filters the loaded sessions were read with; all None for the window
+        self.filters = HistoryFilters()
+        self.loading = False
+        # Session changes that arrived while loading, replayed onto the new columns
+        self.pending = []
+        notifier.session_opened.connect(self.add_session)
+        notifier.session_closed.connect(self.close_session)
+        notifier.sessions_closed.connect(self.close_sessions)
+
+    def covers(self, filters):
+        # Whether the loaded sessions include every session matching filters. Sessions at the
+        # window's oldest entry time may have been cut off, so that day needs a load of its own.
+        if any(loaded is not None and loaded != wanted for loaded, wanted in zip(self.filters, filters)):
+            return False
+        if self.filters != HistoryFilters() or filters == HistoryFilters():
+            return True
+        if self.loading:
+            return False
+        return self.since is None or (filters.date is not None
+                                      and local_epoch(date.fromisoformat(filters.date)) > self.since)
+
+    def load(self, filters=HistoryFilters()):
+        # Reads the window, or every session matching filters
+        self.filters = filters
+        self.loading = True
+        self.pending = []
+        limit = HISTORY_WINDOW_ROWS if filters == HistoryFilters() else None
+        task = self.runner.read("history", self.store.history_columns, filters, None, limit,
+                                on_result=self.set_columns)
+        task.signals.failed.connect(lambda message: self.set_columns(HistoryColumns()))
+
+    def holds(self, student_id, pc_id, entry_time):
+        # Whether a new session belongs with the loaded ones
+        filters = self.filters
+        return ((filters.date is None or filters.date == date.fromtimestamp(entry_time).isoformat())
+                and (filters.student_id is None or filters.student_id.strip() == str(student_id))
+                and (filters.pc_id is None or filters.pc_id == pc_id))
+
+    def set_columns(self, columns):
+        self.beginResetModel()
+        self.columns = columns
+        window = self.filters == HistoryFilters() and len(columns) >= HISTORY_WINDOW_ROWS
+        self.since = columns.entry_times[-1] if window else None
+        self.loading = False
+        self.endResetModel()
+        pending, self.pending = self.pending, []
+        for function, args in pending:
+            function(*args)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == Qt.DisplayRole:
+            return self.columns.value(index.row(), index.column())
+        if role == Qt.UserRole and index.column() == 0:
+            return self.columns.value(index.row(), 1)
+        return None
+
+    def has_session(self, student_id, entry_time):
+        # Loaded rows are newest first, so only the sessions at least as new are looked at
+        columns = self.columns
+        for row in range(len(columns)):
+            if columns.entry_times[row] < entry_time:
+                return False
+            if columns.entry_times[row] == entry_time and columns.student_ids[row] == student_id:
+                return True
+        return False
+
+    def add_session(self, student_id, name, pc_id, entry_time):
+        if self.loading:
+            self.pending.append((self.add_session, (student_id, name, pc_id, entry_time)))
+            return
+        entry_time = parse_timestamp(entry_time)
+        if not self.holds(student_id, pc_id, entry_time) or self.has_session(student_id, entry_time):
+            return
+
+        row = len(self.columns)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.columns.append(student_id, name, pc_id, entry_time)
+        self.endInsertRows()
+
+    def close_session(self, student_id, pc_id, exit_time, duration):
+        if self.loading:
+            self.pending.append((self.close_session, (student_id, pc_id, exit_time, duration)))
+            return
+        row = self.columns.close(student_id, parse_timestamp(exit_time))
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 4), self.index(row, 5))
+
+    def close_sessions(self, closed):
+        for session in closed:
+            self.close_session(*session)
+
+
+class HistoryFilterModel(QAbstractProxyModel):
+    # Sorts and filters AssignmentHistoryModel in memory, without going back to the database.
+    # The visible source rows are kept in ascending order of the sort column and shown
+    # reversed for a descending sort, so new and closed sessions are placed by bisection.
+
+    def __init__(self, history_model):
+        super().__init__()
+
+        self.history_model = history_model
+        self.rows = []
+        self.filters = HistoryFilters()
+        self.text = ""
+        self.sort_column = 3
+        self.descending = True
+        self.setSourceModel(history_model)
+        history_model.modelReset.connect(self.refresh)
+        history_model.rowsInserted.connect(self.source_rows_inserted)
+        history_model.dataChanged.connect(self.source_data_changed)
+
+    def refresh(self):
+        columns = self.history_model.columns
+        self.beginResetModel()
+        self.rows = columns.sorted_rows(columns.matching(self.filters, self.text), self.sort_column)
+        self.endResetModel()
+
+    def set_filters(self, filters):
+        self.filters = filters
+        self.refresh()
+
+    def set_text(self, text):
+        self.text = text
+        self.refresh()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
+
+    def source_row(self, row):
+        return self.rows[len(self.rows) - 1 - row] if self.descending else self.rows[row]
+
+    def view_row(self, position, count):
+        # The row shown for position in self.rows, when self.rows holds count rows
+        return count - 1 - position if self.descending else position
+
+    def insert_row(self, source_row):
+        key = self.history_model.columns.sort_key(self.sort_column)
+        position = bisect.bisect_right(self.rows, key(source_row), key=key)
+        row = self.view_row(position, len(self.rows) + 1)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.insert(position, source_row)
+        self.endInsertRows()
+
+    def source_rows_inserted(self, parent, first, last):
+        columns = self.history_model.columns
+        for source_row in columns.matching(self.filters, self.text, range(first, last + 1)):
+            self.insert_row(source_row)
+
+    def source_data_changed(self, top_left, bottom_right):
+        for source_row in range(top_left.row(), bottom_right.row() + 1):
+            try:
+                position = self.rows.index(source_row)
+            except ValueError:
+                continue
+            row = self.view_row(position, len(self.rows))
+            if self.sort_column in (4, 5):
+                # Closing a session changes its exit time and duration, so it moves
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.rows[position]
+                self.endRemoveRows()
+                self.insert_row(source_row)
+            else:
+                self.dataChanged.emit(self.index(row, top_left.column()), self.index(row, bottom_right.column()))
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self.history_model.index(self.source_row(index.row()), index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        try:
+            position = self.rows.index(index.row())
+        except ValueError:
+            return QModelIndex()
+        return self.index(self.view_row(position, len(self.rows)), index.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return self.history_model.columnCount(parent)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            return self.history_model.headerData(section, orientation, role)
+        return section + 1 if role == Qt.DisplayRole else None
+
+
+class OccupancyModel(QAbstractListModel):
+    # One row per PC, holding [pc_id, student_id, name, entry_epoch]; the last three are
+    # None while the PC is vacant. Every change touches only the rows it affects.
+    # Emitted when a PC is added, removed, taken or freed, not on every tick
+    counts_changed = pyqtSignal()
+
+    def __init__(self, store, runner, notifier):
+        super().__init__()
+
+        self.store = store
+        self.runner = runner
+        self.tiles = []
+        # PC ID -> row
+        self.rows = {}
+        # PC IDs in use, by the second of the minute their session started. Elapsed time
+        # is shown in minutes, so those tiles change when the clock reaches that second.
+        self.ticks = [set() for _ in range(60)]
+        self.last_tick = int(time.time())
+        notifier.session_opened.connect(
+            lambda student_id, name, pc_id, entry_time: self.set_session(pc_id, student_id, name, parse_timestamp(entry_time)))
+        notifier.session_closed.connect(
+            lambda student_id, pc_id, exit_time, duration: self.set_session(pc_id, None, None, None))
+        notifier.sessions_closed.connect(self.sessions_closed)
+        notifier.pc_added.connect(self.add_pc)
+        notifier.pc_deleted.connect(self.remove_pc)
+        notifier.pcs_imported.connect(self.load)
+
+    def load(self):
+        self.runner.read("occupancy", self.store.occupancy, on_result=self.populate)
+
+    def populate(self, occupancy):
+        self.beginResetModel()
+        self.tiles = [list(pc) for pc in occupancy]
+        self.rows = {tile[0]: row for row, tile in enumerate(self.tiles)}
+        self.ticks = [set() for _ in range(60)]
+        for pc_id, student_id, name, entry_epoch in self.tiles:
+            if entry_epoch is not None:
+                self.ticks[entry_epoch % 60].add(pc_id)
+        self.endResetModel()
+        self.counts_changed.emit()
+
+    def in_use(self):
+        return sum(len(pc_ids) for pc_ids in self.ticks)
+
+    def tile(self, pc_id):
+        row = self.rows.get(pc_id)
+        return None if row is None else self.tiles[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.tiles)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        tile = self.tiles[index.row()]
+        if role == Qt.DisplayRole:
+            return tile[0]
+        if role == Qt.UserRole:
+            return tile
+        if role == Qt.ToolTipRole and tile[1] is not None:
+            return f"{tile[2]} ({tile[1]}) since {time.strftime(TIME_FORMAT, time.localtime(tile[3]))}"
+        return None
+
+    def changed(self, pc_id):
+        index = self.index(self.rows[pc_id])
+        self.dataChanged.emit(index, index)
+
+    def set_session(self, pc_id, student_id, name, entry_epoch):
+        self.update_tile(pc_id, student_id, name, entry_epoch)
+        self.counts_changed.emit()
+
+    def sessions_closed(self, closed):
+        for student_id, pc_id, exit_time, duration in closed:
+            self.update_tile(pc_id, None, None, None)
+        self.counts_changed.emit()
+
+    def update_tile(self, pc_id, student_id, name, entry_epoch):
+        tile = self.tile(pc_id)
+        if tile is None:
+            return
+        if tile[3] is not None:
+            self.ticks[tile[3] % 60].discard(pc_id)
+        tile[1:] = [student_id, name, entry_epoch]
+        if entry_epoch is not None:
+            self.ticks[entry_epoch % 60].add(pc_id)
+        self.changed(pc_id)
+
+    def tick(self):
+        # Repaints the tiles whose elapsed minutes rolled over since the last tick,
+        # catching up on seconds the timer skipped
+        now = int(time.time())
+        for second in range(max(self.last_tick + 1, now - 59), now + 1):
+            for pc_id in self.ticks[second % 60]:
+                self.changed(pc_id)
+        self.last_tick = now
+
+    def add_pc(self, pc_id):
+        row = len(self.tiles)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.tiles.append([pc_id, None, None, None])
+        self.rows[pc_id] = row
+        self.endInsertRows()
+        self.counts_changed.emit()
+
+    def remove_pc(self, pc_id):
+        row = self.rows.get(pc_id)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.tiles[row]
+        self.rows = {tile[0]: row for row, tile in enumerate(self.tiles)}
+        self.endRemoveRows()
+        self.counts_changed.emit()
+
+
+class OccupancyDelegate(QStyledItemDelegate):
+    # Paints each PC as a colored tile and turns clicks on a tile into tile_clicked,
+    # so the grid has no child widgets however many PCs there are
+    tile_clicked = pyqtSignal(str)
+
+    def sizeHint(self, option, index):
+        return TILE_SIZE
+
+    def paint(self, painter, option, index):
+        pc_id, student_id, name, entry_epoch = index.data(Qt.UserRole)
+        if entry_epoch is None:
+            color = VACANT_COLOR
+            text = f"{pc_id}\nVacant"
+        else:
+            elapsed = max(0, int(time.time()) - entry_epoch)
+            color = OVERDUE_COLOR if elapsed >= SESSION_LIMIT_SECONDS else ASSIGNED_COLOR
+            text = f"{pc_id}\n{student_id}\n{elapsed // 3600}:{elapsed // 60 % 60:02d}"
+
+        rect = option.rect.adjusted(2, 2, -2, -2)
+        painter.save()
+        painter.fillRect(rect, color)
+        if option.state & QStyle.State_MouseOver:
+            painter.setPen(QPen(Qt.black, 2))
+            painter.drawRect(rect)
+        painter.setPen(Qt.white)
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            self.tile_clicked.emit(index.data(Qt.DisplayRole))
+            return True
+        return False
+
+
+class OccupancyWidget(QWidget):
+    def __init__(self, store, runner, notifier, allocator):
+        super().__init__()
+
+        self.store = store
+        self.runner = runner
+        self.notifier = notifier
+        self.allocator = allocator
+        self.layout = QVBoxLayout()
+
+        summary_layout = QHBoxLayout()
+        self.summary_label = QLabel()
+        summary_layout.addWidget(self.summary_label)
+        summary_layout.addWidget(QLabel("Click a vacant PC to assign it, or a PC in use to unassign it."))
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.display_occupancy)
+        summary_layout.addWidget(refresh_button)
+        self.layout.addLayout(summary_layout)
+        self.layout.addWidget(LoadingLabel(runner, "occupancy"))
+
+        self.occupancy_model = OccupancyModel(store, runner, notifier)
+        self.occupancy_model.counts_changed.connect(self.update_summary)
+
+        # Uniform sizes let the view place tiles arithmetically instead of asking every index
+        self.occupancy_view = QListView()
+        self.occupancy_view.setViewMode(QListView.IconMode)
+        self.occupancy_view.setResizeMode(QListView.Adjust)
+        self.occupancy_view.setMovement(QListView.Static)
+        self.occupancy_view.setUniformItemSizes(True)
+        self.occupancy_view.setSelectionMode(QListView.NoSelection)
+        self.occupancy_view.setMouseTracking(True)
+        self.occupancy_view.setModel(self.occupancy_model)
+        delegate = OccupancyDelegate(self.occupancy_view)
+        delegate.tile_clicked.connect(self.tile_clicked)
+        self.occupancy_view.setItemDelegate(delegate)
+        self.layout.addWidget(self.occupancy_view)
+
+        self.setLayout(self.layout)
+
+        # Elapsed times only need to tick while the grid is on screen
+        self.tick_timer = QTimer(self)
+        self.tick_timer.setInterval(1000)
+        self.tick_timer.timeout.connect(self.occupancy_model.tick)
+
+        self.display_occupancy()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.occupancy_model.tick()
+        self.tick_timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.tick_timer.stop()
+
+    def display_occupancy(self):
+        self.occupancy_model.load()
+
+    def update_summary(self):
+        self.summary_label.setText(f"{self.occupancy_model.in_use()} of {self.occupancy_model.rowCount()} PCs in use")
+
+    def tile_clicked(self, pc_id):
+        pc_id, student_id, name, entry_epoch = self.occupancy_model.tile(pc_id)
+        if student_id is None:
+            student_id, ok = QInputDialog.getText(self, "Assign PC", f"Student ID for {pc_id}:")
+            if ok and student_id.strip():
+                self.runner.write(self.open_session, student_id.strip(), pc_id, on_result=self.session_opened)
+            return
+
+        answer = QMessageBox.question(self, "Unassign PC", f"End the session of {name} ({student_id}) on {pc_id}?")
+        if answer == QMessageBox.Yes:
+            self.runner.write(self.store.close_session, student_id,
+                              on_result=lambda closed: self.session_closed(student_id, closed))
+
+    def open_session(self, student_id, pc_id):
+        # Returns (session, None), or (None, reason) if the student can't be checked in
+        student = self.store.student(student_id)
+        if student is None:
+            return None, "No matching student found."
+        try:
+            entry_time = self.store.open_session(student.student_id, pc_id)
+        except PcTakenError as error:
+            self.allocator.load()
+            return None, str(error)
+        except AssignmentError as error:
+            return None, str(error)
+        return (student.student_id, student.name, pc_id, entry_time), None
+
+    def session_opened(self, opened):
+        session, error = opened
+        if error is not None:
+            QMessageBox.warning(self, "Error", error)
+            # Another desk may have changed the PC, so the grid is out of date
+            self.display_occupancy()
+            return
+
+        self.notifier.session_opened.emit(*session)
+
+    def session_closed(self, student_id, closed):
+        if closed is not None:
+            self.notifier.session_closed.emit(student_id, *closed)
+
+
+class BookingsWidget(QWidget):
+    def __init__(self, store, runner, notifier):
+        super().__init__()
+
+        self.store = store
+        self.runner = runner
+        self.layout = QVBoxLayout()
+
+        form_layout = QFormLayout()
+        self.pc_id_input = QLineEdit()
+        form_layout.addRow("PC ID:", self.pc_id_input)
+
+        self.student_id_input = QLineEdit()
+        self.student_id_input.setPlaceholderText("Leave empty to block the PC for maintenance")
+        form_layout.addRow("Student ID:", self.student_id_input)
+
+        # The next full hour, for two hours
+        start = QDateTime.currentDateTime().addSecs(3600)
+        start.setTime(start.time().addSecs(-start.time().minute() * 60 - start.time().second()))
+        self.start_input = self.add_time_input(form_layout, "From:", start)
+        self.end_input = self.add_time_input(form_layout, "To:", start.addSecs(2 * 3600))
+
+        self.note_input = QLineEdit()
+        form_layout.addRow("Note:", self.note_input)
+
+        button_layout = QHBoxLayout()
+        book_button = QPushButton("Book")
+        book_button.clicked.connect(self.add_booking)
+        button_layout.addWidget(book_button)
+        free_button = QPushButton("Show Free PCs")
+        free_button.clicked.connect(self.show_free_pcs)
+        button_layout.addWidget(free_button)
+        form_layout.addRow(button_layout)
+
+        self.free_pcs_label = QLabel()
+        self.free_pcs_label.setWordWrap(True)
+        form_layout.addRow(self.free_pcs_label)
+        self.layout.addLayout(form_layout)
+
+        day_layout = QHBoxLayout()
+        day_layout.addWidget(QLabel("Bookings on:"))
+        self.day_input = QDateEdit()
+        self.day_input.setCalendarPopup(True)
+        self.day_input.setDate(QDate.currentDate())
+        self.day_input.dateChanged.connect(self.display_bookings)
+        day_layout.addWidget(self.day_input)
+        cancel_button = QPushButton("Cancel Selected Booking")
+        cancel_button.clicked.connect(self.cancel_booking)
+        day_layout.addWidget(cancel_button)
+        self.layout.addLayout(day_layout)
+        self.layout.addWidget(LoadingLabel(runner, "bookings", "free pcs"))
+
+        self.bookings_table = QTableWidget()
+        self.bookings_table.setColumnCount(6)
+        self.bookings_table.setHorizontalHeaderLabels(["Booking", "PC ID", "Booked For", "From", "To", "Note"])
+        self.bookings_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.bookings_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.bookings_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.layout.addWidget(self.bookings_table)
+
+        self.setLayout(self.layout)
+
+        self.display_bookings()
+
+    def add_time_input(self, form_layout, label, value):
+        time_input = QDateTimeEdit(value)
+        time_input.setCalendarPopup(True)
+        time_input.setDisplayFormat("yyyy-MM-dd HH:mm")
+        form_layout.addRow(label, time_input)
+        return time_input
+
+    def selected_window(self):
+        return self.start_input.dateTime().toSecsSinceEpoch(), self.end_input.dateTime().toSecsSinceEpoch()
+
+    def display_bookings(self):
+        day = self.day_input.date().toPyDate()
+        day_start = local_epoch(day)
+        day_end = local_epoch(day + timedelta(days=1))
+        self.runner.read("bookings", self.store.bookings, day_start, day_end, on_result=self.populate_bookings)
+
+    def populate_bookings(self, bookings):
+        self.bookings_table.setRowCount(len(bookings))
+        for row, booking in enumerate(bookings):
+            booked_for = "Maintenance" if booking.student_id is None else f"{booking.name} ({booking.student_id})"
+            values = (booking.booking_id, booking.pc_id, booked_for, format_booking_time(booking.start_time),
+                      format_booking_time(booking.end_time), booking.note)
+            for column, value in enumerate(values):
+                self.bookings_table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def add_booking(self):
+        pc_id = self.pc_id_input.text().strip()
+        if not pc_id:
+            QMessageBox.warning(self, "Error", "Please enter a PC ID.")
+            return
+
+        student_id = self.student_id_input.text().strip() or None
+        start_time, end_time = self.selected_window()
+        self.runner.write(self.book, pc_id, start_time, end_time, student_id, self.note_input.text(),
+                          on_result=self.booking_added)
+
+    def book(self, pc_id, start_time, end_time, student_id, note):
+        # Returns (booking_id, None), or (None, reason) if the slot can't be booked
+        try:
+            return self.store.add_booking(pc_id, start_time, end_time, student_id, note), None
+        except BookingError as error:
+            return None, str(error)
+
+    def booking_added(self, added):
+        booking_id, error = added
+        if error is not None:
+            QMessageBox.warning(self, "Error", error)
+            return
+
+        QMessageBox.information(self, "PC Booked", f"Booking {booking_id} added.")
+        self.note_input.clear()
+        self.display_bookings()
+
+    def cancel_booking(self):
+        row = self.bookings_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "Error", "Please select a booking.")
+            return
+
+        booking_id = int(self.bookings_table.item(row, 0).text())
+        self.runner.write(self.store.cancel_booking, booking_id, on_result=lambda cancelled: self.display_bookings())
+
+    def show_free_pcs(self):
+        self.runner.read("free pcs", self.store.free_pcs, *self.selected_window(), on_result=self.populate_free_pcs)
+
+    def populate_free_pcs(self, pc_ids):
+        start_time, end_time = self.selected_window()
+        text = f"{len(pc_ids)} PCs free from {format_booking_time(start_time)} to {format_booking_time(end_time)}"
+        if pc_ids:
+            text += ": " + ", ".join(pc_ids[:50]) + (", ..." if len(pc_ids) > 50 else "")
+        self.free_pcs_label.setText(text)
+
+
+class ExportProgress(QObject):
+    # Carries progress from the export thread to the progress dialog
+    progressed = pyqtSignal(int, int)
 
 
 class AssignmentHistoryWidget(QWidget):
-    def __init__(self):
+    def __init__(self, store, runner, notifier):
         super().__init__()
 
+        self.store = store
+        self.runner = runner
+        self.progress_dialog = None
+        self.export_progress = ExportProgress()
+        self.export_progress.progressed.connect(self.show_export_progress)
+
         self.layout = QVBoxLayout()
 
         filter_layout = QGridLayout()
@@ -434,16 +1395,41 @@ class AssignmentHistoryWidget(QWidget):
         self.filter_pc_input.setEnabled(False)
         filter_layout.addWidget(self.filter_pc_input, 3, 1)
 
+        filter_layout.addWidget(QLabel("Search:"), 4, 0)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Student ID, name or PC ID")
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
+        filter_layout.addWidget(self.search_input, 4, 1)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(lambda: self.history_filter_model.set_text(self.search_input.text()))
+
         self.filter_button = QPushButton("Apply Filter")
         self.filter_button.clicked.connect(self.apply_filter)
-        filter_layout.addWidget(self.filter_button, 4, 0, 1, 2)
+        filter_layout.addWidget(self.filter_button, 5, 0, 1, 2)
+
+        self.export_button = QPushButton("Export...")
+        self.export_button.clicked.connect(self.export_history)
+        filter_layout.addWidget(self.export_button, 6, 0, 1, 2)
 
         self.layout.addLayout(filter_layout)
 
-        self.assignment_table = QTableWidget()
-        self.assignment_table.setColumnCount(6)
-        self.assignment_table.setHorizontalHeaderLabels(["Student ID", "Name", "PC ID", "Entry Time", "Exit Time", "Duration"])
-        self.assignment_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.layout.addWidget(LoadingLabel(runner, "history"))
+
+        self.history_model = AssignmentHistoryModel(store, runner, notifier)
+        self.history_filter_model = HistoryFilterModel(self.history_model)
+        self.assignment_table = QTableView()
+        self.assignment_table.setModel(self.history_filter_model)
+        # Sized by hand rather than stretched, so the widths can be kept between runs
+        self.assignment_table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.assignment_table.horizontalHeader().setStretchLastSection(True)
+        self.assignment_table.horizontalHeader().resizeSection(1, 200)
+        self.assignment_table.horizontalHeader().resizeSection(3, 160)
+        self.assignment_table.horizontalHeader().resizeSection(4, 160)
+        self.assignment_table.horizontalHeader().setSortIndicator(3, Qt.DescendingOrder)
+        self.assignment_table.setSortingEnabled(True)
         self.layout.addWidget(self.assignment_table)
 
         self.setLayout(self.layout)
@@ -460,141 +1446,402 @@ class AssignmentHistoryWidget(QWidget):
     def enable_filter_pc(self, state):
         self.filter_pc_input.setEnabled(state == Qt.Checked)
 
-    def apply_filter(self):
+    def current_filters(self):
         filter_date = self.filter_date_input.date().toString(Qt.ISODate)
         filter_student_id = self.filter_student_input.text()
         filter_pc_id = self.filter_pc_input.text()
 
-        query = (
-            "SELECT students.student_id, students.name, computers.pc_id, "
-            "reservations.entry_time, reservations.exit_time "
-            "FROM students "
-            "JOIN reservations ON students.student_id = reservations.student_id "
-            "JOIN computers ON computers.pc_id = reservations.pc_id "
-            "WHERE "
+        return (
+            filter_date if self.filter_date_checkbox.isChecked() else None,
+            filter_student_id if self.filter_student_checkbox.isChecked() else None,
+            filter_pc_id if self.filter_pc_checkbox.isChecked() else None,
         )
 
-        filters = []
+    def apply_filter(self):
+        # Filters in memory; filters the loaded sessions can't fully answer go back to the database
+        filters = HistoryFilters(*self.current_filters())
+        if not self.history_model.covers(filters):
+            self.history_model.load(filters)
+        self.history_filter_model.set_filters(filters)
 
-        if self.filter_date_checkbox.isChecked():
-            filters.append(f"reservations.entry_time LIKE '{filter_date}%'")
+    def display_assignment_history(self):
+        self.history_model.load()
+
+    def save_filters(self, settings):
+        settings.setValue("filter_date", self.filter_date_checkbox.isChecked())
+        settings.setValue("date", self.filter_date_input.date().toString(Qt.ISODate))
+        settings.setValue("filter_student", self.filter_student_checkbox.isChecked())
+        settings.setValue("student_id", self.filter_student_input.text())
+        settings.setValue("filter_pc", self.filter_pc_checkbox.isChecked())
+        settings.setValue("pc_id", self.filter_pc_input.text())
+        settings.setValue("search", self.search_input.text())
+
+    def restore_filters(self, settings):
+        saved_date = QDate.fromString(settings.value("date", "", type=str), Qt.ISODate)
+        if saved_date.isValid():
+            self.filter_date_input.setDate(saved_date)
+        self.filter_date_checkbox.setChecked(settings.value("filter_date", False, type=bool))
+        self.filter_student_input.setText(settings.value("student_id", "", type=str))
+        self.filter_student_checkbox.setChecked(settings.value("filter_student", False, type=bool))
+        self.filter_pc_input.setText(settings.value("pc_id", "", type=str))
+        self.filter_pc_checkbox.setChecked(settings.value("filter_pc", False, type=bool))
+        self.search_input.setText(settings.value("search", "", type=str))
+        self.search_timer.stop()
+        self.history_filter_model.text = self.search_input.text()
+        self.apply_filter()
+
+    def export_history(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", "history.csv",
+                                              "CSV files (*.csv);;JSON Lines (*.jsonl)")
+        if not path:
+            return
 
-        if self.filter_student_checkbox.isChecked():
-            filters.append(f"students.student_id = '{filter_student_id}'")
+        if self.progress_dialog is None:
+            self.progress_dialog = QProgressDialog("Exporting history...", "Cancel", 0, 100, self)
+            self.progress_dialog.setWindowModality(Qt.WindowModal)
+            self.progress_dialog.setMinimumDuration(0)
+            self.progress_dialog.canceled.connect(self.cancel_export)
+        self.progress_dialog.setValue(0)
 
-        if self.filter_pc_checkbox.isChecked():
-            filters.append(f"computers.pc_id = '{filter_pc_id}'")
+        filters = HistoryFilters(*self.current_filters())
+        self.export_button.setEnabled(False)
+        task = self.runner.read("export", self.store.export_history, path, filters, self.export_progress.progressed.emit,
+                                on_result=lambda written: self.history_exported(path, written))
+        task.signals.failed.connect(lambda message: self.history_exported(path, None))
 
-        if filters:
-            query += " AND ".join(filters)
-        else:
-            query = (
-                "SELECT students.student_id, students.name, computers.pc_id, "
-                "reservations.entry_time, reservations.exit_time "
-                "FROM students "
-                "JOIN reservations ON students.student_id = reservations.student_id "
-                "JOIN computers ON computers.pc_id = reservations.pc_id "
-            )
+    def show_export_progress(self, written, total):
+        if self.progress_dialog is not None and not self.export_button.isEnabled():
+            self.progress_dialog.setValue(min(99, written * 100 // max(total, 1)))
 
-        query += " ORDER BY reservations.entry_time DESC"
+    def cancel_export(self):
+        self.runner.cancel("export")
+        self.export_button.setEnabled(True)
 
-        c.execute(query)
-        assignment_data = c.fetchall()
+    def history_exported(self, path, written):
+        self.export_button.setEnabled(True)
+        self.progress_dialog.reset()
+        if written is not None:
+            QMessageBox.information(self, "Export Finished", f"Exported {written} rows to {path}.")
 
-        self.assignment_table.setRowCount(len(assignment_data))
-        for row, assignment in enumerate(assignment_data):
-            student_id, name, pc_id, entry_time, exit_time = assignment
-            student_item = QTableWidgetItem(str(student_id))
-            student_item.setData(Qt.UserRole, name)
-            pc_item = QTableWidgetItem(pc_id)
-            entry_time_item = QTableWidgetItem(entry_time)
-            exit_time_item = QTableWidgetItem(exit_time if exit_time else "")
-
-            # Calculate the duration if the PC is currently assigned
-            duration_item = QTableWidgetItem()
-            if exit_time:
-                duration = datetime.strptime(exit_time, "%Y-%m-%d %H:%M:%S") - datetime.strptime(entry_time, "%Y-%m-%d %H:%M:%S")
-                duration_item.setText(str(duration))
-
-            self.assignment_table.setItem(row, 0, student_item)
-            self.assignment_table.setItem(row, 1, QTableWidgetItem(name))
-            self.assignment_table.setItem(row, 2, pc_item)
-            self.assignment_table.setItem(row, 3, entry_time_item)
-            self.assignment_table.setItem(row, 4, exit_time_item)
-            self.assignment_table.setItem(row, 5, duration_item)
 
-    def display_assignment_history(self):
-        c.execute(
-            "SELECT students.student_id, students.name, computers.pc_id, "
-            "reservations.entry_time, reservations.exit_time "
-            "FROM students "
-            "JOIN reservations ON students.student_id = reservations.student_id "
-            "JOIN computers ON computers.pc_id = reservations.pc_id "
-            "ORDER BY reservations.entry_time DESC"
-        )
-        assignment_data = c.fetchall()
+class ReportsWidget(QWidget):
+    def __init__(self, store, runner, notifier):
+        super().__init__()
 
-        self.assignment_table.setRowCount(len(assignment_data))
-        for row, assignment in enumerate(assignment_data):
-            student_id, name, pc_id, entry_time, exit_time = assignment
-            student_item = QTableWidgetItem(str(student_id))
-            student_item.setData(Qt.UserRole, name)
-            pc_item = QTableWidgetItem(pc_id)
-            entry_time_item = QTableWidgetItem(entry_time)
-            exit_time_item = QTableWidgetItem(exit_time if exit_time else "")
-
-            # Calculate the duration if the PC is currently assigned
-            duration_item = QTableWidgetItem()
-            if exit_time:
-                duration = datetime.strptime(exit_time, "%Y-%m-%d %H:%M:%S") - datetime.strptime(entry_time, "%Y-%m-%d %H:%M:%S")
-                duration_item.setText(str(duration))
-
-            self.assignment_table.setItem(row, 0, student_item)
-            self.assignment_table.setItem(row, 1, QTableWidgetItem(name))
-            self.assignment_table.setItem(row, 2, pc_item)
-            self.assignment_table.setItem(row, 3, entry_time_item)
-            self.assignment_table.setItem(row, 4, exit_time_item)
-            self.assignment_table.setItem(row, 5, duration_item)
+        self.store = store
+        self.runner = runner
+        self.layout = QVBoxLayout()
 
+        range_layout = QHBoxLayout()
+        range_layout.addWidget(QLabel("From:"))
+        self.first_day_input = QDateEdit()
+        self.first_day_input.setCalendarPopup(True)
+        self.first_day_input.setDate(QDate.currentDate().addDays(-29))
+        range_layout.addWidget(self.first_day_input)
+
+        range_layout.addWidget(QLabel("To:"))
+        self.last_day_input = QDateEdit()
+        self.last_day_input.setCalendarPopup(True)
+        self.last_day_input.setDate(QDate.currentDate())
+        range_layout.addWidget(self.last_day_input)
+
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.display_report)
+        range_layout.addWidget(refresh_button)
+
+        self.layout.addLayout(range_layout)
+        self.layout.addWidget(LoadingLabel(runner, "reports"))
+
+        report_layout = QGridLayout()
+        self.utilization_table = self.add_report_table(report_layout, 0, 0, "PC Utilization",
+                                                       ["PC ID", "Time Used", "Utilization %"])
+        self.peaks_table = self.add_report_table(report_layout, 0, 1, "Peak Occupancy by Hour",
+                                                 ["Hour", "Peak PCs in Use"])
+        self.courses_table = self.add_report_table(report_layout, 1, 0, "Average Session by Course",
+                                                   ["Course", "Sessions", "Average Length"])
+        self.top_users_table = self.add_report_table(report_layout, 1, 1, "Top Users",
+                                                     ["Student ID", "Name", "Sessions", "Time Used"])
+        self.layout.addLayout(report_layout)
 
-class LibraryPcManagement(QMainWindow):
-    def __init__(self):
+        self.setLayout(self.layout)
+
+        # Closed sessions are what the rollups count, so refresh when one closes
+        notifier.session_closed.connect(lambda *closed: self.display_report())
+        notifier.sessions_closed.connect(lambda closed: self.display_report())
+        self.display_report()
+
+    def add_report_table(self, report_layout, row, column, title, headers):
+        group = QGroupBox(title)
+        group_layout = QVBoxLayout()
+        table = QTableWidget()
+        table.setColumnCount(len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        group_layout.addWidget(table)
+        group.setLayout(group_layout)
+        report_layout.addWidget(group, row, column)
+        return table
+
+    def display_report(self):
+        first_day = self.first_day_input.date().toString(Qt.ISODate)
+        last_day = self.last_day_input.date().toString(Qt.ISODate)
+        self.runner.read("reports", self.store.usage_report, first_day, last_day, on_result=self.populate_report)
+
+    def populate_report(self, report):
+        self.fill_table(self.utilization_table, report.utilization)
+        self.fill_table(self.peaks_table, [(f"{hour:02d}:00", peak) for hour, peak in report.peaks])
+        self.fill_table(self.courses_table, report.courses)
+        self.fill_table(self.top_users_table, report.top_users)
+
+    def fill_table(self, table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                table.setItem(row, column, QTableWidgetItem(str(value)))
+
+
+class DiagnosticsWidget(QWidget):
+    def __init__(self, store, runner, notifier):
         super().__init__()
 
-        self.setWindowTitle("Library PC Management")
-        self.setGeometry(200, 200, 800, 600)
+        self.store = store
+        self.runner = runner
+        self.layout = QVBoxLayout()
 
-        tab_widget = QTabWidget()
+        refresh_layout = QHBoxLayout()
+        refresh_layout.addWidget(QLabel(f"Slow threshold: {store.instrumentation.slow_ms:g} ms"))
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.display_diagnostics)
+        refresh_layout.addWidget(refresh_button)
+        self.layout.addLayout(refresh_layout)
+
+        backup_layout = QHBoxLayout()
+        self.backup_label = QLabel(f"Snapshots go to {backup_dir_for(store.path)}")
+        backup_layout.addWidget(self.backup_label)
+        self.backup_button = QPushButton("Back Up Now")
+        self.backup_button.clicked.connect(self.backup)
+        backup_layout.addWidget(self.backup_button)
+        self.layout.addLayout(backup_layout)
+
+        self.timings_table = self.add_table("Timings (ms)", ["Kind", "Name", "Count", "p50", "p95", "p99", "Max"])
+        self.slow_table = self.add_table("Slow Log", ["Time", "Kind", "ms", "Name"])
+        self.stats_table = self.add_table("Database", ["Stat", "Value"])
 
-        assign_pc_widget = AssignPcWidget(self,self)
-        tab_widget.addTab(assign_pc_widget, "Assign PC")
+        self.setLayout(self.layout)
+
+    def add_table(self, title, headers):
+        group = QGroupBox(title)
+        group_layout = QVBoxLayout()
+        table = QTableWidget()
+        table.setColumnCount(len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        table.horizontalHeader().setStretchLastSection(True)
+        group_layout.addWidget(table)
+        group.setLayout(group_layout)
+        self.layout.addWidget(group)
+        return table
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.display_diagnostics()
+
+    def display_diagnostics(self):
+        instrumentation = self.store.instrumentation
+        self.fill_table(self.timings_table, instrumentation.timings())
+        self.fill_table(self.slow_table, [(event.time, event.kind, event.ms, event.name)
+                                          for event in reversed(instrumentation.slow)])
+        self.runner.read("diagnostics", self.store.database_stats,
+                         on_result=lambda stats: self.fill_table(self.stats_table, stats))
+
+    def fill_table(self, table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def backup(self):
+        # Copies in page steps on a worker thread, so check-ins carry on meanwhile
+        self.backup_button.setEnabled(False)
+        self.backup_label.setText("Backing up...")
+        task = self.runner.read("backup", self.store.backup, None, BACKUP_KEEP, True, on_result=self.backed_up)
+        task.signals.failed.connect(lambda message: self.backed_up(None))
+
+    def backed_up(self, result):
+        self.backup_button.setEnabled(True)
+        if result is None:
+            self.backup_label.setText("Backup failed")
+            return
+        self.backup_label.setText(f"Backed up {result.pages} pages in {result.seconds:.1f} s "
+                                  f"({result.pages_per_second:.0f} pages/s) to {result.path}")
 
-        pc_management_widget = PCManagementWidget()
-        tab_widget.addTab(pc_management_widget, "PC Management")
 
-        student_management_widget = StudentManagementWidget()
-        tab_widget.addTab(student_management_widget, "Student Management")
+class LibraryPcManagement(QMainWindow):
+    def __init__(self, store, max_session_seconds=None, closing_time=None, settings=None):
+        super().__init__()
 
-        assignment_history_widget = AssignmentHistoryWidget()
-        tab_widget.addTab(assignment_history_widget, "Assignment History")
+        self.store = store
+        self.max_session_seconds = max_session_seconds
+        self.closing_time = closing_time
 
-        self.setCentralWidget(tab_widget)
+        self.setWindowTitle("Library PC Management")
+        self.setGeometry(200, 200, 800, 600)
 
-    def display_pcs(self):
-        # Retrieve and display PC data
-        pc_management_widget = self.findChild(PCManagementWidget)
-        if pc_management_widget:
-            pc_management_widget.display_pcs()
-    
-    def display_assignment_history(self):
-        # Retrieve and display PC data
-        assignment_history_widget = self.findChild(AssignmentHistoryWidget)
-        if assignment_history_widget:
-            assignment_history_widget.display_assignment_history()
+        # Views subscribe to this instead of reloading each other after every change
+        self.notifier = DataChangeNotifier()
+        # Database work runs on worker threads so the window never waits on SQLite
+        self.runner = DbTaskRunner(store)
+        self.runner.failed.connect(lambda message: QMessageBox.warning(self, "Database Error", message))
+
+        # Vacant PCs are tracked in memory; it learns of every change made here through the notifier
+        self.allocator = PcAllocator(store)
+        self.notifier.session_opened.connect(lambda student_id, name, pc_id, entry_time: self.allocator.take(pc_id))
+        self.notifier.session_closed.connect(lambda student_id, pc_id, exit_time, duration: self.allocator.release(pc_id))
+        self.notifier.sessions_closed.connect(self.release_pcs)
+        for signal in (self.notifier.pc_added, self.notifier.pc_deleted, self.notifier.pcs_imported):
+            signal.connect(lambda *changed: self.runner.write(self.allocator.load))
+        self.runner.write(self.allocator.load)
+        # Other processes share the database; PCs they take or free are picked up by reloading
+        self.data_version = None
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL_MS)
+        self.watch_timer.timeout.connect(self.watch_database)
+        self.watch_timer.start()
+        self.watch_database()
+
+        # Tabs are built, and so start loading, the first time they are shown; a tab that
+        # hasn't been built has nothing to keep up to date
+        self.tab_factories = [
+            ("assign_pc_widget", "Assign PC",
+             lambda: AssignPcWidget(store, self.runner, self.notifier, self.allocator)),
+            ("occupancy_widget", "Occupancy",
+             lambda: OccupancyWidget(store, self.runner, self.notifier, self.allocator)),
+            ("pc_management_widget", "PC Management", lambda: PCManagementWidget(store, self.runner, self.notifier)),
+            ("student_management_widget", "Student Management",
+             lambda: StudentManagementWidget(store, self.runner, self.notifier)),
+            ("assignment_history_widget", "Assignment History",
+             lambda: AssignmentHistoryWidget(store, self.runner, self.notifier)),
+            ("bookings_widget", "Bookings", lambda: BookingsWidget(store, self.runner, self.notifier)),
+            ("reports_widget", "Reports", lambda: ReportsWidget(store, self.runner, self.notifier)),
+            ("diagnostics_widget", "Diagnostics", lambda: DiagnosticsWidget(store, self.runner, self.notifier)),
+        ]
+        self.tab_widgets = {}
+        self.tab_widget = QTabWidget()
+        for name, title, factory in self.tab_factories:
+            page = QWidget()
+            QVBoxLayout(page).setContentsMargins(0, 0, 0, 0)
+            self.tab_widget.addTab(page, title)
+        self.setCentralWidget(self.tab_widget)
+
+        self.settings = settings if settings is not None else QSettings(SETTINGS_ORGANIZATION, SETTINGS_APPLICATION)
+        geometry = self.settings.value("window/geometry")
+        if geometry is not None:
+            self.restoreGeometry(geometry)
+        names = [name for name, title, factory in self.tab_factories]
+        last_tab = self.settings.value("window/tab")
+        self.tab_widget.setCurrentIndex(names.index(last_tab) if last_tab in names else 0)
+        self.tab_widget.currentChanged.connect(self.build_tab)
+        self.build_tab(self.tab_widget.currentIndex())
+
+        # Overrun and forgotten sessions are ended in one batch per check. Only when asked for:
+        # the command line sets a limit by default, a window built in code has none.
+        if max_session_seconds or closing_time:
+            self.expiry_timer = QTimer(self)
+            self.expiry_timer.setInterval(EXPIRY_CHECK_MS)
+            self.expiry_timer.timeout.connect(self.expire_sessions)
+            self.expiry_timer.start()
+            self.expire_sessions()
+
+    def watch_database(self):
+        # data_version is read on the write thread, so commits made from this window don't count
+        self.runner.write(self.store.data_version, on_result=self.database_version)
+
+    def database_version(self, data_version):
+        if self.data_version is not None and data_version != self.data_version:
+            self.runner.write(self.allocator.load)
+        self.data_version = data_version
+
+    def expire_sessions(self):
+        self.runner.write(self.store.expire_sessions, self.max_session_seconds, self.closing_time,
+                          on_result=self.sessions_expired)
+
+    def sessions_expired(self, closed):
+        if closed:
+            self.notifier.sessions_closed.emit(closed)
+            self.statusBar().showMessage(f"Released {len(closed)} expired sessions", 10000)
+
+    def release_pcs(self, closed):
+        for student_id, pc_id, exit_time, duration in closed:
+            self.allocator.release(pc_id)
+
+    def build_tab(self, index):
+        name, title, factory = self.tab_factories[index]
+        if name in self.tab_widgets:
+            return self.tab_widgets[name]
+
+        widget = self.tab_widgets[name] = factory()
+        self.tab_widget.widget(index).layout().addWidget(widget)
+        self.settings.beginGroup(name)
+        for number, table in enumerate(widget.findChildren(QTableView)):
+            state = self.settings.value(f"header{number}")
+            if state is not None:
+                table.horizontalHeader().restoreState(state)
+        if isinstance(widget, AssignmentHistoryWidget):
+            widget.restore_filters(self.settings)
+        self.settings.endGroup()
+        return widget
+
+    def show_tab(self, name):
+        # Switches to the tab, building it if needed, and returns its widget
+        index = [name for name, title, factory in self.tab_factories].index(name)
+        self.tab_widget.setCurrentIndex(index)
+        return self.build_tab(index)
+
+    def save_settings(self):
+        self.settings.setValue("window/geometry", self.saveGeometry())
+        self.settings.setValue("window/tab", self.tab_factories[self.tab_widget.currentIndex()][0])
+        for name, widget in self.tab_widgets.items():
+            self.settings.beginGroup(name)
+            for number, table in enumerate(widget.findChildren(QTableView)):
+                self.settings.setValue(f"header{number}", table.horizontalHeader().saveState())
+            if isinstance(widget, AssignmentHistoryWidget):
+                widget.save_filters(self.settings)
+            self.settings.endGroup()
+        self.settings.sync()
+
+    def closeEvent(self, event):
+        self.save_settings()
+        self.runner.shutdown()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    # Scripted jobs (imports, exports, plan checks) live in library_cli.py
+    parser = argparse.ArgumentParser(description="Library PC Management")
+    parser.add_argument("--db", help="database file (default: $LIBRARY_PC_DB or library_pc.db)")
+    parser.add_argument("--slow-ms", type=float, help="log statements and views slower than this (default: $LIBRARY_PC_SLOW_MS or 100)")
+    parser.add_argument("--slow-log", help="file to append slow statements and views to")
+    parser.add_argument("--max-session-hours", type=float, default=MAX_SESSION_SECONDS / 3600,
+                        help=f"end sessions after this many hours, 0 for never (default: {MAX_SESSION_SECONDS / 3600:g})")
+    parser.add_argument("--closing-time", type=clock_time, help="end every session at this time of day (HH:MM)")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="print how long the window took to show and to load its data, then quit")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
     app = QApplication([])
-    window = LibraryPcManagement()
+    window = LibraryPcManagement(LibraryStore(args.db, Instrumentation(args.slow_ms, args.slow_log)),
+                                 int(args.max_session_hours * 3600), args.closing_time)
     window.show()
-    app.exec_()
+    if args.startup_time:
+        # From opening the database to the window painted, and to every startup read and write done
+        app.processEvents()
+        shown = time.perf_counter()
+        while window.runner.running:
+            app.processEvents(QEventLoop.WaitForMoreEvents)
+        app.processEvents()
+        print(f"Window shown in {(shown - started) * 1000:.0f} ms, "
+              f"data loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+        window.close()
+    else:
+        app.exec_()
@@ -0,0 +1,355 @@
+# JSON over HTTP for kiosks and occupancy displays, using only the standard library.
+#
+#   python library_api.py --host 0.0.0.0 --port 8080
+#
+#   GET    /pcs/vacant                      vacant PC IDs nobody has booked within WALK_IN_MINUTES
+#   GET    /sessions                        open sessions
+#   POST   /sessions                        {"student_id": ..., "pc_id": ...} opens a session; without
+#                                           pc_id the next PC is picked by "policy" (see ALLOCATION_POLICIES)
+#   DELETE /sessions/<student_id>           closes the student's session
+#   GET    /students/<student_id>           student details
+#   GET    /history?date=&student_id=&pc_id=&limit=&after=
+#   GET    /events?since=<id>&timeout=<s>   long poll for occupancy changes
+#   GET    /events/stream                   the same changes as server-sent events
+#
+# There is no authentication, so only listen on a trusted network.
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+from library_core import (
+    ALLOCATION_POLICIES, EXPORT_COLUMNS, AssignmentError, HistoryFilters, Instrumentation, LibraryStore, PcAllocator,
+    PcTakenError
+)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_HISTORY_LIMIT = 1000
+# How often other processes' writes are looked for, and how often idle streams get a keepalive
+WATCH_INTERVAL = 1.0
+KEEPALIVE_INTERVAL = 15.0
+
+# The endpoints requests are timed under; IDs in a path are shown as {id}
+ROUTES = {("GET", "/pcs/vacant"), ("GET", "/sessions"), ("POST", "/sessions"), ("DELETE", "/sessions/{id}"),
+          ("GET", "/students/{id}"), ("GET", "/history"), ("GET", "/events")}
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LibraryApi:
+    # Reads run on a small thread pool, each thread with its own connection. Writes go
+    # through a single thread, so they never queue on SQLite's lock inside this process.
+
+    def __init__(self, store, readers=4, policy="lowest-id"):
+        self.store = store
+        # Loaded and updated on the writer thread only
+        self.allocator = PcAllocator(store, policy)
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix="api-read")
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="api-write")
+        # Recent occupancy changes, numbered so clients can ask for what they missed
+        self.events = deque(maxlen=1000)
+        self.last_event_id = 0
+        self.changed = None
+
+    async def read(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, function, *args)
+
+    async def write(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writer, function, *args)
+
+    async def publish(self, kind, data):
+        async with self.changed:
+            self.last_event_id += 1
+            self.events.append({"id": self.last_event_id, "type": kind, "data": data})
+            self.changed.notify_all()
+
+    def events_since(self, since):
+        # If the client is further behind than the kept events it gets a reset and should reload
+        events = [event for event in self.events if event["id"] > since]
+        if events and events[0]["id"] > since + 1:
+            return [{"id": self.last_event_id, "type": "reset", "data": {}}]
+        return events
+
+    async def wait_for_events(self, since, timeout):
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: self.last_event_id > since), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.events_since(since)
+
+    async def watch_database(self):
+        # The Qt desks write from other processes; their changes are published as "changed".
+        # data_version is read on the writer's thread, so this server's own commits don't count
+        data_version = await self.write(self.store.data_version)
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            current = await self.write(self.store.data_version)
+            if current != data_version:
+                await self.write(self.allocator.load)
+                await self.publish("changed", {})
+            data_version = current
+
+    async def handle(self, method, path, query, body):
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+
+        if parts == ["pcs", "vacant"] and method == "GET":
+            return 200, {"pcs": await self.write(self.allocator.available)}
+
+        if parts == ["sessions"] and method == "GET":
+            sessions = await self.read(self.store.active_sessions)
+            return 200, {"sessions": [session._asdict() for session in sessions]}
+
+        if parts == ["sessions"] and method == "POST":
+            student_id, pc_id = student_id_parameter(body.get("student_id")), str(body.get("pc_id") or "")
+            policy = body.get("policy")
+            if policy is not None and policy not in ALLOCATION_POLICIES:
+                raise ApiError(400, f"policy must be one of {', '.join(ALLOCATION_POLICIES)}")
+            try:
+                if pc_id:
+                    entry_time = await self.write(self.open_session, student_id, pc_id)
+                else:
+                    pc_id, entry_time = await self.write(self.assign_next, student_id, policy)
+            except AssignmentError as error:
+                raise ApiError(409, str(error))
+            student = await self.read(self.store.student, student_id)
+            session = {"student_id": student.student_id, "name": student.name, "pc_id": pc_id,
+                       "entry_time": entry_time}
+            await self.publish("session_opened", session)
+            return 201, session
+
+        if len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            student_id = student_id_parameter(parts[1])
+            closed = await self.write(self.close_session, student_id)
+            if closed is None:
+                raise ApiError(404, f"Student {student_id} has no open session.")
+            pc_id, exit_time, duration = closed
+            session = {"student_id": student_id, "pc_id": pc_id, "exit_time": exit_time, "duration": duration}
+            await self.publish("session_closed", session)
+            return 200, session
+
+        if len(parts) == 2 and parts[0] == "students" and method == "GET":
+            student = await self.read(self.store.student, student_id_parameter(parts[1]))
+            if student is None:
+                raise ApiError(404, "No matching student found.")
+            return 200, student._asdict()
+
+        if parts == ["history"] and method == "GET":
+            return 200, await self.history(query)
+
+        if parts == ["events"] and method == "GET":
+            since = int_parameter(query, "since", self.last_event_id)
+            timeout = min(int_parameter(query, "timeout", 30), 60)
+            return 200, {"events": await self.wait_for_events(since, timeout), "last": self.last_event_id}
+
+        if parts[0] in ("pcs", "sessions", "students", "history", "events"):
+            raise ApiError(405, f"{method} is not supported on {path}")
+        raise ApiError(404, f"No such resource: {path}")
+
+    def open_session(self, student_id, pc_id):
+        try:
+            entry_time = self.store.open_session(student_id, pc_id)
+        except PcTakenError:
+            # Another desk took it, so the vacant list is out of date
+            self.allocator.load()
+            raise
+        self.allocator.take(pc_id)
+        return entry_time
+
+    def assign_next(self, student_id, policy):
+        pc_id, entry_time = self.allocator.assign_next(student_id, policy)
+        self.allocator.take(pc_id)
+        return pc_id, entry_time
+
+    def close_session(self, student_id):
+        closed = self.store.close_session(student_id)
+        if closed is not None:
+            self.allocator.release(closed[0])
+        return closed
+
+    async def history(self, query):
+        # Pages are keyset paginated; pass the returned "next" back as "after" for the next page
+        filters = HistoryFilters(date_parameter(query, "date"),
+                                 *(query.get(name, [None])[0] or None for name in ("student_id", "pc_id")))
+        limit = max(1, min(int_parameter(query, "limit", 100), MAX_HISTORY_LIMIT))
+        after = None
+        if "after" in query:
+            try:
+                entry_epoch, reservation_id = query["after"][0].split(",")
+                after = (int(entry_epoch), int(reservation_id))
+            except ValueError:
+                raise ApiError(400, "after must be <entry_epoch>,<reservation_id>")
+
+        rows = await self.read(self.store.history, filters, after, limit)
+        next_page = f"{rows[-1].entry_epoch},{rows[-1].reservation_id}" if len(rows) == limit else None
+        return {"history": [dict(zip(EXPORT_COLUMNS, row)) for row in rows], "next": next_page}
+
+    async def stream_events(self, writer):
+        # Sends every change from now on as a server-sent event, with comment lines as keepalives
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        await writer.drain()
+        since = self.last_event_id
+        while True:
+            events = await self.wait_for_events(since, KEEPALIVE_INTERVAL)
+            if not events:
+                writer.write(b": keepalive\n\n")
+            for event in events:
+                writer.write(f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+                             .encode())
+                since = max(since, event["id"])
+            await writer.drain()
+
+    async def serve_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive; each request is read in full before it is handled
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 413, {"error": "Headers too large"}, False)
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              if version == "HTTP/1.1" else headers.get("connection", "").lower() == "keep-alive")
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "Malformed Content-Length"}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "Body too large"}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                url = urlsplit(target)
+                if url.path == "/events/stream" and method == "GET":
+                    await self.stream_events(writer)
+                    break
+
+                status, payload = await self.dispatch(method, url.path, parse_qs(url.query), raw_body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, query, raw_body):
+        start = time.perf_counter()
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+            if not isinstance(body, dict):
+                raise ApiError(400, "The body must be a JSON object")
+            return await self.handle(method, path, query, body)
+        except json.JSONDecodeError:
+            return 400, {"error": "The body is not valid JSON"}
+        except ApiError as error:
+            return error.status, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+        finally:
+            self.store.instrumentation.record("api", route(method, path), time.perf_counter() - start)
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            .encode() + body)
+        await writer.drain()
+
+    async def serve(self, host, port, started=None):
+        # Serves until cancelled. started, if given, is set to the listening socket's address.
+        self.changed = asyncio.Condition()
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=MAX_HEADER_BYTES)
+        watcher = asyncio.create_task(self.watch_database())
+        if started is not None:
+            started.set_result(server.sockets[0].getsockname()[:2])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.readers.shutdown(wait=False)
+            self.writer.shutdown()
+
+
+def route(method, path):
+    # The key a request is timed under. Requests that match no endpoint share one key,
+    # so a long-running server keeps a fixed number of timings.
+    parts = path.strip("/").split("/")
+    if len(parts) == 2 and parts[0] in ("sessions", "students"):
+        parts[1] = "{id}"
+    path = "/" + "/".join(parts)
+    return f"{method} {path}" if (method, path) in ROUTES else "unmatched"
+
+
+def student_id_parameter(value):
+    # Student IDs are numbers, as the import requires
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, "student_id must be a number")
+
+
+def int_parameter(query, name, default):
+    try:
+        return int(query[name][0]) if name in query else default
+    except ValueError:
+        raise ApiError(400, f"{name} must be a whole number")
+
+
+def date_parameter(query, name):
+    text = query.get(name, [None])[0] or None
+    try:
+        return None if text is None else date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise ApiError(400, f"{name} must be a date (YYYY-MM-DD)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Library PC Management JSON API")
+    parser.add_argument("--db", help="database file (default: $LIBRARY_PC_DB or library_pc.db)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--readers", type=int, default=4, help="threads (and connections) for reads")
+    parser.add_argument("--policy", choices=ALLOCATION_POLICIES, default="lowest-id",
+                        help="how POST /sessions picks a PC when none is given")
+    parser.add_argument("--slow-ms", type=float, help="log statements and requests slower than this")
+    parser.add_argument("--slow-log", help="file to append slow statements and requests to")
+    args = parser.parse_args()
+
+    api = LibraryApi(LibraryStore(args.db, Instrumentation(args.slow_ms, args.slow_log)), args.readers, args.policy)
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
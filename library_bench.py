@@ -0,0 +1,454 @@
+# Benchmarks for the store queries and the widget refresh paths on a generated library.
+#
+#   python library_bench.py generate bench.db --students 50000 --pcs 2000 --reservations 10000000
+#   python library_bench.py run bench.db --output after.json --compare before.json
+#   python library_bench.py stress bench.db --writers 8 --seconds 10
+#   python library_bench.py api bench.db --clients 20 --seconds 10
+#
+# Widgets are timed under QT_QPA_PLATFORM=offscreen, from the call until the data is on
+# screen, including the worker thread round trip and a full paint of the widget.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from library_core import (
+    HISTORY_WINDOW_ROWS, AssignmentError, HistoryFilters, LibraryStore, local_epoch, rebuild_rollups
+)
+
+COURSES = ["FYBSC CS", "SYBSC CS", "TYBSC CS", "FYBSC IT", "SYBSC IT", "TYBSC IT"]
+# Sessions start between 9:00 and 20:00 and last from 15 minutes to 4 hours
+FIRST_ENTRY_HOUR = 9
+ENTRY_HOURS = 11
+SHORTEST_SESSION = 15 * 60
+LONGEST_SESSION = 4 * 3600
+
+
+def reservation_rows(rng, students, pcs, reservations, days):
+    first_day = date.today() - timedelta(days=days)
+    day_starts = [local_epoch(first_day + timedelta(days=day)) + FIRST_ENTRY_HOUR * 3600 for day in range(days)]
+    for _ in range(reservations):
+        entry_time = rng.choice(day_starts) + rng.randrange(ENTRY_HOURS * 3600)
+        exit_time = entry_time + rng.randrange(SHORTEST_SESSION, LONGEST_SESSION)
+        yield rng.randint(1, students), f"PC{rng.randint(1, pcs):04d}", entry_time, exit_time
+
+
+def generate(path, students, pcs, reservations, days, seed):
+    # Fills a new database with the current schema. Reservation indexes are dropped during
+    # the bulk insert and rebuilt afterwards, which is much faster than updating them per row.
+    if os.path.exists(path):
+        sys.exit(f"{path} already exists")
+
+    rng = random.Random(seed)
+    store = LibraryStore(path)
+    conn = store.conn
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'reservations' AND sql IS NOT NULL"
+    ).fetchall()
+
+    with conn:
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+
+        conn.executemany("INSERT INTO students (student_id, name, course, contact) VALUES (?, ?, ?, ?)",
+                         ((student_id, f"Student {student_id}", rng.choice(COURSES), f"9{rng.randrange(10 ** 9):09d}")
+                          for student_id in range(1, students + 1)))
+        conn.executemany("INSERT INTO computers (pc_id) VALUES (?)", ((f"PC{pc:04d}",) for pc in range(1, pcs + 1)))
+        conn.executemany("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (?, ?, ?, ?)",
+                         reservation_rows(rng, students, pcs, reservations, days))
+
+        # Half the lab is in use right now
+        now = int(time.time())
+        open_sessions = min(pcs // 2, students)
+        for student_id, pc in zip(rng.sample(range(1, students + 1), open_sessions),
+                                  rng.sample(range(1, pcs + 1), open_sessions)):
+            pc_id = f"PC{pc:04d}"
+            conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time) VALUES (?, ?, ?)",
+                         (student_id, pc_id, now - rng.randrange(LONGEST_SESSION)))
+            conn.execute("UPDATE computers SET student_id = ?, status = 'Assigned' WHERE pc_id = ?",
+                         (student_id, pc_id))
+
+        for _, sql in indexes:
+            conn.execute(sql)
+        rebuild_rollups(conn)
+
+    conn.execute("ANALYZE")
+    store.close()
+
+
+def measure(function, repeat):
+    # Runs function once to warm caches, then returns timings of repeat runs in milliseconds
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "repeat": repeat,
+    }
+
+
+def sample_keys(store):
+    # A busy day, student and PC from the middle of the data, so filters return realistic pages
+    conn = store.conn
+    day, = conn.execute("SELECT day FROM daily_pc_usage GROUP BY day ORDER BY SUM(sessions) DESC LIMIT 1").fetchone()
+    student_id, = conn.execute("SELECT student_id FROM students ORDER BY student_id LIMIT 1 OFFSET "
+                               "(SELECT COUNT(*) / 2 FROM students)").fetchone()
+    pc_id, = conn.execute("SELECT pc_id FROM computers ORDER BY pc_id LIMIT 1 OFFSET "
+                          "(SELECT COUNT(*) / 2 FROM computers)").fetchone()
+    return day, str(student_id), pc_id
+
+
+def query_benchmarks(store, repeat):
+    day, student_id, pc_id = sample_keys(store)
+    first_day = (date.fromisoformat(day) - timedelta(days=29)).isoformat()
+    benchmarks = {
+        "vacant_pcs": store.vacant_pcs,
+        "active_sessions": store.active_sessions,
+        "student_lookup": lambda: store.student(student_id),
+        "history_first_page": lambda: store.history(limit=200),
+        "history_by_date": lambda: store.history(HistoryFilters(date=day), limit=200),
+        "history_by_student": lambda: store.history(HistoryFilters(student_id=student_id), limit=200),
+        "history_by_pc": lambda: store.history(HistoryFilters(pc_id=pc_id), limit=200),
+        "count_history": store.count_history,
+        "history_columns_window": lambda: store.history_columns(limit=HISTORY_WINDOW_ROWS),
+        "usage_report_30_days": lambda: store.usage_report(first_day, day),
+    }
+    return {name: measure(function, repeat) for name, function in benchmarks.items()}
+
+
+def widget_benchmarks(store, repeat):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import Qt, QDate, QEventLoop, QSettings
+    from PyQt5.QtWidgets import QApplication
+    from LibraryPCManagement import LibraryPcManagement
+
+    app = QApplication.instance() or QApplication([])
+    # A settings file of its own, so the saved layout of a real desk doesn't change the numbers
+    settings_dir = tempfile.TemporaryDirectory()
+    settings = QSettings(os.path.join(settings_dir.name, "bench.ini"), QSettings.IniFormat)
+    # No session limit, so a run never closes the sessions it is measuring
+    window = LibraryPcManagement(store, max_session_seconds=0, settings=settings)
+    window.show()
+
+    def settle(window=window):
+        while window.runner.running:
+            app.processEvents(QEventLoop.WaitForMoreEvents)
+        app.processEvents()
+
+    def startup():
+        # A second window from construction until its first tab has its data on screen
+        started = LibraryPcManagement(store, max_session_seconds=0, settings=settings)
+        started.show()
+        settle(started)
+        started.grab()
+        started.close()
+
+    def refresh(widget, load):
+        def run():
+            load()
+            settle()
+            widget.grab()
+        return run
+
+    settle()
+    day, student_id, _ = sample_keys(store)
+    assign_pc = window.show_tab("assign_pc_widget")
+    pcs = window.show_tab("pc_management_widget")
+    students = window.show_tab("student_management_widget")
+    history = window.show_tab("assignment_history_widget")
+    settle()
+    history.filter_date_input.setDate(QDate.fromString(day, Qt.ISODate))
+    history.filter_student_input.setText(student_id)
+
+    def filter_by(date_filter, student_filter):
+        def load():
+            history.filter_date_checkbox.setChecked(date_filter)
+            history.filter_student_checkbox.setChecked(student_filter)
+            history.apply_filter()
+        return load
+
+    benchmarks = {
+        "startup": startup,
+        "display_pcs": refresh(pcs, pcs.display_pcs),
+        "display_students": refresh(students, students.display_students),
+        "assign_pc.display_assignment_history": refresh(assign_pc, assign_pc.display_assignment_history),
+        "history.display_assignment_history": refresh(history, history.display_assignment_history),
+        "history.apply_filter_date": refresh(history, filter_by(True, False)),
+        "history.apply_filter_student": refresh(history, filter_by(False, True)),
+        "history.sort_by_name": refresh(history, lambda: history.assignment_table.sortByColumn(1, Qt.AscendingOrder)),
+        "history.search": refresh(history, lambda: history.history_filter_model.set_text(student_id)),
+    }
+    try:
+        return {name: measure(function, repeat) for name, function in benchmarks.items()}
+    finally:
+        window.close()
+        settings_dir.cleanup()
+
+
+def dataset(store):
+    conn = store.conn
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("students", "computers", "reservations")}
+
+
+def compare(results, baseline):
+    # Prints the median of each benchmark next to the baseline's, slowest changes first
+    rows = []
+    for group, benchmarks in results["results"].items():
+        for name, timing in benchmarks.items():
+            before = baseline.get("results", {}).get(group, {}).get(name)
+            if before:
+                rows.append((timing["median_ms"] / before["median_ms"], f"{group}.{name}",
+                             before["median_ms"], timing["median_ms"]))
+    for ratio, name, before, after in sorted(rows, reverse=True):
+        print(f"{name:50} {before:10.2f} ms -> {after:10.2f} ms  x{ratio:.2f}")
+
+
+def stress_writer(path, seconds, seed):
+    # One front desk: assigns random students to PCs it last saw vacant, and releases
+    # its own sessions at random, as fast as it can
+    rng = random.Random(seed)
+    store = LibraryStore(path)
+    students = store.conn.execute("SELECT MAX(student_id) FROM students").fetchone()[0]
+    counts = {"assigned": 0, "released": 0, "rejected": 0, "locked": 0}
+    assigned = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            if assigned and rng.random() < 0.5:
+                if store.close_session(assigned.pop(rng.randrange(len(assigned)))) is not None:
+                    counts["released"] += 1
+                continue
+
+            vacant_pcs = store.vacant_pcs()
+            if not vacant_pcs:
+                continue
+            student_id = rng.randint(1, students)
+            store.open_session(student_id, rng.choice(vacant_pcs[:10]))
+            assigned.append(student_id)
+            counts["assigned"] += 1
+        except AssignmentError:
+            counts["rejected"] += 1
+        except sqlite3.OperationalError as error:
+            if "locked" not in str(error):
+                raise
+            counts["locked"] += 1
+    store.close()
+    return counts
+
+
+def session_violations(store):
+    # Returns descriptions of every broken one-session-per-student/PC invariant
+    conn = store.conn
+    checks = {
+        "students with several open sessions": "SELECT COUNT(*) FROM (SELECT student_id FROM reservations "
+                                               "WHERE exit_time IS NULL GROUP BY student_id HAVING COUNT(*) > 1)",
+        "PCs with several open sessions": "SELECT COUNT(*) FROM (SELECT pc_id FROM reservations "
+                                          "WHERE exit_time IS NULL GROUP BY pc_id HAVING COUNT(*) > 1)",
+        "PCs whose status disagrees with their open session": '''
+            SELECT COUNT(*) FROM computers LEFT JOIN reservations
+                ON reservations.pc_id = computers.pc_id AND reservations.exit_time IS NULL
+            WHERE (reservations.student_id IS NULL) != (computers.status = 'Vacant')
+               OR reservations.student_id IS NOT computers.student_id AND reservations.student_id IS NOT NULL
+        ''',
+    }
+    violations = []
+    for description, query in checks.items():
+        count = conn.execute(query).fetchone()[0]
+        if count:
+            violations.append(f"{count} {description}")
+    return violations
+
+
+def stress(path, writers, seconds, seed):
+    # Runs `writers` desks as separate processes against one database, then checks that
+    # no PC or student ended up in two sessions
+    if not os.path.exists(path):
+        sys.exit(f"{path} does not exist; create it with the generate command")
+
+    with multiprocessing.Pool(writers) as pool:
+        results = pool.starmap(stress_writer, [(path, seconds, seed + writer) for writer in range(writers)])
+
+    totals = {name: sum(result[name] for result in results) for name in results[0]}
+    print(f"{writers} writers for {seconds} s: {totals['assigned']} assigned "
+          f"({totals['assigned'] / seconds:.1f}/s), {totals['released']} released, "
+          f"{totals['rejected']} rejected, {totals['locked']} gave up on a locked database")
+
+    store = LibraryStore(path)
+    violations = session_violations(store)
+    store.close()
+    for violation in violations:
+        print(f"FAILED: {violation}")
+    if violations:
+        sys.exit(1)
+    print("No double assignments")
+
+
+def serve_api(path, addresses):
+    # Runs library_api in this process, reporting the port it got through addresses
+    from library_api import LibraryApi
+
+    async def serve():
+        started = asyncio.get_running_loop().create_future()
+        started.add_done_callback(lambda future: addresses.put(future.result()))
+        await LibraryApi(LibraryStore(path)).serve("127.0.0.1", 0, started)
+
+    asyncio.run(serve())
+
+
+async def api_client(host, port, seconds, students, seed, latencies, statuses):
+    # One kiosk on a keep-alive connection: mostly reads, with an assign and release now and then
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def request(method, target, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        writer.write(f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(payload)}\r\n\r\n"
+                     .encode() + payload)
+        start = time.perf_counter()
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        response = json.loads(await reader.readexactly(length))
+        latencies.append((time.perf_counter() - start) * 1000)
+        status = int(head.split(b" ")[1])
+        statuses[status] = statuses.get(status, 0) + 1
+        return status, response
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        choice = rng.random()
+        student_id = rng.randint(1, students)
+        if choice < 0.4:
+            await request("GET", "/pcs/vacant")
+        elif choice < 0.7:
+            await request("GET", f"/students/{student_id}")
+        elif choice < 0.8:
+            await request("GET", "/sessions")
+        elif choice < 0.9:
+            await request("GET", f"/history?student_id={student_id}&limit=20")
+        else:
+            status, vacant = await request("GET", "/pcs/vacant")
+            if vacant["pcs"]:
+                status, _ = await request("POST", "/sessions", {"student_id": student_id,
+                                                                 "pc_id": rng.choice(vacant["pcs"])})
+                if status == 201:
+                    await request("DELETE", f"/sessions/{student_id}")
+    writer.close()
+
+
+def api_load(path, clients, seconds, seed):
+    # Starts the API in its own process and measures it from local clients in this one
+    if not os.path.exists(path):
+        sys.exit(f"{path} does not exist; create it with the generate command")
+
+    addresses = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_api, args=(path, addresses), daemon=True)
+    server.start()
+    host, port = addresses.get(timeout=30)
+    store = LibraryStore(path)
+    students = store.conn.execute("SELECT MAX(student_id) FROM students").fetchone()[0]
+    store.close()
+
+    latencies = []
+    statuses = {}
+
+    async def load():
+        await asyncio.gather(*(api_client(host, port, seconds, students, seed + client, latencies, statuses)
+                               for client in range(clients)))
+
+    try:
+        asyncio.run(load())
+    finally:
+        server.terminate()
+
+    latencies.sort()
+    print(f"{clients} clients for {seconds} s: {len(latencies) / seconds:.0f} requests/s, "
+          f"p50 {latencies[len(latencies) // 2]:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms")
+    print("Responses: " + ", ".join(f"{count} x {status}" for status, count in sorted(statuses.items())))
+
+
+def run(path, repeat, gui, output, baseline_path):
+    if not os.path.exists(path):
+        sys.exit(f"{path} does not exist; create it with the generate command")
+
+    store = LibraryStore(path)
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "dataset": dataset(store),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "results": {"queries": query_benchmarks(store, repeat)},
+    }
+    if gui:
+        results["results"]["widgets"] = widget_benchmarks(store, repeat)
+    store.close()
+
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    for group, benchmarks in results["results"].items():
+        for name, timing in benchmarks.items():
+            print(f"{group}.{name:45} median {timing['median_ms']:10.2f} ms  min {timing['min_ms']:10.2f} ms")
+    print(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Library PC Management benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("generate", help="create a database filled with synthetic data")
+    command.add_argument("path")
+    command.add_argument("--students", type=int, default=50000)
+    command.add_argument("--pcs", type=int, default=2000)
+    command.add_argument("--reservations", type=int, default=10000000)
+    command.add_argument("--days", type=int, default=3 * 365, help="days of history to spread sessions over")
+    command.add_argument("--seed", type=int, default=1)
+
+    command = commands.add_parser("run", help="time queries and widget refreshes against a database")
+    command.add_argument("path")
+    command.add_argument("--repeat", type=int, default=5)
+    command.add_argument("--no-gui", action="store_true", help="skip the widget benchmarks")
+    command.add_argument("--output", default="library_bench.json", help="JSON results file")
+    command.add_argument("--compare", metavar="JSON", help="print changes against an earlier results file")
+
+    command = commands.add_parser("stress", help="assign and release from several processes at once")
+    command.add_argument("path")
+    command.add_argument("--writers", type=int, default=4, help="number of concurrent desk processes")
+    command.add_argument("--seconds", type=float, default=10)
+    command.add_argument("--seed", type=int, default=1)
+
+    command = commands.add_parser("api", help="measure the JSON API under concurrent local clients")
+    command.add_argument("path")
+    command.add_argument("--clients", type=int, default=20, help="number of concurrent keep-alive clients")
+    command.add_argument("--seconds", type=float, default=10)
+    command.add_argument("--seed", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate(args.path, args.students, args.pcs, args.reservations, args.days, args.seed)
+    elif args.command == "stress":
+        stress(args.path, args.writers, args.seconds, args.seed)
+    elif args.command == "api":
+        api_load(args.path, args.clients, args.seconds, args.seed)
+    else:
+        run(args.path, args.repeat, not args.no_gui, args.output, args.compare)
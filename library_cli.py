@@ -0,0 +1,305 @@
+# Command-line access to the library database. Only library_core is imported, so
+# commands start without loading Qt and work without a display.
+import argparse
+import sys
+from datetime import date, timedelta
+from library_core import (
+    ALLOCATION_POLICIES, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, BACKUP_KEEP, BACKUP_STEP_PAGES, EXPORT_COLUMNS,
+    AssignmentError, MAX_SESSION_SECONDS, BackupError, BookingError, HistoryFilters, Instrumentation,
+    LibraryStore, PcAllocator, check_query_plans, clock_time, format_booking_time, local_epoch, parse_booking_time,
+    restore_backup
+)
+
+
+def assign(store, args):
+    try:
+        entry_time = store.open_session(args.student_id, args.pc_id)
+    except AssignmentError as error:
+        sys.exit(str(error))
+    print(f"Assigned {args.pc_id} to {args.student_id} at {entry_time}")
+
+
+def assign_next(store, args):
+    try:
+        pc_id, entry_time = PcAllocator(store, args.policy).assign_next(args.student_id)
+    except AssignmentError as error:
+        sys.exit(str(error))
+    print(f"Assigned {pc_id} to {args.student_id} at {entry_time}")
+
+
+def release(store, args):
+    closed = store.close_session(args.student_id)
+    if closed is None:
+        sys.exit(f"Student {args.student_id} has no open session.")
+
+    pc_id, exit_time, duration = closed
+    print(f"Released {pc_id} at {exit_time} after {duration}")
+
+
+def print_closed(closed):
+    for student_id, pc_id, exit_time, duration in closed:
+        print(f"Released {pc_id} from {student_id} at {exit_time} after {duration}")
+
+
+def release_all(store, args):
+    print_closed(store.close_sessions())
+
+
+def expire(store, args):
+    # Meant to run from cron, e.g. every few minutes
+    print_closed(store.expire_sessions(int(args.max_hours * 3600), args.closing_time))
+
+
+def list_vacant(store, args):
+    for pc_id in store.vacant_pcs():
+        print(pc_id)
+
+
+def history_filters(args):
+    return HistoryFilters(args.date, args.student, args.pc)
+
+
+def history(store, args):
+    print("\t".join(EXPORT_COLUMNS))
+    for row in store.history(history_filters(args), limit=args.limit):
+        print("\t".join(str(value) for value in row[:len(EXPORT_COLUMNS)]))
+
+
+def print_import_result(result):
+    print(f"Imported {result.imported} rows")
+    for line, reason in result.rejected:
+        print(f"Line {line}: {reason}")
+
+
+def import_rows(store, args):
+    try:
+        if args.kind == "students":
+            print_import_result(store.import_students(args.path))
+        else:
+            print_import_result(store.import_pcs(args.path))
+    except (OSError, ValueError) as error:
+        sys.exit(f"Import failed: {error}")
+
+
+def export(store, args):
+    try:
+        written = store.export_history(args.path, history_filters(args))
+    except OSError as error:
+        sys.exit(f"Export failed: {error}")
+    print(f"Exported {written} rows to {args.path}")
+
+
+def archive(store, args):
+    moved = store.archive_sessions(args.days, args.batch_size, progress=lambda moved: print(f"Archived {moved} sessions"))
+    print(f"Moved {moved} sessions to {store.archive_path}")
+    if args.vacuum:
+        store.vacuum()
+
+
+def print_backup_result(action, result):
+    check = "" if result.check is None else f", quick_check {result.check}"
+    print(f"{action} {result.pages} pages in {result.seconds:.2f} s ({result.pages_per_second:.0f} pages/s): "
+          f"{result.path}, {result.bytes / 1024 / 1024:.1f} MB{check}")
+
+
+def backup(store, args):
+    # Meant to run from cron; desks can keep working while it runs
+    try:
+        result = store.backup(args.dir, args.keep, args.check, args.pages)
+    except (OSError, BackupError) as error:
+        sys.exit(f"Backup failed: {error}")
+    print_backup_result("Backed up", result)
+
+
+def restore(store, args):
+    try:
+        result = restore_backup(args.snapshot, store.path, args.pages)
+    except (OSError, BackupError) as error:
+        sys.exit(f"Restore failed: {error}")
+    print_backup_result("Restored", result)
+
+
+def booking_time(text):
+    try:
+        return parse_booking_time(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD HH:MM, got {text!r}")
+
+
+def iso_date(text):
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {text!r}")
+
+
+def book(store, args):
+    try:
+        booking_id = store.add_booking(args.pc_id, args.start, args.end, args.student, args.note)
+    except BookingError as error:
+        sys.exit(str(error))
+    print(f"Booked {args.pc_id} as booking {booking_id}")
+
+
+def list_bookings(store, args):
+    day = date.fromisoformat(args.date) if args.date else date.today()
+    print("booking_id\tpc_id\tstudent_id\tname\tstart\tend\tnote")
+    for booking in store.bookings(local_epoch(day), local_epoch(day + timedelta(days=args.days))):
+        print(f"{booking.booking_id}\t{booking.pc_id}\t{booking.student_id or ''}\t{booking.name or 'Maintenance'}\t"
+              f"{format_booking_time(booking.start_time)}\t{format_booking_time(booking.end_time)}\t{booking.note}")
+
+
+def cancel_booking(store, args):
+    if not store.cancel_booking(args.booking_id):
+        sys.exit(f"There is no booking {args.booking_id}.")
+    print(f"Cancelled booking {args.booking_id}")
+
+
+def free_pcs(store, args):
+    for pc_id in store.free_pcs(args.start, args.end):
+        print(pc_id)
+
+
+def check_plans(store, args):
+    # Exits non-zero if any hot query scans a whole table, so it can gate a deploy
+    full_scans = check_query_plans(store.conn)
+    for name, scans in full_scans.items():
+        print(f"{name}: {'; '.join(scans)}")
+    if full_scans:
+        sys.exit(1)
+
+
+def diagnostics(store, args):
+    for name, value in store.database_stats():
+        print(f"{name}: {value}")
+
+
+def print_timings(store):
+    print("kind\tcount\tp50_ms\tp95_ms\tp99_ms\tmax_ms\tname", file=sys.stderr)
+    for timing in store.instrumentation.timings():
+        print(f"{timing.kind}\t{timing.count}\t{timing.p50}\t{timing.p95}\t{timing.p99}\t{timing.max}\t{timing.name}",
+              file=sys.stderr)
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--date", type=iso_date, help="only sessions that started on this day (YYYY-MM-DD)")
+    parser.add_argument("--student", help="only sessions of this student ID")
+    parser.add_argument("--pc", help="only sessions on this PC ID")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Library PC Management from the command line")
+    parser.add_argument("--db", help="database file (default: $LIBRARY_PC_DB or library_pc.db)")
+    parser.add_argument("--slow-ms", type=float, help="log statements slower than this (default: $LIBRARY_PC_SLOW_MS or 100)")
+    parser.add_argument("--slow-log", help="file to append slow statements to")
+    parser.add_argument("--timings", action="store_true", help="print statement timings to stderr when done")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("assign", help="assign a vacant PC to a student")
+    command.add_argument("student_id")
+    command.add_argument("pc_id")
+    command.set_defaults(run=assign)
+
+    command = commands.add_parser("assign-next", help="assign the next vacant PC chosen by a policy")
+    command.add_argument("student_id")
+    command.add_argument("--policy", choices=ALLOCATION_POLICIES, default="lowest-id")
+    command.set_defaults(run=assign_next)
+
+    command = commands.add_parser("release", help="end a student's open session")
+    command.add_argument("student_id")
+    command.set_defaults(run=release)
+
+    command = commands.add_parser("release-all", help="end every open session")
+    command.set_defaults(run=release_all)
+
+    command = commands.add_parser("expire", help="end sessions that ran past the time limit or closing time")
+    command.add_argument("--max-hours", type=float, default=MAX_SESSION_SECONDS / 3600,
+                         help=f"end sessions after this many hours, 0 for never (default: {MAX_SESSION_SECONDS / 3600:g})")
+    command.add_argument("--closing-time", type=clock_time, help="end every session at this time of day (HH:MM)")
+    command.set_defaults(run=expire)
+
+    command = commands.add_parser("list-vacant", help="list the vacant PCs")
+    command.set_defaults(run=list_vacant)
+
+    command = commands.add_parser("book", help="book a PC for a student, or block it for maintenance")
+    command.add_argument("pc_id")
+    command.add_argument("start", type=booking_time, help="YYYY-MM-DD HH:MM")
+    command.add_argument("end", type=booking_time, help="YYYY-MM-DD HH:MM")
+    command.add_argument("--student", help="student ID; without one the PC is blocked for maintenance")
+    command.add_argument("--note", default="")
+    command.set_defaults(run=book)
+
+    command = commands.add_parser("bookings", help="list bookings, tab separated")
+    command.add_argument("--date", type=iso_date, help="first day (YYYY-MM-DD, default: today)")
+    command.add_argument("--days", type=int, default=1, help="number of days (default: 1)")
+    command.set_defaults(run=list_bookings)
+
+    command = commands.add_parser("cancel-booking", help="cancel a booking")
+    command.add_argument("booking_id", type=int)
+    command.set_defaults(run=cancel_booking)
+
+    command = commands.add_parser("free-pcs", help="list PCs without a booking between two times")
+    command.add_argument("start", type=booking_time, help="YYYY-MM-DD HH:MM")
+    command.add_argument("end", type=booking_time, help="YYYY-MM-DD HH:MM")
+    command.set_defaults(run=free_pcs)
+
+    command = commands.add_parser("history", help="print the most recent sessions, tab separated")
+    add_filter_arguments(command)
+    command.add_argument("--limit", type=int, default=50, help="number of sessions to print (default: 50)")
+    command.set_defaults(run=history)
+
+    command = commands.add_parser("import", help="import students or PCs from a CSV file")
+    command.add_argument("kind", choices=("students", "pcs"))
+    command.add_argument("path")
+    command.set_defaults(run=import_rows)
+
+    command = commands.add_parser("export", help="export the history to CSV, or JSON Lines for .jsonl paths")
+    command.add_argument("path")
+    add_filter_arguments(command)
+    command.set_defaults(run=export)
+
+    command = commands.add_parser("archive", help="move old closed sessions to the archive database")
+    command.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                         help=f"keep sessions that started in the last this many days (default: {ARCHIVE_AFTER_DAYS})")
+    command.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE,
+                         help=f"sessions moved per transaction (default: {ARCHIVE_BATCH_SIZE})")
+    command.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    command.set_defaults(run=archive)
+
+    command = commands.add_parser("backup", help="write a compressed snapshot of the database while it is in use")
+    command.add_argument("--dir", help="snapshot directory (default: backups/ next to the database)")
+    command.add_argument("--keep", type=int, default=BACKUP_KEEP,
+                         help=f"number of snapshots to keep (default: {BACKUP_KEEP})")
+    command.add_argument("--check", action="store_true", help="run PRAGMA quick_check on the copy")
+    command.add_argument("--pages", type=int, default=BACKUP_STEP_PAGES,
+                         help=f"pages copied per step (default: {BACKUP_STEP_PAGES})")
+    command.set_defaults(run=backup)
+
+    command = commands.add_parser("restore", help="replace the database with a snapshot; close the desk windows first")
+    command.add_argument("snapshot", help="a .db.gz file written by backup")
+    command.add_argument("--pages", type=int, default=BACKUP_STEP_PAGES,
+                         help=f"pages copied per step (default: {BACKUP_STEP_PAGES})")
+    command.set_defaults(run=restore)
+
+    command = commands.add_parser("check-plans", help="list hot queries that scan a whole table")
+    command.set_defaults(run=check_plans)
+
+    command = commands.add_parser("diagnostics", help="print database page and cache stats")
+    command.set_defaults(run=diagnostics)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = LibraryStore(args.db, Instrumentation(args.slow_ms, args.slow_log))
+    try:
+        args.run(store, args)
+    finally:
+        if args.timings:
+            print_timings(store)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1926 @@
+# Students, PCs, sessions and history, with no Qt dependency so scripts and the CLI
+# can use them without a display
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime, timedelta
+
+# Database used when no path is given; LIBRARY_PC_DB overrides it
+DEFAULT_DB_PATH = os.environ.get("LIBRARY_PC_DB", "library_pc.db")
+# Statements and views slower than this many milliseconds go to the slow log
+DEFAULT_SLOW_MS = float(os.environ.get("LIBRARY_PC_SLOW_MS", "100"))
+DEFAULT_SLOW_LOG = os.environ.get("LIBRARY_PC_SLOW_LOG")
+
+# Times are stored as epoch seconds and formatted by SQLite, so rows need no parsing in Python
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+BOOKING_TIME_FORMAT = "%Y-%m-%d %H:%M"
+ENTRY_TIME_TEXT = f"strftime('{TIME_FORMAT}', reservations.entry_time, 'unixepoch', 'localtime')"
+EXIT_TIME_TEXT = f"COALESCE(strftime('{TIME_FORMAT}', reservations.exit_time, 'unixepoch', 'localtime'), '')"
+DURATION_TEXT = (
+    "CASE WHEN reservations.duration IS NULL THEN '' ELSE "
+    "printf('%d:%02d:%02d', reservations.duration / 3600, reservations.duration / 60 % 60, reservations.duration % 60) END"
+)
+
+# Student names are filled in from LibraryStore.student_cache rather than joined
+ACTIVE_SESSIONS_QUERY = (
+    f"SELECT reservations.student_id, computers.pc_id, {ENTRY_TIME_TEXT} "
+    "FROM reservations "
+    "JOIN computers ON computers.pc_id = reservations.pc_id "
+    "WHERE computers.status != 'Vacant' AND reservations.exit_time IS NULL "
+    "ORDER BY reservations.entry_time ASC"
+)
+
+
+def history_select(table, epochs=False):
+    # The history columns read from one reservations table, which is aliased so
+    # the same conditions work on the live and the archived sessions. With epochs
+    # set the times are left as epoch seconds, as HistoryColumns stores them.
+    if epochs:
+        columns = "reservations.entry_time, reservations.exit_time, reservations.reservation_id"
+    else:
+        columns = (f"{ENTRY_TIME_TEXT}, {EXIT_TIME_TEXT}, {DURATION_TEXT}, "
+                   "reservations.entry_time, reservations.reservation_id")
+    return (
+        f"SELECT reservations.student_id, computers.pc_id, {columns} "
+        f"FROM {table} AS reservations "
+        "JOIN computers ON computers.pc_id = reservations.pc_id "
+    )
+
+
+VACANT_PCS_QUERY = "SELECT pc_id FROM computers WHERE status = 'Vacant'"
+
+CLOSE_SESSION_QUERY = "UPDATE reservations SET exit_time = ? WHERE student_id = ? AND exit_time IS NULL"
+
+
+def create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS students (
+            student_id INTEGER PRIMARY KEY,
+            name TEXT,
+            course TEXT,
+            contact TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS computers (
+            pc_id TEXT PRIMARY KEY,
+            student_id INTEGER,
+            status TEXT DEFAULT 'Vacant',
+            FOREIGN KEY (student_id) REFERENCES students(student_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reservations (
+            student_id INTEGER,
+            pc_id TEXT,
+            entry_time TEXT,
+            exit_time TEXT,
+            FOREIGN KEY (student_id) REFERENCES students(student_id),
+            FOREIGN KEY (pc_id) REFERENCES computers(pc_id)
+        )
+    ''')
+
+
+def add_reservation_indexes(conn):
+    # Open sessions are a handful of rows, so partial indexes keep them cheap to find
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_open ON reservations (student_id) WHERE exit_time IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_open_entry ON reservations (entry_time) WHERE exit_time IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_student_entry ON reservations (student_id, entry_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_pc_entry ON reservations (pc_id, entry_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_entry ON reservations (entry_time)")
+
+
+def add_computer_status_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_computers_status ON computers (status)")
+
+
+def convert_reservation_times_to_epoch(conn):
+    # Column affinity would turn integers back into text, so the table is rebuilt
+    # with INTEGER times. Old rows were written in local time, hence the 'utc' modifier.
+    conn.execute('''
+        CREATE TABLE reservations_epoch (
+            reservation_id INTEGER PRIMARY KEY,
+            student_id INTEGER,
+            pc_id TEXT,
+            entry_time INTEGER,
+            exit_time INTEGER,
+            duration INTEGER GENERATED ALWAYS AS (exit_time - entry_time) VIRTUAL,
+            FOREIGN KEY (student_id) REFERENCES students(student_id),
+            FOREIGN KEY (pc_id) REFERENCES computers(pc_id)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO reservations_epoch (reservation_id, student_id, pc_id, entry_time, exit_time)
+        SELECT rowid, student_id, pc_id,
+               CAST(strftime('%s', entry_time, 'utc') AS INTEGER),
+               CAST(strftime('%s', exit_time, 'utc') AS INTEGER)
+        FROM reservations
+    ''')
+    conn.execute("DROP TABLE reservations")
+    conn.execute("ALTER TABLE reservations_epoch RENAME TO reservations")
+    add_reservation_indexes(conn)
+
+
+def add_usage_rollups(conn):
+    # Per-day totals kept up to date as sessions close, so reports never rescan reservations
+    conn.execute('''
+        CREATE TABLE daily_pc_usage (
+            day TEXT,
+            pc_id TEXT,
+            sessions INTEGER,
+            seconds INTEGER,
+            PRIMARY KEY (day, pc_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE daily_course_usage (
+            day TEXT,
+            course TEXT,
+            sessions INTEGER,
+            seconds INTEGER,
+            PRIMARY KEY (day, course)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE daily_student_usage (
+            day TEXT,
+            student_id INTEGER,
+            sessions INTEGER,
+            seconds INTEGER,
+            PRIMARY KEY (day, student_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE hourly_occupancy (
+            day TEXT,
+            hour INTEGER,
+            peak INTEGER,
+            PRIMARY KEY (day, hour)
+        )
+    ''')
+    # Finds the sessions overlapping a day when its hourly peaks are recomputed
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_exit ON reservations (exit_time)")
+    rebuild_rollups(conn)
+
+
+def make_open_sessions_unique(conn):
+    # A student or a PC can have only one open session. Duplicates left by desks racing
+    # each other are closed when the newer session began, before the unique indexes go in.
+    duplicates = conn.execute('''
+        SELECT older.reservation_id, older.student_id, students.course, older.pc_id, older.entry_time,
+               MIN(newer.entry_time)
+        FROM reservations older
+        JOIN reservations newer ON newer.exit_time IS NULL AND newer.reservation_id > older.reservation_id
+                               AND (newer.student_id = older.student_id OR newer.pc_id = older.pc_id)
+        LEFT JOIN students ON students.student_id = older.student_id
+        WHERE older.exit_time IS NULL
+        GROUP BY older.reservation_id
+    ''').fetchall()
+    for reservation_id, student_id, course, pc_id, entry_time, exit_time in duplicates:
+        exit_time = max(entry_time, exit_time)
+        conn.execute("UPDATE reservations SET exit_time = ? WHERE reservation_id = ?", (exit_time, reservation_id))
+        add_to_rollups(conn, student_id, course, pc_id, entry_time, exit_time)
+        refresh_hourly_occupancy(conn, entry_time, exit_time)
+
+    conn.execute("DROP INDEX IF EXISTS idx_reservations_open")
+    conn.execute("CREATE UNIQUE INDEX idx_reservations_open ON reservations (student_id) WHERE exit_time IS NULL")
+    conn.execute("CREATE UNIQUE INDEX idx_reservations_open_pc ON reservations (pc_id) WHERE exit_time IS NULL")
+
+    # Bring PC statuses back in line with the open sessions
+    conn.execute('''
+        UPDATE computers SET
+            student_id = (SELECT student_id FROM reservations WHERE pc_id = computers.pc_id AND exit_time IS NULL),
+            status = CASE WHEN EXISTS (SELECT 1 FROM reservations WHERE pc_id = computers.pc_id AND exit_time IS NULL)
+                          THEN 'Assigned' ELSE 'Vacant' END
+    ''')
+
+
+def add_student_search(conn):
+    # An external-content FTS5 index over the students table, kept in step by triggers.
+    # SQLite builds without FTS5 skip it; search then falls back to LIKE.
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE students_fts USING fts5(
+                name, contact, course,
+                content = 'students', content_rowid = 'student_id',
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        ''')
+    except sqlite3.OperationalError as error:
+        if "fts5" not in str(error):
+            raise
+        return
+
+    conn.execute('''
+        CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, name, contact, course)
+            VALUES (new.student_id, new.name, new.contact, new.course);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name, contact, course)
+            VALUES ('delete', old.student_id, old.name, old.contact, old.course);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER students_fts_update AFTER UPDATE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name, contact, course)
+            VALUES ('delete', old.student_id, old.name, old.contact, old.course);
+            INSERT INTO students_fts (rowid, name, contact, course)
+            VALUES (new.student_id, new.name, new.contact, new.course);
+        END
+    ''')
+    conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+def add_bookings(conn):
+    # Time slots held on a PC in advance, by a student or, without one, for maintenance.
+    # Checks on one PC walk its upcoming bookings in idx_bookings_pc_end. Lab-wide
+    # overlap queries use bookings_span, an R*Tree over the booking intervals, so they
+    # only visit bookings near the window however many are upcoming.
+    conn.execute('''
+        CREATE TABLE bookings (
+            booking_id INTEGER PRIMARY KEY,
+            pc_id TEXT NOT NULL,
+            student_id INTEGER,
+            start_time INTEGER NOT NULL,
+            end_time INTEGER NOT NULL,
+            note TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY (student_id) REFERENCES students(student_id),
+            FOREIGN KEY (pc_id) REFERENCES computers(pc_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_bookings_pc_end ON bookings (pc_id, end_time)")
+    conn.execute("CREATE INDEX idx_bookings_end ON bookings (end_time)")
+
+    # SQLite builds without R*Tree skip it; queries then range scan idx_bookings_end.
+    # R*Tree keeps 32-bit floats, rounded outwards, so its matches are checked again
+    # against the exact times in bookings.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE bookings_span USING rtree(booking_id, start_time, end_time)")
+    except sqlite3.OperationalError as error:
+        if "rtree" not in str(error):
+            raise
+        return
+
+    conn.execute('''
+        CREATE TRIGGER bookings_span_insert AFTER INSERT ON bookings BEGIN
+            INSERT INTO bookings_span VALUES (new.booking_id, new.start_time, new.end_time);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER bookings_span_delete AFTER DELETE ON bookings BEGIN
+            DELETE FROM bookings_span WHERE booking_id = old.booking_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER bookings_span_update AFTER UPDATE ON bookings BEGIN
+            UPDATE bookings_span SET start_time = new.start_time, end_time = new.end_time
+            WHERE booking_id = old.booking_id;
+        END
+    ''')
+
+
+# Schema migrations in the order they are applied. PRAGMA user_version holds the
+# number of migrations already applied, so only append to this list.
+MIGRATIONS = [
+    create_base_tables,
+    add_reservation_indexes,
+    add_computer_status_index,
+    convert_reservation_times_to_epoch,
+    add_usage_rollups,
+    make_open_sessions_unique,
+    add_student_search,
+    add_bookings,
+]
+
+
+def migrate(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+
+    # The version is read again under the write lock, so processes starting together migrate once
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            return
+        try:
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# Closed sessions that started more than this many days ago are moved to the archive
+# database, in transactions of ARCHIVE_BATCH_SIZE sessions
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def archive_path_for(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}-archive{extension or '.db'}"
+
+
+# Backups copy BACKUP_STEP_PAGES pages at a time and pause BACKUP_STEP_PAUSE seconds between
+# steps, so desks keep writing and the GUI thread gets the GIL. BACKUP_KEEP snapshots are kept.
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.005
+BACKUP_KEEP = 7
+# gzip level 1 compresses in under half the time of level 6, for files about 7% larger
+BACKUP_COMPRESS_LEVEL = 1
+
+
+def backup_dir_for(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), "backups")
+
+
+def backup_snapshots(directory, path):
+    # The snapshots of the database at path in directory, oldest first
+    root = os.path.splitext(os.path.basename(path))[0]
+    pattern = re.compile(rf"{re.escape(root)}-\d{{8}}-\d{{6}}\.db\.gz")
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if pattern.fullmatch(name))
+
+
+def copy_pages(source, target, name="main", pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    # Copies one schema of source into target with the backup API and returns the page count
+    copied = [0]
+
+    def step(status, remaining, total):
+        copied[0] = total
+        time.sleep(pause)
+
+    source.backup(target, pages=pages, progress=step, name=name)
+    return copied[0]
+
+
+def compress_file(path):
+    # Writes path.gz next to path
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb", compresslevel=BACKUP_COMPRESS_LEVEL) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+def check_copy(path):
+    # Runs PRAGMA quick_check on a copied database and returns "ok" or raises BackupError
+    conn = sqlite3.connect(path)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check")]
+    except sqlite3.DatabaseError as error:
+        raise BackupError(f"{path} is not a usable database: {error}")
+    finally:
+        conn.close()
+    if problems != ["ok"]:
+        raise BackupError(f"{path} failed quick_check: {'; '.join(problems[:5])}")
+    return "ok"
+
+
+def remove_files(*paths):
+    for path in paths:
+        for name in (path, path + "-wal", path + "-shm", path + "-journal"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def restore_backup(snapshot, path=None, pages=BACKUP_STEP_PAGES):
+    # Replaces the database at path, and its archive if the snapshot has one, with a snapshot
+    # written by LibraryStore.backup. Every file is unpacked and checked before anything is
+    # written, then copied in through the backup API, so a desk still holding the database
+    # open sees the restored data rather than half of it.
+    path = path or DEFAULT_DB_PATH
+    started = time.perf_counter()
+    restores = [(snapshot, path)]
+    archive_snapshot = archive_path_for(snapshot[:-len(".gz")]) + ".gz"
+    if os.path.exists(archive_snapshot):
+        restores.append((archive_snapshot, archive_path_for(path)))
+    copies = [(source_path, target_path, target_path + ".restore") for source_path, target_path in restores]
+
+    total = 0
+    copy_seconds = 0
+    try:
+        for source_path, target_path, copy_path in copies:
+            with gzip.open(source_path, "rb") as source_file, open(copy_path, "wb") as copy_file:
+                shutil.copyfileobj(source_file, copy_file, 1024 * 1024)
+            check_copy(copy_path)
+
+        for source_path, target_path, copy_path in copies:
+            source = sqlite3.connect(copy_path)
+            target = sqlite3.connect(target_path)
+            try:
+                target.execute("PRAGMA busy_timeout = 5000")
+                copy_started = time.perf_counter()
+                total += copy_pages(source, target, pages=pages)
+                copy_seconds += time.perf_counter() - copy_started
+            finally:
+                source.close()
+                target.close()
+    finally:
+        remove_files(*(copy_path for source_path, target_path, copy_path in copies))
+
+    seconds = time.perf_counter() - started
+    return BackupResult(path, total, seconds, total / copy_seconds if copy_seconds else 0, os.path.getsize(path), "ok")
+
+
+def create_archive_tables(conn):
+    # The archive has no migrations of its own: it only ever holds closed sessions,
+    # in the current reservations layout
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.reservations (
+            reservation_id INTEGER PRIMARY KEY,
+            student_id INTEGER,
+            pc_id TEXT,
+            entry_time INTEGER,
+            exit_time INTEGER,
+            duration INTEGER GENERATED ALWAYS AS (exit_time - entry_time) VIRTUAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_reservations_student_entry ON reservations (student_id, entry_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_reservations_pc_entry ON reservations (pc_id, entry_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_reservations_entry ON reservations (entry_time)")
+
+
+def local_epoch(day):
+    return int(time.mktime(day.timetuple()))
+
+
+def format_timestamp(epoch):
+    return time.strftime(TIME_FORMAT, time.localtime(epoch))
+
+
+def parse_booking_time(text):
+    # Local "YYYY-MM-DD HH:MM" to epoch seconds
+    return int(time.mktime(time.strptime(text, BOOKING_TIME_FORMAT)))
+
+
+def format_booking_time(epoch):
+    return time.strftime(BOOKING_TIME_FORMAT, time.localtime(epoch))
+
+
+def parse_timestamp(text):
+    return int(time.mktime(time.strptime(text, TIME_FORMAT)))
+
+
+def format_duration(seconds):
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def history_filter_query(filter_date=None, filter_student_id=None, filter_pc_id=None, after=None, limit=None,
+                         archived=False, since=None, epochs=False):
+    # With archived set, the archive database is read too; both sides are walked in
+    # entry time order and merged, so a page still stops after limit rows
+    filters, params = history_conditions(filter_date, filter_student_id, filter_pc_id, since)
+
+    if after is not None:
+        # Keyset pagination: continue below the last (entry_time, reservation_id) already loaded
+        filters.append("(reservations.entry_time, reservations.reservation_id) < (?, ?)")
+        params.extend(after)
+
+    where = "WHERE " + " AND ".join(filters) if filters else ""
+    query = history_select("main.reservations", epochs) + where
+    if archived:
+        query += " UNION ALL " + history_select("archive.reservations", epochs) + where
+        params = params * 2
+    query += " ORDER BY reservations.entry_time DESC, reservations.reservation_id DESC"
+
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def history_conditions(filter_date=None, filter_student_id=None, filter_pc_id=None, since=None):
+    # WHERE conditions on reservations only, so they also work without the joins
+    filters = []
+    params = []
+
+    if since is not None:
+        filters.append("reservations.entry_time >= ?")
+        params.append(since)
+
+    if filter_date is not None:
+        # The local day as a range of epoch seconds, which the entry_time index can serve
+        day = date.fromisoformat(filter_date)
+        filters.append("reservations.entry_time >= ? AND reservations.entry_time < ?")
+        params.extend([local_epoch(day), local_epoch(day + timedelta(days=1))])
+
+    if filter_student_id is not None:
+        filters.append("reservations.student_id = ?")
+        params.append(filter_student_id)
+
+    if filter_pc_id is not None:
+        filters.append("reservations.pc_id = ?")
+        params.append(filter_pc_id)
+
+    return filters, params
+
+
+# Scanning one of these only touches open sessions, however large the table grows
+OPEN_SESSION_INDEXES = ("idx_reservations_open", "idx_reservations_open_pc", "idx_reservations_open_entry")
+
+
+def check_query_plans(conn):
+    # Returns the hot queries whose plan scans a whole students or reservations table.
+    # The computers table is bounded by the number of PCs in the lab, so scans of it are fine.
+    today = date.today().isoformat()
+    hot_queries = {
+        "active sessions": (ACTIVE_SESSIONS_QUERY, []),
+        "close session": (CLOSE_SESSION_QUERY, ["", 0]),
+        "vacant pcs": (VACANT_PCS_QUERY, []),
+        "history by date": history_filter_query(filter_date=today),
+        "history by student": history_filter_query(filter_student_id=0),
+        "history by pc": history_filter_query(filter_pc_id=""),
+    }
+
+    full_scans = {}
+    for name, (query, params) in hot_queries.items():
+        plan = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        scans = [detail for _, _, _, detail in plan if full_scan(detail)]
+        if scans:
+            full_scans[name] = scans
+    return full_scans
+
+
+def full_scan(detail):
+    # Whether an EXPLAIN QUERY PLAN line scans all of students or reservations. SQLite before
+    # 3.36 writes "SCAN TABLE reservations", later versions "SCAN reservations".
+    words = detail.split()
+    if words[:2] == ["SCAN", "TABLE"]:
+        del words[1]
+    if words[0] != "SCAN" or len(words) < 2 or words[1] not in ("students", "reservations"):
+        return False
+    return words[-1] not in OPEN_SESSION_INDEXES
+
+
+# Hours a day the library is open, the denominator of PC utilization
+OPENING_HOURS_PER_DAY = 12
+
+
+def day_bounds(day):
+    return local_epoch(day), local_epoch(day + timedelta(days=1))
+
+
+def day_segments(entry_time, exit_time):
+    # Splits a session at local midnights into (day, seconds) pieces
+    day = date.fromtimestamp(entry_time)
+    while True:
+        day_start, day_end = day_bounds(day)
+        yield day, min(exit_time, day_end) - max(entry_time, day_start)
+        if exit_time <= day_end:
+            break
+        day += timedelta(days=1)
+
+
+def hourly_peaks(sessions, day):
+    # Sweep line over the entry/exit events that fall on the day, tracking how many
+    # sessions are open and the most seen in each hour
+    day_start, day_end = day_bounds(day)
+    events = []
+    for entry_time, exit_time in sessions:
+        start, end = max(entry_time, day_start), min(exit_time, day_end)
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    # At equal times exits (-1) sort first, so back-to-back sessions don't overlap
+    events.sort()
+
+    peaks = [0] * 24
+    occupied = 0
+    hour = 0
+    for event_time, change in events:
+        event_hour = min(23, (event_time - day_start) // 3600)
+        # Hours without events keep the occupancy carried into them, unless the
+        # event lands exactly on the hour and changes it first
+        while hour < event_hour:
+            hour += 1
+            if hour < event_hour or event_time > day_start + hour * 3600:
+                peaks[hour] = max(peaks[hour], occupied)
+        occupied += change
+        peaks[hour] = max(peaks[hour], occupied)
+    return peaks
+
+
+# Rollup tables and the column each one totals by
+ROLLUP_TABLES = (("daily_pc_usage", "pc_id"), ("daily_course_usage", "course"), ("daily_student_usage", "student_id"))
+
+
+def rollup_rows(student_id, course, pc_id, entry_time, exit_time):
+    # Yields (table, day, key, sessions, seconds) for each rollup row a closed session adds to
+    keys = (pc_id, course or "Unknown", student_id)
+    for index, (day, seconds) in enumerate(day_segments(entry_time, exit_time)):
+        # A session counts once, on the day it started
+        sessions = 1 if index == 0 else 0
+        for (table, _), key in zip(ROLLUP_TABLES, keys):
+            yield table, day.isoformat(), key, sessions, seconds
+
+
+def add_to_rollups(conn, student_id, course, pc_id, entry_time, exit_time):
+    key_columns = dict(ROLLUP_TABLES)
+    for table, day, key, sessions, seconds in rollup_rows(student_id, course, pc_id, entry_time, exit_time):
+        conn.execute(
+            f"INSERT INTO {table} VALUES (?, ?, ?, ?) ON CONFLICT (day, {key_columns[table]}) DO UPDATE SET "
+            "sessions = sessions + excluded.sessions, seconds = seconds + excluded.seconds",
+            (day, key, sessions, seconds))
+
+
+def save_hourly_peaks(conn, day, peaks):
+    conn.executemany("INSERT OR REPLACE INTO hourly_occupancy VALUES (?, ?, ?)",
+                     [(day.isoformat(), hour, peak) for hour, peak in enumerate(peaks)])
+
+
+def refresh_hourly_occupancy(conn, entry_time, exit_time):
+    # Recomputes the peaks of every day the closed session touched
+    for day, _ in day_segments(entry_time, exit_time):
+        refresh_day_occupancy(conn, day)
+
+
+def refresh_day_occupancy(conn, day):
+    day_start, day_end = day_bounds(day)
+    sessions = conn.execute(
+        "SELECT entry_time, exit_time FROM reservations WHERE exit_time > ? AND entry_time < ?",
+        (day_start, day_end)).fetchall()
+    save_hourly_peaks(conn, day, hourly_peaks(sessions, day))
+
+
+def clock_time(text):
+    # Checks a local "HH:MM" time of day, as used for closing times
+    time.strptime(text, "%H:%M")
+    return text
+
+
+def session_expiry(entry_time, max_seconds=None, closing_time=None):
+    # Epoch time the session runs out: max_seconds after it started, or the first closing
+    # time ("HH:MM", local) after it started, whichever comes first. None if neither applies.
+    expiries = []
+    if max_seconds:
+        expiries.append(entry_time + max_seconds)
+    if closing_time:
+        hours, minutes = (int(part) for part in closing_time.split(":"))
+        day = date.fromtimestamp(entry_time)
+        closing = local_epoch(day) + hours * 3600 + minutes * 60
+        if closing <= entry_time:
+            closing = local_epoch(day + timedelta(days=1)) + hours * 3600 + minutes * 60
+        expiries.append(closing)
+    return min(expiries) if expiries else None
+
+
+# The epoch of the local midnight after `column`, as day_bounds() computes it in Python
+NEXT_MIDNIGHT = "CAST(strftime('%s', date({column}, 'unixepoch', 'localtime', '+1 day'), 'utc') AS INTEGER)"
+
+# Every closed session, live and archived, split at local midnights into (day, key, sessions,
+# seconds) pieces like day_segments() and rollup_rows() do; {key} is the column totalled by.
+# Archived sessions count too, or rebuilding would drop every day older than the retention window.
+ROLLUP_SEGMENTS = f'''
+    WITH RECURSIVE closed AS (
+        SELECT student_id, pc_id, entry_time, exit_time FROM main.reservations WHERE exit_time IS NOT NULL
+        UNION ALL SELECT student_id, pc_id, entry_time, exit_time FROM archive.reservations
+    ), segments (student_id, pc_id, start, exit_time, sessions) AS (
+        SELECT student_id, pc_id, entry_time, exit_time, 1 FROM closed
+        UNION ALL
+        SELECT student_id, pc_id, {NEXT_MIDNIGHT.format(column="start")}, exit_time, 0 FROM segments
+        WHERE {NEXT_MIDNIGHT.format(column="start")} < exit_time
+    )
+    SELECT date(segments.start, 'unixepoch', 'localtime') AS day, {{key}} AS key, SUM(segments.sessions),
+        SUM(MIN(segments.exit_time, {NEXT_MIDNIGHT.format(column="segments.start")}) - segments.start)
+    FROM segments LEFT JOIN students ON students.student_id = segments.student_id
+    GROUP BY day, key
+'''
+ROLLUP_KEYS = {"daily_pc_usage": "segments.pc_id", "daily_course_usage": "COALESCE(students.course, 'Unknown')",
+               "daily_student_usage": "segments.student_id"}
+
+
+def rebuild_rollups(conn):
+    # Rebuilds every rollup from the closed sessions. The daily totals are one grouped
+    # INSERT per table, so SQLite does the work without holding the history in Python.
+    # The hourly peaks need a sweep over the sessions ordered by entry time; a day's
+    # peaks are final once sessions start after it, so each day is written as it ends.
+    for table in ("daily_pc_usage", "daily_course_usage", "daily_student_usage", "hourly_occupancy"):
+        conn.execute(f"DELETE FROM {table}")
+
+    for table, _ in ROLLUP_TABLES:
+        conn.execute(f"INSERT INTO {table} " + ROLLUP_SEGMENTS.format(key=ROLLUP_KEYS[table]))
+
+    open_days = {}
+    # Day -> epoch its end, worked out once per day rather than once per session
+    day_ends = {}
+    # The earliest end of an open day, the next point at which days can be written
+    flush_at = None
+    cursor = conn.execute(
+        "SELECT entry_time, exit_time FROM main.reservations WHERE exit_time IS NOT NULL "
+        "UNION ALL SELECT entry_time, exit_time FROM archive.reservations ORDER BY entry_time")
+    for entry_time, exit_time in cursor:
+        if flush_at is not None and entry_time >= flush_at:
+            for day in [day for day in open_days if day_ends[day] <= entry_time]:
+                save_hourly_peaks(conn, day, hourly_peaks(open_days.pop(day), day))
+            flush_at = min((day_ends[day] for day in open_days), default=None)
+
+        day = date.fromtimestamp(entry_time)
+        if exit_time <= day_ends.get(day, 0):
+            days = [day]
+        else:
+            days = [day for day, _ in day_segments(entry_time, exit_time)]
+        for day in days:
+            if day not in open_days:
+                open_days[day] = []
+                end = day_ends.setdefault(day, day_bounds(day)[1])
+                flush_at = end if flush_at is None else min(flush_at, end)
+            open_days[day].append((entry_time, exit_time))
+
+    for day, sessions in open_days.items():
+        save_hourly_peaks(conn, day, hourly_peaks(sessions, day))
+
+
+STUDENT_COLUMNS = ("student_id", "name", "course", "contact")
+PC_COLUMNS = ("pc_id",)
+
+
+def validate_student_row(row):
+    values = [(row.get(column) or "").strip() for column in STUDENT_COLUMNS]
+    if not all(values):
+        raise ValueError("All of student_id, name, course and contact are required")
+    try:
+        values[0] = int(values[0])
+    except ValueError:
+        raise ValueError("student_id must be a number")
+    return values
+
+
+def validate_pc_row(row):
+    pc_id = (row.get("pc_id") or "").strip()
+    if not pc_id:
+        raise ValueError("pc_id is required")
+    return [pc_id]
+
+
+def read_import_rows(path, columns, validate, rejected):
+    # Streams (line, *values) from a CSV with a header row; invalid rows are added to rejected
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.DictReader(csv_file)
+        missing = [column for column in columns if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV file is missing the column(s): {', '.join(missing)}")
+
+        for row in reader:
+            try:
+                yield (reader.line_num, *validate(row))
+            except ValueError as error:
+                rejected.append((reader.line_num, str(error)))
+
+
+Student = namedtuple("Student", "student_id name course contact")
+StudentMatch = namedtuple("StudentMatch", "student_id name course")
+# Matches scored per student search query; a one-letter prefix can match most students
+SEARCH_CANDIDATES = 2000
+PC = namedtuple("PC", "pc_id student_id status")
+Session = namedtuple("Session", "student_id name pc_id entry_time")
+PcOccupancy = namedtuple("PcOccupancy", "pc_id student_id name entry_epoch")
+# Times are epoch seconds; student_id and name are None for maintenance blocks
+Booking = namedtuple("Booking", "booking_id pc_id student_id name start_time end_time note")
+HistoryRow = namedtuple("HistoryRow", "student_id name pc_id entry_time exit_time duration entry_epoch reservation_id")
+HistoryFilters = namedtuple("HistoryFilters", "date student_id pc_id", defaults=(None, None, None))
+ImportResult = namedtuple("ImportResult", "imported rejected")
+# seconds covers the whole job; pages_per_second only the page copy, the part that competes
+# with the desks. check is "ok" after a passing quick_check, or None when it was skipped.
+BackupResult = namedtuple("BackupResult", "path pages seconds pages_per_second bytes check")
+UsageReport = namedtuple("UsageReport", "utilization peaks courses top_users")
+
+# A failed BEGIN IMMEDIATE is retried this many times, backing off from WRITE_RETRY_DELAY seconds
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.05
+
+Timing = namedtuple("Timing", "kind name count p50 p95 p99 max")
+SlowEvent = namedtuple("SlowEvent", "time kind name ms")
+
+EXPORT_COLUMNS = ("student_id", "name", "pc_id", "entry_time", "exit_time", "duration")
+
+# A walk-in only gets a PC that nobody else has booked within this many minutes
+WALK_IN_MINUTES = 60
+
+# Sessions running longer than SESSION_LIMIT_SECONDS are shown as overdue; the expiry
+# scheduler ends them at MAX_SESSION_SECONDS, so staff see an hour's warning first
+SESSION_LIMIT_SECONDS = 3 * 60 * 60
+MAX_SESSION_SECONDS = 4 * 60 * 60
+
+# Students kept in LibraryStore.student_cache; a lab's regulars fit many times over
+STUDENT_CACHE_SIZE = 10000
+
+# Newest sessions held in memory by the History tab, whatever period they cover, so opening
+# it costs the same on a quiet lab and a busy one. Older days are read when a date filter asks.
+HISTORY_WINDOW_ROWS = 10000
+
+
+class AssignmentError(Exception):
+    # Raised when a PC can't be given to a student; the message is meant for the desk
+    pass
+
+
+class PcTakenError(AssignmentError):
+    # The PC exists but is already in a session, possibly claimed by another desk
+    pass
+
+
+class BookingError(Exception):
+    # Raised when a booking can't be made; the message is meant for the desk
+    pass
+
+
+class BackupError(Exception):
+    # Raised when a backup or restore copy fails its integrity check
+    pass
+
+
+class Instrumentation:
+    # Keeps the last `window` durations of every timed query and view for percentiles.
+    # Anything slower than slow_ms is kept in `slow` and appended to slow_log if one is set.
+
+    def __init__(self, slow_ms=None, slow_log=None, window=1000):
+        self.slow_ms = DEFAULT_SLOW_MS if slow_ms is None else slow_ms
+        self.slow_log = slow_log or DEFAULT_SLOW_LOG
+        self.window = window
+        self.durations = {}
+        self.counts = {}
+        self.slow = deque(maxlen=100)
+        self.names = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, seconds):
+        name = self.names.get(name) or self.names.setdefault(name, " ".join(name.split()))
+        ms = seconds * 1000
+        key = (kind, name)
+        with self.lock:
+            durations = self.durations.get(key)
+            if durations is None:
+                durations = self.durations[key] = deque(maxlen=self.window)
+            durations.append(ms)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if ms >= self.slow_ms:
+                self.log_slow(SlowEvent(datetime.now().strftime(TIME_FORMAT), kind, name, round(ms, 1)))
+
+    def log_slow(self, event):
+        self.slow.append(event)
+        if self.slow_log:
+            with open(self.slow_log, "a", encoding="utf-8") as log_file:
+                log_file.write(f"{event.time}\t{event.ms} ms\t{event.kind}\t{event.name}\n")
+
+    def timings(self):
+        # Returns a Timing per query and view, in milliseconds, slowest p95 first
+        with self.lock:
+            samples = [(key, sorted(durations), self.counts[key]) for key, durations in self.durations.items()]
+
+        def percentile(durations, fraction):
+            return round(durations[min(len(durations) - 1, int(fraction * len(durations)))], 3)
+
+        timings = [
+            Timing(kind, name, count, percentile(durations, 0.5), percentile(durations, 0.95),
+                   percentile(durations, 0.99), round(durations[-1], 3))
+            for (kind, name), durations, count in samples
+        ]
+        timings.sort(key=lambda timing: timing.p95, reverse=True)
+        return timings
+
+
+class LruCache:
+    # A bounded map that drops the least recently used entry when full, counting
+    # hits and misses. Shared by the runner's threads, hence the lock.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_many(self, keys):
+        # Returns {key: value} for the keys that are cached, taking the lock once
+        found = {}
+        with self.lock:
+            entries = self.entries
+            for key in keys:
+                value = entries.get(key)
+                if value is not None:
+                    entries.move_to_end(key)
+                    found[key] = value
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        # Forgets one key, or everything when no key is given
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+class HistoryColumns:
+    # Sessions held column by column for sorting and filtering in memory: student IDs and
+    # epoch times in int arrays, names and PC IDs as indexes into a table of distinct strings.
+    # A row costs about 32 bytes instead of a tuple of six strings. Rows are only appended,
+    # so a row number stays valid; exit_times holds 0 while a session is open.
+
+    def __init__(self):
+        self.student_ids = array("q")
+        self.names = array("i")
+        self.pc_ids = array("i")
+        self.entry_times = array("q")
+        self.exit_times = array("q")
+        self.strings = []
+        self.folded = []
+        self.string_indexes = {}
+        self.distinct_students = set()
+        # Student ID -> row of their open session
+        self.open_rows = {}
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def intern(self, text):
+        index = self.string_indexes.get(text)
+        if index is None:
+            index = self.string_indexes[text] = len(self.strings)
+            self.strings.append(text)
+            self.folded.append(text.casefold())
+        return index
+
+    def append(self, student_id, name, pc_id, entry_time, exit_time=None):
+        row = len(self.student_ids)
+        self.student_ids.append(student_id)
+        self.distinct_students.add(student_id)
+        self.names.append(self.intern(name))
+        self.pc_ids.append(self.intern(pc_id))
+        self.entry_times.append(entry_time)
+        self.exit_times.append(exit_time or 0)
+        if exit_time is None:
+            self.open_rows[student_id] = row
+        return row
+
+    def close(self, student_id, exit_time):
+        # Returns the row of the student's open session, or None if it isn't loaded
+        row = self.open_rows.pop(student_id, None)
+        if row is not None:
+            self.exit_times[row] = exit_time
+        return row
+
+    def value(self, row, column):
+        # The text shown in one of the HistoryRow columns student_id to duration
+        if column == 0:
+            return str(self.student_ids[row])
+        if column == 1:
+            return self.strings[self.names[row]]
+        if column == 2:
+            return self.strings[self.pc_ids[row]]
+        if column == 3:
+            return format_timestamp(self.entry_times[row])
+        exit_time = self.exit_times[row]
+        if not exit_time:
+            return ""
+        if column == 4:
+            return format_timestamp(exit_time)
+        return format_duration(exit_time - self.entry_times[row])
+
+    def sort_key(self, column):
+        # A function of the row to sort it by column; open sessions sort after closed ones
+        # by exit time and duration
+        if column == 0:
+            return self.student_ids.__getitem__
+        if column in (1, 2):
+            strings = self.names if column == 1 else self.pc_ids
+            folded = self.folded
+            return lambda row: folded[strings[row]]
+        if column == 3:
+            return self.entry_times.__getitem__
+        exit_times = self.exit_times
+        if column == 4:
+            return lambda row: exit_times[row] or sys.maxsize
+        entry_times = self.entry_times
+        return lambda row: exit_times[row] - entry_times[row] if exit_times[row] else sys.maxsize
+
+    def sorted_rows(self, rows, column):
+        # rows in ascending order of column, ties kept in their current order
+        return sorted(rows, key=self.sort_key(column))
+
+    def matching(self, filters=HistoryFilters(), text="", rows=None):
+        # The rows, of all or of rows, that pass HistoryFilters and contain text, ignoring case,
+        # in their student ID, name or PC ID. Each test is decided once per distinct value.
+        rows = range(len(self)) if rows is None else rows
+        if filters.date is not None:
+            day = date.fromisoformat(filters.date)
+            start, end = local_epoch(day), local_epoch(day + timedelta(days=1))
+            entry_times = self.entry_times
+            rows = [row for row in rows if start <= entry_times[row] < end]
+        if filters.student_id is not None:
+            student_id = int(filters.student_id) if filters.student_id.strip().isdigit() else None
+            student_ids = self.student_ids
+            rows = [row for row in rows if student_ids[row] == student_id]
+        if filters.pc_id is not None:
+            pc_id = self.string_indexes.get(filters.pc_id)
+            pc_ids = self.pc_ids
+            rows = [row for row in rows if pc_ids[row] == pc_id]
+        text = text.strip().casefold()
+        if text:
+            strings = {index for index, folded in enumerate(self.folded) if text in folded}
+            student_ids = {student_id for student_id in self.distinct_students if text in str(student_id)}
+            names, pc_ids, ids = self.names, self.pc_ids, self.student_ids
+            rows = [row for row in rows if names[row] in strings or pc_ids[row] in strings or ids[row] in student_ids]
+        return list(rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Times each execute and executemany call. That covers preparing the statement and
+    # stepping to the first row, which for sorted or grouped queries is nearly all of the work.
+    instrumentation = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if self.instrumentation is not None:
+                self.instrumentation.record("query", sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            if self.instrumentation is not None:
+                self.instrumentation.record("query", sql, time.perf_counter() - start)
+
+
+class LibraryStore:
+    # Every query the application runs goes through here. Statements are constant
+    # strings with ? placeholders, so sqlite3's statement cache prepares each one once.
+
+    def __init__(self, path=None, instrumentation=None, archive_path=None):
+        # Nothing is opened until the first query, which also brings the schema up to date.
+        # Archived sessions live in a second file next to the database unless archive_path is given.
+        self.path = path or DEFAULT_DB_PATH
+        self.archive_path = archive_path or archive_path_for(self.path)
+        self.instrumentation = instrumentation or Instrumentation()
+        # Thread ID -> connection. Qt's pool threads lose threading.local data between
+        # tasks, which would open a new connection for every task.
+        self.thread_connections = {}
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.migrated = False
+        self.student_search = None
+        self.booking_span = None
+        # Students are only ever added, so cached rows can't go stale. Lookups that find
+        # nothing aren't cached, since another desk may add that student at any time.
+        self.student_cache = LruCache(STUDENT_CACHE_SIZE)
+
+    @property
+    def conn(self):
+        # Each thread gets its own connection; in WAL mode their reads don't block each other
+        conn = self.thread_connections.get(threading.get_ident())
+        if conn is None:
+            conn = self.thread_connections[threading.get_ident()] = self.connect()
+        return conn
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, cached_statements=256, check_same_thread=False, factory=TimedConnection)
+        conn.instrumentation = self.instrumentation
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA cache_size = -16000")  # 16 MB
+        conn.execute("PRAGMA mmap_size = 268435456")  # 256 MB
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        conn.execute("PRAGMA archive.journal_mode = WAL")
+        conn.execute("PRAGMA archive.synchronous = NORMAL")
+        with self.connections_lock:
+            self.connections.append(conn)
+            if not self.migrated:
+                with conn:
+                    create_archive_tables(conn)
+                migrate(conn)
+                self.migrated = True
+        return conn
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+            self.thread_connections = {}
+
+    def data_version(self):
+        # Changes when another connection commits, so it is read on the same thread each time
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def database_stats(self):
+        # Returns (name, value) pairs describing the database file and the page cache
+        conn = self.conn
+        stats = [(pragma, conn.execute(f"PRAGMA {pragma}").fetchone()[0])
+                 for pragma in ("page_size", "page_count", "freelist_count", "cache_size", "mmap_size",
+                                "journal_mode", "user_version")]
+        for name, path in (("file_bytes", self.path), ("wal_bytes", self.path + "-wal"),
+                           ("archive_bytes", self.archive_path)):
+            stats.append((name, os.path.getsize(path) if os.path.exists(path) else 0))
+        with self.connections_lock:
+            stats.append(("connections", len(self.connections)))
+        cache = self.student_cache
+        stats.extend([("student_cache_entries", len(cache.entries)), ("student_cache_hits", cache.hits),
+                      ("student_cache_misses", cache.misses)])
+        return stats
+
+    def student(self, student_id):
+        try:
+            student_id = int(student_id)
+        except (TypeError, ValueError):
+            return None
+        student = self.student_cache.get(student_id)
+        if student is None:
+            row = self.conn.execute(
+                "SELECT student_id, name, course, contact FROM students WHERE student_id = ?", (student_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            student = Student(*row)
+            self.student_cache.put(student_id, student)
+        return student
+
+    def student_names(self, student_ids):
+        # Returns {student_id: name}, reading only the students missing from the cache, in one query
+        student_ids = set(student_ids)
+        names = {student_id: student.name for student_id, student in self.student_cache.get_many(student_ids).items()}
+        missing = [student_id for student_id in student_ids if student_id not in names]
+        if missing:
+            for row in self.conn.execute(
+                    "SELECT student_id, name, course, contact FROM students "
+                    "WHERE student_id IN (SELECT value FROM json_each(?))", (json.dumps(missing),)):
+                student = Student(*row)
+                self.student_cache.put(student.student_id, student)
+                names[student.student_id] = student.name
+        return names
+
+    def with_names(self, rows, row_type):
+        # Builds row_type tuples from rows that lack the name column, which comes second
+        names = self.student_names(row[0] for row in rows)
+        return [row_type(row[0], names.get(row[0], ""), *row[1:]) for row in rows]
+
+    def search_students(self, text, limit=10):
+        # Returns up to limit StudentMatches for what was typed so far: an exact student ID
+        # first, then name matches, then contact and course matches, each ranked by bm25.
+        # Only the first SEARCH_CANDIDATES matches of a query are scored, so a short prefix
+        # that matches half the students costs no more than a specific one.
+        words = text.split()
+        if not words:
+            return []
+
+        matches = []
+        if text.strip().isdigit():
+            student = self.conn.execute("SELECT student_id, name, course FROM students WHERE student_id = ?",
+                                        (int(text),)).fetchone()
+            if student:
+                matches.append(StudentMatch(*student))
+
+        if self.has_student_search():
+            # Each word is a quoted prefix term, so punctuation can't break the FTS syntax
+            query = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+            # Names come first, so a course word shared by thousands can't push them out
+            rows = self.ranked_students("{name} : (" + query + ")", limit + 1)
+            if len(rows) <= limit:
+                found = {row[0] for row in rows}
+                rows += [row for row in self.ranked_students(query, limit + 1) if row[0] not in found]
+        else:
+            rows = self.conn.execute("SELECT student_id, name, course FROM students WHERE name LIKE ? LIMIT ?",
+                                     (text.strip() + "%", limit))
+        matches.extend(StudentMatch(*row) for row in rows if not matches or row[0] != matches[0].student_id)
+        return matches[:limit]
+
+    def ranked_students(self, query, limit):
+        # The best limit of the first SEARCH_CANDIDATES students matching an FTS query
+        return self.conn.execute(
+            "SELECT students.student_id, students.name, students.course FROM ("
+            "SELECT rowid, bm25(students_fts, 10.0, 5.0, 1.0) AS score FROM students_fts "
+            "WHERE students_fts MATCH ? LIMIT ?) AS candidates "
+            "JOIN students ON students.student_id = candidates.rowid ORDER BY candidates.score LIMIT ?",
+            (query, SEARCH_CANDIDATES, limit)).fetchall()
+
+    def has_student_search(self):
+        if self.student_search is None:
+            self.student_search = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'students_fts'").fetchone() is not None
+        return self.student_search
+
+    def students(self):
+        return [Student(*row) for row in self.conn.execute("SELECT student_id, name, course, contact FROM students")]
+
+    def add_student(self, student_id, name, course, contact):
+        # Returns False if the student ID is already taken
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO students (student_id, name, course, contact) VALUES (?, ?, ?, ?)",
+                (student_id, name, course, contact),
+            )
+        if cursor.rowcount != 1:
+            return False
+        self.student_cache.put(int(student_id), Student(int(student_id), name, course, contact))
+        return True
+
+    def import_students(self, path):
+        return self.bulk_import(path, "students", STUDENT_COLUMNS, validate_student_row)
+
+    def import_pcs(self, path):
+        return self.bulk_import(path, "computers", PC_COLUMNS, validate_pc_row)
+
+    def bulk_import(self, path, table, columns, validate):
+        # Streams the file into a temp table, then checks and inserts it with set-based
+        # statements, all in one transaction. Returns an ImportResult listing rejected lines.
+        key = columns[0]
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        rejected = []
+
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DROP TABLE IF EXISTS temp.import_rows")
+            conn.execute(f"CREATE TEMP TABLE import_rows (line INTEGER PRIMARY KEY, {column_list})")
+            conn.executemany(f"INSERT INTO temp.import_rows VALUES ({placeholders})",
+                             read_import_rows(path, columns, validate, rejected))
+            conn.execute(f"CREATE INDEX temp.idx_import_rows_key ON import_rows ({key}, line)")
+
+            # IDs that already exist, or that repeat an earlier line of the file
+            rejected.extend(conn.execute(f'''
+                SELECT line,
+                       CASE WHEN EXISTS (SELECT 1 FROM main.{table} t WHERE t.{key} = i.{key})
+                            THEN '{key} already exists'
+                            ELSE '{key} repeats an earlier line' END
+                FROM import_rows i
+                WHERE EXISTS (SELECT 1 FROM main.{table} t WHERE t.{key} = i.{key})
+                   OR EXISTS (SELECT 1 FROM import_rows j WHERE j.{key} = i.{key} AND j.line < i.line)
+            '''))
+
+            imported = conn.execute(
+                f"INSERT OR IGNORE INTO main.{table} ({column_list}) SELECT {column_list} FROM import_rows ORDER BY line"
+            ).rowcount
+            conn.execute("DROP TABLE temp.import_rows")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        rejected.sort()
+        return ImportResult(imported, rejected)
+
+    def pc(self, pc_id):
+        row = self.conn.execute("SELECT pc_id, student_id, status FROM computers WHERE pc_id = ?", (pc_id,)).fetchone()
+        return PC(*row) if row else None
+
+    def pcs(self):
+        return [PC(*row) for row in self.conn.execute("SELECT pc_id, student_id, status FROM computers")]
+
+    def add_pc(self, pc_id):
+        # Returns False if the PC ID is already taken
+        with self.conn:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO computers (pc_id) VALUES (?)", (pc_id,))
+        return cursor.rowcount == 1
+
+    def delete_pc(self, pc_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM computers WHERE pc_id = ?", (pc_id,))
+
+    def vacant_pcs(self):
+        return [pc_id for pc_id, in self.conn.execute(VACANT_PCS_QUERY)]
+
+    def allocation_state(self):
+        # Returns (pc_id, vacant, last_assigned, sessions_today) for every PC; both
+        # subqueries are range lookups on idx_reservations_pc_entry
+        return self.conn.execute(
+            "SELECT pc_id, status = 'Vacant', "
+            "(SELECT MAX(entry_time) FROM reservations WHERE reservations.pc_id = computers.pc_id), "
+            "(SELECT COUNT(*) FROM reservations WHERE reservations.pc_id = computers.pc_id AND entry_time >= ?) "
+            "FROM computers", (local_epoch(date.today()),)).fetchall()
+
+    def active_sessions(self):
+        return self.with_names(self.conn.execute(ACTIVE_SESSIONS_QUERY).fetchall(), Session)
+
+    def occupancy(self):
+        # Returns a PcOccupancy for every PC in ID order; vacant PCs have no student.
+        # The open session of each PC is one lookup in idx_reservations_open_pc.
+        rows = self.conn.execute(
+            "SELECT computers.pc_id, reservations.student_id, reservations.entry_time FROM computers "
+            "LEFT JOIN reservations ON reservations.pc_id = computers.pc_id AND reservations.exit_time IS NULL "
+            "ORDER BY computers.pc_id").fetchall()
+        names = self.student_names(student_id for _, student_id, _ in rows if student_id is not None)
+        return [PcOccupancy(pc_id, student_id, names.get(student_id), entry_epoch)
+                for pc_id, student_id, entry_epoch in rows]
+
+    def open_session_of(self, student_id):
+        # Returns (pc_id, entry_time) of the student's open session, or None
+        return self.conn.execute(
+            "SELECT pc_id, entry_time FROM reservations WHERE student_id = ? AND exit_time IS NULL", (student_id,)
+        ).fetchone()
+
+    def assigned_pc(self, student_id):
+        session = self.open_session_of(student_id)
+        return session[0] if session else None
+
+    def write_transaction(self, function, *args):
+        # Runs function(conn, *args) inside BEGIN IMMEDIATE, so the write lock is held before
+        # anything is read and the checks can't go stale. If another desk keeps the lock past
+        # busy_timeout, waits a little longer before giving up with "database is locked".
+        conn = self.conn
+        for attempt in range(WRITE_RETRIES):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as error:
+                if "locked" not in str(error) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(WRITE_RETRY_DELAY * 2 ** attempt * (1 + random.random()))
+
+        try:
+            result = function(conn, *args)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        return result
+
+    def open_session(self, student_id, pc_id):
+        # Claims the PC and records the reservation in one transaction. Raises AssignmentError
+        # if the student or PC doesn't exist or either is already in a session.
+        # Returns the formatted entry time.
+        return self.write_transaction(self.start_session, student_id, pc_id)
+
+    def start_session(self, conn, student_id, pc_id):
+        if self.student(student_id) is None:
+            raise AssignmentError("No matching student found.")
+        if self.open_session_of(student_id) is not None:
+            raise AssignmentError("The Student is already assigned to a PC.")
+
+        booking = self.next_booking(pc_id, student_id)
+        if booking is not None:
+            raise AssignmentError(f"{pc_id} is booked from {format_timestamp(booking)}.")
+
+        # The status condition turns check and claim into one statement
+        claimed = conn.execute("UPDATE computers SET student_id = ?, status = 'Assigned' "
+                               "WHERE pc_id = ? AND status = 'Vacant'", (student_id, pc_id)).rowcount
+        if not claimed:
+            if self.pc(pc_id) is None:
+                raise AssignmentError("PC ID does not exist.")
+            raise PcTakenError(f"{pc_id} is not vacant.")
+
+        entry_time = int(time.time())
+        conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time) VALUES (?, ?, ?)",
+                     (student_id, pc_id, entry_time))
+        return format_timestamp(entry_time)
+
+    def next_booking(self, pc_id, student_id):
+        # Start time of a booking of the PC by someone else within the walk-in window, or None
+        now = int(time.time())
+        row = self.conn.execute(
+            "SELECT start_time FROM bookings WHERE pc_id = ? AND end_time > ? AND start_time < ? "
+            "AND (student_id IS NULL OR student_id != ?) ORDER BY start_time LIMIT 1",
+            (pc_id, now, now + WALK_IN_MINUTES * 60, student_id)).fetchone()
+        return row[0] if row else None
+
+    def add_booking(self, pc_id, start_time, end_time, student_id=None, note=""):
+        # Books the PC from start_time to end_time (epoch seconds) for the student, or for
+        # maintenance without one, and returns the booking ID. Raises BookingError if the
+        # slot is invalid or overlaps another booking of the PC.
+        return self.write_transaction(self.insert_booking, pc_id, start_time, end_time, student_id, note)
+
+    def insert_booking(self, conn, pc_id, start_time, end_time, student_id, note):
+        if end_time <= start_time:
+            raise BookingError("A booking has to end after it starts.")
+        if end_time <= time.time():
+            raise BookingError("A booking has to end in the future.")
+        if self.pc(pc_id) is None:
+            raise BookingError("PC ID does not exist.")
+        if student_id is not None:
+            student = self.student(student_id)
+            if student is None:
+                raise BookingError("No matching student found.")
+            student_id = student.student_id
+
+        clash = conn.execute(
+            "SELECT start_time, end_time FROM bookings WHERE pc_id = ? AND end_time > ? AND start_time < ? LIMIT 1",
+            (pc_id, start_time, end_time)).fetchone()
+        if clash is not None:
+            raise BookingError(
+                f"{pc_id} is already booked from {format_timestamp(clash[0])} to {format_timestamp(clash[1])}.")
+
+        return conn.execute("INSERT INTO bookings (pc_id, student_id, start_time, end_time, note) VALUES (?, ?, ?, ?, ?)",
+                            (pc_id, student_id, start_time, end_time, note)).lastrowid
+
+    def cancel_booking(self, booking_id):
+        # Returns False if there is no such booking
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM bookings WHERE booking_id = ?", (booking_id,))
+        return cursor.rowcount == 1
+
+    def has_booking_span(self):
+        if self.booking_span is None:
+            self.booking_span = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'bookings_span'").fetchone() is not None
+        return self.booking_span
+
+    def overlapping(self, start_time, end_time):
+        # WHERE condition and parameters for the bookings that overlap the window
+        condition = "bookings.end_time > ? AND bookings.start_time < ?"
+        params = [start_time, end_time]
+        if self.has_booking_span():
+            condition = ("bookings.booking_id IN (SELECT booking_id FROM bookings_span "
+                         "WHERE end_time > ? AND start_time < ?) AND " + condition)
+            params *= 2
+        return condition, params
+
+    def bookings(self, start_time, end_time):
+        # Returns the Bookings overlapping the window, earliest first
+        condition, params = self.overlapping(start_time, end_time)
+        rows = self.conn.execute(
+            "SELECT booking_id, pc_id, student_id, start_time, end_time, note FROM bookings "
+            f"WHERE {condition} ORDER BY start_time, pc_id", params).fetchall()
+        names = self.student_names(row[2] for row in rows if row[2] is not None)
+        return [Booking(booking_id, pc_id, student_id, names.get(student_id), start, end, note)
+                for booking_id, pc_id, student_id, start, end, note in rows]
+
+    def booked_pcs(self, start_time, end_time, student_id=None):
+        # Returns the IDs of PCs with a booking overlapping the window. Bookings held by
+        # student_id don't count, so a student can walk in to their own slot.
+        condition, params = self.overlapping(start_time, end_time)
+        query = f"SELECT DISTINCT pc_id FROM bookings WHERE {condition}"
+        if student_id is not None:
+            query += " AND (student_id IS NULL OR student_id != ?)"
+            params.append(student_id)
+        return {pc_id for pc_id, in self.conn.execute(query, params)}
+
+    def free_pcs(self, start_time, end_time):
+        # Returns the IDs of PCs without a booking in the window, in ID order
+        condition, params = self.overlapping(start_time, end_time)
+        return [pc_id for pc_id, in self.conn.execute(
+            f"SELECT pc_id FROM computers WHERE pc_id NOT IN (SELECT pc_id FROM bookings WHERE {condition}) "
+            "ORDER BY pc_id", params)]
+
+    def close_session(self, student_id):
+        # Returns (pc_id, exit_time, duration) formatted for display, or None if the student has no open session
+        return self.write_transaction(self.end_session, student_id)
+
+    def end_session(self, conn, student_id):
+        session = self.open_session_of(student_id)
+        if session is None:
+            return None
+
+        pc_id, entry_time = session
+        exit_time = int(time.time())
+        student = self.student(student_id)
+        conn.execute("UPDATE computers SET student_id = NULL, status = 'Vacant' WHERE student_id = ?", (student_id,))
+        conn.execute(CLOSE_SESSION_QUERY, (exit_time, student_id))
+        add_to_rollups(conn, student_id, student.course if student else None, pc_id, entry_time, exit_time)
+        refresh_hourly_occupancy(conn, entry_time, exit_time)
+        return pc_id, format_timestamp(exit_time), format_duration(exit_time - entry_time)
+
+    def close_sessions(self, student_ids=None):
+        # Ends the open sessions of the given students, or every open session, in one
+        # transaction. Returns (student_id, pc_id, exit_time, duration) formatted for display
+        # for each session closed.
+        return self.write_transaction(self.end_open_sessions, student_ids)
+
+    def end_open_sessions(self, conn, student_ids):
+        now = int(time.time())
+        sessions = self.open_sessions()
+        if student_ids is not None:
+            student_ids = {int(student_id) for student_id in student_ids}
+            sessions = [session for session in sessions if session[0] in student_ids]
+        return self.end_sessions(conn, [(*session, now) for session in sessions])
+
+    def expire_sessions(self, max_seconds=MAX_SESSION_SECONDS, closing_time=None):
+        # Ends every open session that ran past max_seconds or a closing time, with the moment
+        # it ran out as its exit time, so a forgotten session isn't counted until someone
+        # notices. Returns the sessions closed, as close_sessions() does.
+        return self.write_transaction(self.end_expired_sessions, max_seconds, closing_time)
+
+    def end_expired_sessions(self, conn, max_seconds, closing_time):
+        now = int(time.time())
+        expired = []
+        for student_id, pc_id, entry_time in self.open_sessions():
+            expiry = session_expiry(entry_time, max_seconds, closing_time)
+            if expiry is not None and expiry <= now:
+                expired.append((student_id, pc_id, entry_time, expiry))
+        return self.end_sessions(conn, expired)
+
+    def open_sessions(self):
+        # (student_id, pc_id, entry_time) of every open session, read from idx_reservations_open_entry
+        return self.conn.execute(
+            "SELECT student_id, pc_id, entry_time FROM reservations WHERE exit_time IS NULL ORDER BY entry_time"
+        ).fetchall()
+
+    def end_sessions(self, conn, sessions):
+        # Closes (student_id, pc_id, entry_time, exit_time) sessions with two set-based
+        # UPDATEs through a temp table, then adds them to the rollups, recomputing each
+        # day's hourly peaks once however many sessions touched it
+        if not sessions:
+            return []
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS ending_sessions (student_id INTEGER PRIMARY KEY, exit_time INTEGER)")
+        conn.execute("DELETE FROM temp.ending_sessions")
+        conn.executemany("INSERT INTO temp.ending_sessions VALUES (?, ?)",
+                         [(student_id, exit_time) for student_id, _, _, exit_time in sessions])
+        conn.execute("UPDATE computers SET student_id = NULL, status = 'Vacant' "
+                     "WHERE student_id IN (SELECT student_id FROM temp.ending_sessions)")
+        conn.execute("UPDATE reservations SET exit_time = ending_sessions.exit_time FROM temp.ending_sessions "
+                     "WHERE reservations.student_id = ending_sessions.student_id AND reservations.exit_time IS NULL")
+
+        days = set()
+        closed = []
+        for student_id, pc_id, entry_time, exit_time in sessions:
+            student = self.student(student_id)
+            add_to_rollups(conn, student_id, student.course if student else None, pc_id, entry_time, exit_time)
+            days.update(day for day, _ in day_segments(entry_time, exit_time))
+            closed.append((student_id, pc_id, format_timestamp(exit_time), format_duration(exit_time - entry_time)))
+        for day in sorted(days):
+            refresh_day_occupancy(conn, day)
+        return closed
+
+    def usage_report(self, first_day, last_day, top_users=10):
+        # Reads only the rollups, so the cost depends on the date range, not the size of the history
+        days = (date.fromisoformat(last_day) - date.fromisoformat(first_day)).days + 1
+        available = days * OPENING_HOURS_PER_DAY * 3600
+        utilization = [
+            (pc_id, format_duration(seconds), round(100 * seconds / available, 1))
+            for pc_id, seconds in self.conn.execute(
+                "SELECT computers.pc_id, COALESCE(usage.seconds, 0) AS used FROM computers LEFT JOIN ("
+                "SELECT pc_id, SUM(seconds) AS seconds FROM daily_pc_usage WHERE day BETWEEN ? AND ? GROUP BY pc_id"
+                ") AS usage ON usage.pc_id = computers.pc_id ORDER BY used DESC, computers.pc_id", (first_day, last_day))
+        ]
+        peaks = self.conn.execute(
+            "SELECT hour, MAX(peak) FROM hourly_occupancy WHERE day BETWEEN ? AND ? GROUP BY hour ORDER BY hour",
+            (first_day, last_day)).fetchall()
+        courses = [
+            (course, sessions, format_duration(seconds // sessions))
+            for course, sessions, seconds in self.conn.execute(
+                "SELECT course, SUM(sessions), SUM(seconds) FROM daily_course_usage WHERE day BETWEEN ? AND ? "
+                "GROUP BY course HAVING SUM(sessions) > 0 ORDER BY course", (first_day, last_day))
+        ]
+        users = [
+            (student_id, name, sessions, format_duration(seconds))
+            for student_id, name, sessions, seconds in self.conn.execute(
+                "SELECT usage.student_id, students.name, usage.sessions, usage.seconds FROM ("
+                "SELECT student_id, SUM(sessions) AS sessions, SUM(seconds) AS seconds FROM daily_student_usage "
+                "WHERE day BETWEEN ? AND ? GROUP BY student_id ORDER BY seconds DESC LIMIT ?) AS usage "
+                "LEFT JOIN students ON students.student_id = usage.student_id ORDER BY usage.seconds DESC",
+                (first_day, last_day, top_users))
+        ]
+        return UsageReport(utilization, peaks, courses, users)
+
+    def reads_archive(self, filters, since=None):
+        # The archive only holds sessions that started before its newest entry time,
+        # so a date filter or window after that never needs it
+        archived_until = self.conn.execute("SELECT MAX(entry_time) FROM archive.reservations").fetchone()[0]
+        if archived_until is None or (since is not None and since > archived_until):
+            return False
+        return filters.date is None or local_epoch(date.fromisoformat(filters.date)) <= archived_until
+
+    def history(self, filters=HistoryFilters(), after=None, limit=None):
+        query, params = history_filter_query(*filters, after=after, limit=limit, archived=self.reads_archive(filters))
+        return self.with_names(self.conn.execute(query, params).fetchall(), HistoryRow)
+
+    def history_columns(self, filters=HistoryFilters(), since=None, limit=None):
+        # Loads the newest limit sessions matching filters that started at or after since
+        # into HistoryColumns
+        columns = HistoryColumns()
+        query, params = history_filter_query(*filters, limit=limit, archived=self.reads_archive(filters, since),
+                                             since=since, epochs=True)
+        cursor = self.conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            names = self.student_names(row[0] for row in rows)
+            for student_id, pc_id, entry_time, exit_time, reservation_id in rows:
+                columns.append(student_id, names.get(student_id) or "", pc_id, entry_time, exit_time)
+        return columns
+
+    def count_history(self, filters=HistoryFilters()):
+        # Counted on reservations alone, so it is an upper bound if PCs or students were deleted
+        conditions, params = history_conditions(*filters)
+        tables = ["main.reservations"] + (["archive.reservations"] if self.reads_archive(filters) else [])
+        total = 0
+        for table in tables:
+            query = f"SELECT COUNT(*) FROM {table} AS reservations"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            total += self.conn.execute(query, params).fetchone()[0]
+        return total
+
+    def iter_history(self, filters=HistoryFilters(), chunk_size=1000):
+        # Yields the history in lists of at most chunk_size rows, never holding the whole result
+        query, params = history_filter_query(*filters, archived=self.reads_archive(filters))
+        cursor = self.conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield self.with_names(rows, HistoryRow)
+
+    def export_history(self, path, filters=HistoryFilters(), progress=None):
+        # Streams the history to CSV, or to JSON Lines if path ends in .jsonl, and returns the
+        # number of rows written. progress(written, total) is called after every chunk.
+        total = self.count_history(filters)
+        jsonl = path.lower().endswith(".jsonl")
+        written = 0
+
+        # Opened outside the try, so a path that can't be written keeps its own error
+        export_file = open(path, "w", newline="", encoding="utf-8")
+        try:
+            with export_file:
+                writer = csv.writer(export_file)
+                if not jsonl:
+                    writer.writerow(EXPORT_COLUMNS)
+
+                for chunk in self.iter_history(filters):
+                    if jsonl:
+                        export_file.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in chunk)
+                    else:
+                        writer.writerows(row[:len(EXPORT_COLUMNS)] for row in chunk)
+                    written += len(chunk)
+                    if progress is not None:
+                        progress(written, total)
+        except Exception:
+            # Don't leave a partial export behind, e.g. when the export was cancelled
+            os.remove(path)
+            raise
+
+        return written
+
+    def archive_sessions(self, days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+        # Moves closed sessions that started more than `days` days ago to the archive database
+        # and returns how many were moved. Each batch is its own pair of short transactions, so
+        # desks can open and close sessions while a large archive runs; progress(moved) is
+        # called after every batch.
+        cutoff = local_epoch(date.today() - timedelta(days=days))
+        moved = 0
+        while True:
+            copied = self.write_transaction(self.copy_to_archive, cutoff, batch_size)
+            if not copied:
+                break
+            self.write_transaction(self.delete_archived)
+            moved += copied
+            if progress is not None:
+                progress(moved)
+        if moved:
+            # Fresh statistics for both files, or the planner may sort the archive instead of walking its index
+            self.conn.execute("ANALYZE")
+        return moved
+
+    def copy_to_archive(self, conn, cutoff, batch_size):
+        # A transaction over two WAL databases isn't atomic across both files, so a batch is
+        # copied and committed before it is deleted. After a crash in between the batch is in
+        # both; the next run skips the copies already made and finishes the delete.
+        # The newest session always stays, so reservation IDs are never handed out again.
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (reservation_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.archive_batch")
+        copied = conn.execute(
+            "INSERT INTO temp.archive_batch SELECT reservation_id FROM main.reservations "
+            "WHERE entry_time < ? AND exit_time IS NOT NULL "
+            "AND reservation_id < (SELECT MAX(reservation_id) FROM main.reservations) "
+            "ORDER BY entry_time LIMIT ?", (cutoff, batch_size)).rowcount
+        conn.execute(
+            "INSERT OR IGNORE INTO archive.reservations (reservation_id, student_id, pc_id, entry_time, exit_time) "
+            "SELECT reservation_id, student_id, pc_id, entry_time, exit_time FROM main.reservations "
+            "WHERE reservation_id IN temp.archive_batch")
+        return copied
+
+    def delete_archived(self, conn):
+        conn.execute(
+            "DELETE FROM main.reservations WHERE reservation_id IN ("
+            "SELECT reservation_id FROM temp.archive_batch JOIN archive.reservations USING (reservation_id))")
+
+    def vacuum(self):
+        # Hands the pages freed by archiving back to the file system
+        self.conn.execute("VACUUM main")
+
+    def backup(self, directory=None, keep=BACKUP_KEEP, check=False, pages=BACKUP_STEP_PAGES):
+        # Writes a gzipped snapshot of the database, and of the archive next to it, to directory
+        # (backups/ beside the database by default) and deletes all but the newest keep snapshots.
+        # The copy is made in steps of pages pages from one read transaction: in WAL mode that
+        # snapshot stays consistent while desks keep writing, and the copy never restarts.
+        directory = directory or backup_dir_for(self.path)
+        os.makedirs(directory, exist_ok=True)
+        root = os.path.splitext(os.path.basename(self.path))[0]
+        snapshot = os.path.join(directory, f"{root}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+        copies = [(snapshot, "main"), (archive_path_for(snapshot), "archive")]
+
+        started = time.perf_counter()
+        total = 0
+        conn = self.conn
+        try:
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM main.sqlite_master").fetchone()
+            conn.execute("SELECT COUNT(*) FROM archive.sqlite_master").fetchone()
+            for copy_path, name in copies:
+                target = sqlite3.connect(copy_path)
+                try:
+                    total += copy_pages(conn, target, name, pages)
+                finally:
+                    target.close()
+            conn.rollback()
+            copy_seconds = time.perf_counter() - started
+
+            result = None
+            if check:
+                for copy_path, name in copies:
+                    result = check_copy(copy_path)
+            for copy_path, name in copies:
+                compress_file(copy_path)
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            remove_files(*(copy_path + ".gz" for copy_path, name in copies))
+            raise
+        finally:
+            remove_files(*(copy_path for copy_path, name in copies))
+        seconds = time.perf_counter() - started
+
+        snapshots = backup_snapshots(directory, self.path)
+        for old in snapshots[:max(0, len(snapshots) - keep)]:
+            remove_files(old, archive_path_for(old[:-len(".gz")]) + ".gz")
+        return BackupResult(snapshot + ".gz", total, seconds, total / copy_seconds if copy_seconds else 0,
+                            sum(os.path.getsize(copy_path + ".gz") for copy_path, name in copies), result)
+
+
+# Auto-assign policies, by the name shown to the desk
+ALLOCATION_POLICIES = {
+    "lowest-id": "Lowest PC ID",
+    "least-recently-used": "Least recently used",
+    "fewest-sessions-today": "Fewest sessions today",
+}
+
+
+class PcAllocator:
+    # Keeps the vacant PCs in memory, indexed for each policy, so the next PC is found
+    # without a query: a bitset over the sorted PC IDs for lowest-id, a queue ordered by
+    # last assignment for least-recently-used, and queues per session count for
+    # fewest-sessions-today. Callers report sessions they open and close with take() and
+    # release(). Changes made elsewhere show up as PcTakenError or an empty pick, which
+    # trigger a reload; callers watching data_version() can also reload when it changes.
+
+    def __init__(self, store, policy="lowest-id"):
+        if policy not in ALLOCATION_POLICIES:
+            raise ValueError(f"Unknown allocation policy: {policy}")
+        self.store = store
+        self.policy = policy
+        self.lock = threading.RLock()
+        self.loaded = False
+
+    def load(self):
+        state = self.store.allocation_state()
+        with self.lock:
+            self.pc_ids = sorted(pc_id for pc_id, _, _, _ in state)
+            self.positions = {pc_id: position for position, pc_id in enumerate(self.pc_ids)}
+            self.sessions_today = {pc_id: sessions for pc_id, _, _, sessions in state}
+            self.today = date.today()
+            self.free_bits = 0
+            self.by_recency = OrderedDict()
+            self.by_sessions = {}
+            for pc_id, vacant, _, _ in sorted(state, key=lambda pc: pc[2] or 0):
+                if vacant:
+                    self.add_free(pc_id)
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def add_free(self, pc_id):
+        self.free_bits |= 1 << self.positions[pc_id]
+        # Released PCs go to the back, so the front is the one idle the longest
+        self.by_recency[pc_id] = None
+        self.by_sessions.setdefault(self.sessions_today[pc_id], OrderedDict())[pc_id] = None
+
+    def remove_free(self, pc_id):
+        position = self.positions.get(pc_id)
+        if position is None or not self.free_bits >> position & 1:
+            return
+        self.free_bits &= ~(1 << position)
+        del self.by_recency[pc_id]
+        sessions = self.sessions_today[pc_id]
+        del self.by_sessions[sessions][pc_id]
+        if not self.by_sessions[sessions]:
+            del self.by_sessions[sessions]
+
+    def start_new_day(self):
+        # Session counts are per day, so they start again from zero after midnight
+        self.today = date.today()
+        self.sessions_today = dict.fromkeys(self.pc_ids, 0)
+        self.by_sessions = {0: OrderedDict.fromkeys(self.by_recency)} if self.by_recency else {}
+
+    def vacant(self):
+        self.ensure_loaded()
+        with self.lock:
+            return [pc_id for position, pc_id in enumerate(self.pc_ids) if self.free_bits >> position & 1]
+
+    def walk_in_bookings(self, student_id=None):
+        # PCs booked by anyone but the student within the walk-in window
+        now = int(time.time())
+        return self.store.booked_pcs(now, now + WALK_IN_MINUTES * 60, student_id)
+
+    def available(self, student_id=None):
+        # The vacant PCs a walk-in can have: those not booked by someone else soon
+        booked = self.walk_in_bookings(student_id)
+        return [pc_id for pc_id in self.vacant() if pc_id not in booked]
+
+    def pick(self, policy=None, exclude=()):
+        # Returns the PC the policy (by default self.policy) would assign next, skipping
+        # the PCs in exclude, or None if every other PC is in use
+        policy = policy or self.policy
+        self.ensure_loaded()
+        with self.lock:
+            if self.today != date.today():
+                self.start_new_day()
+            free_bits = self.free_bits
+            for pc_id in exclude:
+                position = self.positions.get(pc_id)
+                if position is not None:
+                    free_bits &= ~(1 << position)
+            if not free_bits:
+                return None
+            if policy == "lowest-id":
+                return self.pc_ids[(free_bits & -free_bits).bit_length() - 1]
+            if policy == "least-recently-used":
+                return next(pc_id for pc_id in self.by_recency if pc_id not in exclude)
+            return next(pc_id for sessions in sorted(self.by_sessions)
+                        for pc_id in self.by_sessions[sessions] if pc_id not in exclude)
+
+    def take(self, pc_id):
+        # Records that a session was opened on the PC. Before the first load there is
+        # nothing to update; the load will see the session.
+        with self.lock:
+            if not self.loaded or pc_id not in self.positions:
+                return
+            self.remove_free(pc_id)
+            self.sessions_today[pc_id] += 1
+
+    def release(self, pc_id):
+        # Records that the PC's session was closed
+        with self.lock:
+            if not self.loaded or pc_id not in self.positions:
+                return
+            if not self.free_bits >> self.positions[pc_id] & 1:
+                self.add_free(pc_id)
+
+    def assign_next(self, student_id, policy=None):
+        # Opens a session for the student on the PC the policy picks and returns
+        # (pc_id, entry_time). If another desk took the PC first, reloads and tries again.
+        # Like any other session, the caller reports it with take().
+        if policy is not None and policy not in ALLOCATION_POLICIES:
+            raise ValueError(f"Unknown allocation policy: {policy}")
+        student = self.store.student(student_id)
+        booked = self.walk_in_bookings(student.student_id if student else None)
+        reloaded = False
+        for attempt in range(3):
+            pc_id = self.pick(policy, booked)
+            if pc_id is None and not reloaded:
+                # Another desk may have freed a PC since the last load
+                self.load()
+                reloaded = True
+                pc_id = self.pick(policy, booked)
+            if pc_id is None:
+                raise AssignmentError("No PC is vacant." if not booked else "No PC is vacant and free of bookings.")
+            try:
+                entry_time = self.store.open_session(student_id, pc_id)
+            except PcTakenError:
+                self.load()
+                reloaded = True
+                continue
+            return pc_id, entry_time
+        raise AssignmentError("Other desks keep taking the vacant PCs; try again.")
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import AssignmentError, LibraryStore, PcAllocator
+
+
+class SharedDatabaseTest(unittest.TestCase):
+    # Two desks on one database file, each with its own store and allocator
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "library.db")
+        self.desk_a = LibraryStore(path)
+        for student_id in (1, 2, 3):
+            self.desk_a.add_student(student_id, f"Student {student_id}", "CS", "555")
+        for pc_id in ("PC1", "PC2"):
+            self.desk_a.add_pc(pc_id)
+        self.desk_b = LibraryStore(path)
+        self.allocator = PcAllocator(self.desk_b)
+
+    def tearDown(self):
+        self.desk_a.close()
+        self.desk_b.close()
+        self.directory.cleanup()
+
+    def fill(self):
+        for student_id in (1, 2):
+            pc_id, entry_time = self.allocator.assign_next(student_id)
+            self.allocator.take(pc_id)
+        self.assertEqual(self.allocator.vacant(), [])
+
+    def test_assign_next_sees_a_pc_freed_by_another_desk(self):
+        self.fill()
+        self.desk_a.close_session(1)
+        pc_id, entry_time = self.allocator.assign_next(3)
+        self.assertEqual(pc_id, "PC1")
+        self.assertEqual(self.desk_b.vacant_pcs(), [])
+
+    def test_reload_shows_a_pc_freed_by_another_desk(self):
+        self.fill()
+        data_version = self.desk_b.data_version()
+        self.desk_a.close_session(1)
+        self.assertNotEqual(self.desk_b.data_version(), data_version)
+        self.allocator.load()
+        self.assertEqual(self.allocator.available(), ["PC1"])
+
+    def test_no_pc_vacant(self):
+        self.fill()
+        with self.assertRaises(AssignmentError):
+            self.allocator.assign_next(3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_api import LibraryApi
+from library_core import LibraryStore
+
+
+class ApiTest(unittest.TestCase):
+    # Requests go through a server on a free local port, as a desk's client would send them
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        self.store.add_student(1, "Ada", "CS", "555")
+        self.api = LibraryApi(self.store)
+
+    def tearDown(self):
+        self.api.readers.shutdown()
+        self.api.writer.shutdown()
+        self.store.close()
+        self.directory.cleanup()
+
+    def send(self, *requests):
+        # Sends each raw request on its own connection and returns the status lines
+        async def run():
+            started = asyncio.get_running_loop().create_future()
+            server = asyncio.create_task(self.api.serve("127.0.0.1", 0, started))
+            host, port = await started
+            statuses = []
+            for request in requests:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                statuses.append((await asyncio.wait_for(reader.readline(), 5)).decode().strip())
+                writer.close()
+            server.cancel()
+            return statuses
+
+        return asyncio.run(run())
+
+    def get(self, path):
+        return f"GET {path} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n".encode()
+
+    def test_timings_grouped_by_endpoint(self):
+        paths = [f"/students/{student_id}" for student_id in range(1, 51)] + [f"/junk/{number}" for number in range(50)]
+        self.send(*(self.get(path) for path in paths))
+        names = {timing.name for timing in self.store.instrumentation.timings() if timing.kind == "api"}
+        self.assertEqual(names, {"GET /students/{id}", "unmatched"})
+
+    def test_malformed_content_length(self):
+        statuses = self.send(*(f"POST /sessions HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode()
+                               for length in ("abc", "-1")))
+        self.assertEqual(statuses, ["HTTP/1.1 400 Bad Request"] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import LibraryStore
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        self.store.add_student(1, "Ada", "CS", "555")
+        self.store.add_pc("PC1")
+        with self.store.conn as conn:
+            conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (1, 'PC1', ?, ?)",
+                         (int(time.time()) - 3600, int(time.time())))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_export(self):
+        path = os.path.join(self.directory.name, "history.csv")
+        self.assertEqual(self.store.export_history(path), 1)
+        with open(path, encoding="utf-8") as export_file:
+            self.assertEqual(len(export_file.readlines()), 2)
+
+    def test_unwritable_path_keeps_its_error(self):
+        path = os.path.join(self.directory.name, "missing", "history.csv")
+        with self.assertRaises(FileNotFoundError) as error:
+            self.store.export_history(path)
+        self.assertIsNone(error.exception.__context__)
+
+    def test_cancelled_export_is_removed(self):
+        path = os.path.join(self.directory.name, "history.jsonl")
+
+        def cancel(written, total):
+            raise InterruptedError()
+
+        with self.assertRaises(InterruptedError):
+            self.store.export_history(path, progress=cancel)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
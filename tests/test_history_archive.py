@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import HistoryFilters, LibraryStore, local_epoch
+
+
+class HistoryArchiveTest(unittest.TestCase):
+    # The history columns read archived sessions as if they had never moved
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        self.store.add_student(1, "Ada", "CS", "555")
+        self.store.add_pc("PC1")
+        self.old_day = date.today() - timedelta(days=400)
+        self.recent_day = date.today() - timedelta(days=10)
+        with self.store.conn as conn:
+            for day in (self.old_day, self.recent_day):
+                start = local_epoch(day) + 10 * 3600
+                conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (1, 'PC1', ?, ?)",
+                             (start, start + 3600))
+            # The newest session always stays in the main database
+            conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (1, 'PC1', ?, ?)",
+                         (int(time.time()) - 60, int(time.time())))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_archived_day(self):
+        self.assertEqual(self.store.archive_sessions(days=180), 1)
+        columns = self.store.history_columns(HistoryFilters(date=self.old_day.isoformat()))
+        self.assertEqual(len(columns), 1)
+        self.assertEqual(columns.value(0, 1), "Ada")
+
+    def test_window_reaching_into_the_archive(self):
+        self.assertEqual(self.store.archive_sessions(days=1), 2)
+        columns = self.store.history_columns(since=local_epoch(date.today() - timedelta(days=30)))
+        self.assertEqual(len(columns), 2)
+
+    def test_window_limited_by_rows(self):
+        self.assertEqual(self.store.archive_sessions(days=1), 2)
+        columns = self.store.history_columns(limit=2)
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(columns.entry_times[1], local_epoch(self.recent_day) + 10 * 3600)
+
+
+if __name__ == "__main__":
+    unittest.main()
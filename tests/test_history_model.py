@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+from LibraryPCManagement import AssignmentHistoryWidget, DataChangeNotifier, DbTaskRunner
+from library_core import HISTORY_WINDOW_ROWS, HistoryFilters, LibraryStore, local_epoch
+
+app = QApplication.instance() or QApplication([])
+
+
+class HistoryFilterTest(unittest.TestCase):
+    # Student and PC filters find every matching session, not just those in the newest window
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        self.store.add_student(1, "Ada", "CS", "555")
+        self.store.add_student(2, "Grace", "CS", "556")
+        self.store.add_pc("PC1")
+        self.store.add_pc("PC2")
+        start = int(time.time()) - HISTORY_WINDOW_ROWS * 60
+        old_day = local_epoch(date.today() - timedelta(days=400)) + 10 * 3600
+        with self.store.conn as conn:
+            # Ada's sessions are all older than a window filled by Grace's
+            conn.executemany("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (1, 'PC1', ?, ?)",
+                             [(old_day + day * 86400, old_day + day * 86400 + 3600) for day in range(3)])
+            conn.executemany("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (2, 'PC2', ?, ?)",
+                             [(start + number * 60, start + number * 60 + 30) for number in range(HISTORY_WINDOW_ROWS)])
+        self.store.archive_sessions(days=300)
+        self.runner = DbTaskRunner(self.store)
+        self.widget = AssignmentHistoryWidget(self.store, self.runner, DataChangeNotifier())
+        self.wait()
+
+    def tearDown(self):
+        self.runner.shutdown()
+        self.store.close()
+        self.directory.cleanup()
+
+    def wait(self):
+        deadline = time.monotonic() + 10
+        while self.widget.history_model.loading and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.01)
+        app.processEvents()
+
+    def test_window_is_truncated(self):
+        self.assertEqual(self.widget.history_model.rowCount(), HISTORY_WINDOW_ROWS)
+        self.assertIsNotNone(self.widget.history_model.since)
+
+    def test_student_filter_reads_older_and_archived_sessions(self):
+        self.widget.filter_student_checkbox.setChecked(True)
+        self.widget.filter_student_input.setText("1")
+        self.widget.apply_filter()
+        self.wait()
+        self.assertEqual(self.widget.history_filter_model.rowCount(),
+                         self.store.count_history(HistoryFilters(student_id="1")))
+        self.assertEqual(self.widget.history_filter_model.rowCount(), 3)
+
+    def test_pc_filter_reads_older_sessions(self):
+        self.widget.filter_pc_checkbox.setChecked(True)
+        self.widget.filter_pc_input.setText("PC1")
+        self.widget.apply_filter()
+        self.wait()
+        self.assertEqual(self.widget.history_filter_model.rowCount(), 3)
+
+        self.widget.filter_pc_checkbox.setChecked(False)
+        self.widget.apply_filter()
+        self.wait()
+        self.assertEqual(self.widget.history_filter_model.rowCount(), HISTORY_WINDOW_ROWS)
+
+
+if __name__ == "__main__":
+    unittest.main()
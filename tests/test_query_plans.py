@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import LibraryStore, check_query_plans, full_scan, local_epoch
+
+STUDENTS = 500
+PCS = 50
+SESSIONS_PER_DAY = 40
+OPEN_SESSIONS = 20
+
+
+class QueryPlanTest(unittest.TestCase):
+    # After a year of sessions no hot query may scan the whole students or reservations table
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        conn = self.store.conn
+        first_day = local_epoch(date.today() - timedelta(days=365))
+        with conn:
+            conn.executemany("INSERT INTO students VALUES (?, ?, 'CS', '555')",
+                             [(student_id, f"Student {student_id}") for student_id in range(1, STUDENTS + 1)])
+            conn.executemany("INSERT INTO computers (pc_id) VALUES (?)", [(f"PC{pc:03d}",) for pc in range(1, PCS + 1)])
+            sessions = []
+            for day in range(365):
+                for number in range(SESSIONS_PER_DAY):
+                    entry_time = first_day + day * 86400 + 9 * 3600 + number * 600
+                    sessions.append((number * 7 % STUDENTS + 1, f"PC{number % PCS + 1:03d}", entry_time, entry_time + 3600))
+            conn.executemany("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (?, ?, ?, ?)",
+                             sessions)
+            for number in range(OPEN_SESSIONS):
+                pc_id = f"PC{number + 1:03d}"
+                conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time) VALUES (?, ?, ?)",
+                             (number + 1, pc_id, int(time.time()) - number * 60))
+                conn.execute("UPDATE computers SET student_id = ?, status = 'Assigned' WHERE pc_id = ?",
+                             (number + 1, pc_id))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_no_full_scans_without_statistics(self):
+        self.assertEqual(check_query_plans(self.store.conn), {})
+
+    def test_no_full_scans_after_analyze(self):
+        self.store.conn.execute("ANALYZE")
+        self.assertEqual(check_query_plans(self.store.conn), {})
+
+
+class PlanFormatTest(unittest.TestCase):
+    # SQLite 3.36 dropped the TABLE keyword from scan lines; both forms must be recognised
+
+    def test_full_scans(self):
+        for detail in ("SCAN reservations", "SCAN TABLE reservations",
+                       "SCAN reservations USING INDEX idx_reservations_entry",
+                       "SCAN TABLE reservations USING COVERING INDEX idx_reservations_entry", "SCAN TABLE students"):
+            self.assertTrue(full_scan(detail), detail)
+
+    def test_not_full_scans(self):
+        for detail in ("SCAN reservations USING INDEX idx_reservations_open_entry",
+                       "SCAN TABLE reservations USING INDEX idx_reservations_open_entry",
+                       "SEARCH TABLE reservations USING INDEX idx_reservations_entry (entry_time>? AND entry_time<?)",
+                       "SEARCH reservations USING INDEX idx_reservations_student (student_id=?)",
+                       "SCAN TABLE computers", "SCAN computers", "USE TEMP B-TREE FOR ORDER BY"):
+            self.assertFalse(full_scan(detail), detail)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import LibraryStore, add_to_rollups, local_epoch, rebuild_rollups, refresh_hourly_occupancy
+
+ROLLUP_TABLES = ("daily_pc_usage", "daily_course_usage", "daily_student_usage", "hourly_occupancy")
+
+
+class RebuildRollupsTest(unittest.TestCase):
+    # The set-based rebuild gives the same rows as adding each session as it closes
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        self.store.add_student(1, "Ada", "CS", "555")
+        self.store.add_student(2, "Bob", None, "556")
+        self.store.add_pc("PC1")
+        self.store.add_pc("PC2")
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def rollups(self):
+        return {table: sorted(self.store.conn.execute(f"SELECT * FROM {table}")) for table in ROLLUP_TABLES}
+
+    def test_matches_incremental_rollups(self):
+        day = local_epoch(date.today() - timedelta(days=5))
+        sessions = [
+            (1, "CS", "PC1", day + 9 * 3600, day + 11 * 3600),
+            (2, None, "PC2", day + 10 * 3600, day + 10 * 3600 + 1800),
+            # Runs past two midnights
+            (1, "CS", "PC2", day + 22 * 3600, day + 2 * 86400 + 3600),
+        ]
+        conn = self.store.conn
+        with conn:
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            for student_id, course, pc_id, entry_time, exit_time in sessions:
+                conn.execute("INSERT INTO reservations (student_id, pc_id, entry_time, exit_time) VALUES (?, ?, ?, ?)",
+                             (student_id, pc_id, entry_time, exit_time))
+                add_to_rollups(conn, student_id, course, pc_id, entry_time, exit_time)
+                refresh_hourly_occupancy(conn, entry_time, exit_time)
+        expected = self.rollups()
+
+        with conn:
+            rebuild_rollups(conn)
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(len(expected["daily_pc_usage"]), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
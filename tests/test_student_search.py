@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_core import SEARCH_CANDIDATES, LibraryStore
+
+
+class StudentSearchTest(unittest.TestCase):
+    # Name matches rank ahead of the many students who share a course word
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self.directory.name, "library.db"))
+        with self.store.conn as conn:
+            conn.executemany("INSERT INTO students VALUES (?, 'Amit Gupta', 'FYBSC IT', ?)",
+                             [(student_id, f"98{student_id:08d}") for student_id in range(1, SEARCH_CANDIDATES * 2)])
+            conn.execute("INSERT INTO students VALUES (?, 'Itachi Uchiha', 'SYBA', '555')", (SEARCH_CANDIDATES * 2,))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_name_match_beats_course_matches(self):
+        matches = self.store.search_students("it")
+        self.assertEqual(matches[0].name, "Itachi Uchiha")
+        self.assertEqual(len(matches), 10)
+
+    def test_course_matches_without_a_name_match(self):
+        matches = self.store.search_students("fybsc")
+        self.assertEqual(len(matches), 10)
+        self.assertEqual({match.course for match in matches}, {"FYBSC IT"})
+
+    def test_exact_student_id_first(self):
+        matches = self.store.search_students(str(SEARCH_CANDIDATES * 2))
+        self.assertEqual(matches[0].name, "Itachi Uchiha")
+
+
+if __name__ == "__main__":
+    unittest.main()